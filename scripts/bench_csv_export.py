@@ -0,0 +1,66 @@
+"""
+Compare peak memory usage of in-memory and streaming CSV exports.
+
+Usage:
+    python scripts/bench_csv_export.py [max_rows]
+
+Rows are synthetic gradebook entries, so the benchmark does not require a
+database. The in-memory export mimics the old gradebook_csv() implementation
+(a list of rows written to a StringIO) and the streaming export consumes
+codeschool.utils.iter_csv() line by line, like a StreamingHttpResponse.
+"""
+
+import csv
+import io
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from codeschool.utils import iter_csv
+
+
+def rows(n):
+    for i in range(n):
+        yield ('user%06d' % i, 'User %d' % i, i % 100, (i * 7) % 100)
+
+
+def in_memory(n):
+    data = list(rows(n))
+    fd = io.StringIO()
+    writer = csv.writer(fd)
+    writer.writerow(('username', 'name', 'grade1', 'grade2'))
+    writer.writerows(data)
+    return len(fd.getvalue())
+
+
+def streaming(n):
+    size = 0
+    header = ('username', 'name', 'grade1', 'grade2')
+    for line in iter_csv(rows(n), header=header):
+        size += len(line)
+    return size
+
+
+def peak_memory(func, n):
+    tracemalloc.start()
+    func(n)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    max_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    n = 1000
+    print('%10s %16s %16s' % ('rows', 'in-memory (KiB)', 'streaming (KiB)'))
+    while n <= max_rows:
+        mem = peak_memory(in_memory, n) / 1024
+        stream = peak_memory(streaming, n) / 1024
+        print('%10d %16.1f %16.1f' % (n, mem, stream))
+        n *= 10
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark bulk course enrollment.
+
+Usage:
+    DJANGO_SETTINGS_MODULE=codeschool.settings \
+        python scripts/bench_enrollment.py [num_students]
+
+Requires a configured database with the courses and friends apps installed.
+All rows are created inside a transaction that is rolled back at the end.
+It reports the time and number of queries used by Course.enroll_students()
+to enroll all students (default: 1000) in a new course.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'codeschool.settings')
+
+import django
+
+django.setup()
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from codeschool.lms.courses.models import Course
+from codeschool.models import User
+from codeschool.social.friends.models import FriendshipStatus
+
+
+class Rollback(Exception):
+    pass
+
+
+def main():
+    num_students = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    try:
+        with transaction.atomic():
+            teacher = User.objects.create(username='bench-teacher')
+            User.objects.bulk_create(
+                User(username='bench-student-%d' % i)
+                for i in range(num_students)
+            )
+            students = list(User.objects
+                            .filter(username__startswith='bench-student-')
+                            .values_list('id', flat=True))
+            course = Course(title='Benchmark', teacher=teacher)
+            course.save()
+
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                course.enroll_students(students)
+                elapsed = time.perf_counter() - start
+
+            relations = FriendshipStatus.objects\
+                .filter(owner_id__in=students).count()
+            print('students:  %d' % num_students)
+            print('relations: %d' % relations)
+            print('queries:   %d' % len(queries))
+            print('time:      %.2fs' % elapsed)
+            raise Rollback
+    except Rollback:
+        pass
+
+
+if __name__ == '__main__':
+    main()
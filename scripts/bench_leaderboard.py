@@ -0,0 +1,92 @@
+"""
+Benchmark leaderboard computation with a large number of users.
+
+Usage:
+    DJANGO_SETTINGS_MODULE=codeschool.settings \
+        python scripts/bench_leaderboard.py [num_users]
+
+Requires a configured database with the gamification app installed. All rows
+are created inside a transaction that is rolled back at the end, so the
+database is left untouched.
+
+It compares the old approach (fetching all rows and summing in a Counter) with
+the aggregation done by the database in GivenXp.leaderboard() and
+GivenXp.rank_of().
+"""
+
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'codeschool.settings')
+
+import django
+
+django.setup()
+
+from django.db import transaction
+
+from codeschool.gamification.models import GivenXp
+from codeschool.models import User
+
+ENTRIES_PER_USER = 3
+
+
+class Rollback(Exception):
+    pass
+
+
+def timeit(name, func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    print('%-32s %8.3fs' % (name, best))
+
+
+def populate(num_users):
+    users = User.objects.bulk_create(
+        User(username='bench-user-%d' % i) for i in range(num_users)
+    )
+    if users[0].pk is None:
+        users = User.objects.filter(username__startswith='bench-user-')
+    GivenXp.objects.bulk_create(
+        GivenXp(user=user, points=random.randint(0, 100), token='bench',
+                index=idx)
+        for user in users
+        for idx in range(ENTRIES_PER_USER)
+    )
+    return users[len(users) // 2]
+
+
+def python_leaderboard():
+    counter = Counter()
+    for user, points in GivenXp.objects.values_list('user', 'points'):
+        counter[user] += points
+    return counter.most_common(10)
+
+
+def main():
+    num_users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    try:
+        with transaction.atomic():
+            print('creating %d users...' % num_users)
+            user = populate(num_users)
+            timeit('python counter (top 10)', python_leaderboard)
+            timeit('database (top 10)',
+                   lambda: GivenXp.leaderboard(10, force_refresh=True))
+            timeit('database (cached, top 10)',
+                   lambda: GivenXp.leaderboard(10))
+            timeit('rank_of(user)', lambda: GivenXp.rank_of(user))
+            raise Rollback
+    except Rollback:
+        pass
+
+
+if __name__ == '__main__':
+    main()
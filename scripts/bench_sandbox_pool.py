@@ -0,0 +1,76 @@
+"""
+Benchmark the execution of small python programs with and without the warm
+sandbox pool.
+
+Usage:
+    DJANGO_SETTINGS_MODULE=codeschool.settings \
+        python scripts/bench_sandbox_pool.py [num_programs] [--no-sandbox]
+
+Sandboxed execution requires the python_boxed executable. Pass --no-sandbox
+to compare both approaches with regular interpreters.
+"""
+
+import os
+import sys
+import time
+from concurrent import futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'codeschool.settings')
+
+import django
+
+django.setup()
+
+import ejudge
+
+from codeschool.questions.coding_io.sandbox_pool import SandboxPool
+
+SOURCE = 'name = input()\nprint("Hello %s!" % name)\n'
+INPUTS = [['World'], ['Codeschool'], ['John']]
+TIMEOUT = 5
+WORKERS = 4
+
+
+def run_ejudge(sandbox):
+    return ejudge.run(SOURCE, INPUTS, lang='python', timeout=TIMEOUT,
+                      sandbox=sandbox, raises=False)
+
+
+def run_pool(pool):
+    return pool.run(SOURCE, INPUTS, TIMEOUT)
+
+
+def timeit(name, func, num_programs):
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(WORKERS) as executor:
+        results = list(executor.map(lambda _: func(), range(num_programs)))
+    elapsed = time.perf_counter() - start
+    print('%-24s %8.3fs %8.2fms/program' %
+          (name, elapsed, 1000 * elapsed / num_programs))
+    return results
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    num_programs = int(args[0]) if args else 1000
+    sandbox = '--no-sandbox' not in sys.argv
+
+    print('running %d programs (sandbox=%s)...' % (num_programs, sandbox))
+    expected = timeit('ejudge.run()', lambda: run_ejudge(sandbox),
+                      num_programs)
+
+    pool = SandboxPool('python', size=WORKERS, sandbox=sandbox)
+    try:
+        results = timeit('warm sandbox pool', lambda: run_pool(pool),
+                         num_programs)
+    finally:
+        pool.close()
+
+    print('pool metrics: %s' % pool.metrics())
+    if [x.to_json() for x in results] != [x.to_json() for x in expected]:
+        print('WARNING: results differ!')
+
+
+if __name__ == '__main__':
+    main()
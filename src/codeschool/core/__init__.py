@@ -1,5 +1,7 @@
 from codeschool.core.config_dict import ConfigDict, DataDict
 
+default_app_config = 'codeschool.core.apps.CoreConfig'
+
 
 def get_sys_page(name):
     """
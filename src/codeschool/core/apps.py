@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete
 
 
 class CoreConfig(AppConfig):
-    name = 'core'
+    name = 'codeschool.core'
+
+    def ready(self):
+        from .models.fileformat import FileFormat, ProgrammingLanguage, \
+            update_language_registry, discard_from_language_registry
+
+        for model in [FileFormat, ProgrammingLanguage]:
+            post_save.connect(update_language_registry, sender=model)
+            post_delete.connect(discard_from_language_registry, sender=model)
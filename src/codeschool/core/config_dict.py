@@ -1,59 +1,127 @@
-import collections
+import threading
+import time
+import uuid
+from collections.abc import MutableMapping
 
+from django.core.cache import cache
+from django.core.signals import request_started
 
-class ConfigDict(collections.MutableMapping):
+
+class ConfigDict(MutableMapping):
     """
     A dictionary of options stored on the database.
 
     It accepts string keys and str, int and float values.
+
+    All options are loaded in a single query and kept in a process-local
+    dictionary. Each write stores a new version token in the shared cache.
+    Other processes compare this token with the version of their local copy
+    once per request (or every VERSION_CHECK_INTERVAL seconds outside of
+    requests) and reload all options if it has changed.
     """
 
     _key_value_pair_model = None
 
+    #: Maximum time (in seconds) between version checks outside of requests.
+    VERSION_CHECK_INTERVAL = 1.0
+
+    _instances = []
+
     def __init__(self):
-        self._cache = {}
+        self._cache = None
+        self._version = None
+        self._last_check = 0
+        self._lock = threading.Lock()
+        self._instances.append(self)
+
+    @property
+    def _version_key(self):
+        meta = self._key_value_pair_model._meta
+        return 'config-dict:%s.%s:version' % (meta.app_label, meta.model_name)
+
+    def _data(self):
+        """
+        Return the local dictionary of options, reloading it from the database
+        if it is outdated.
+        """
+
+        data = self._cache
+        if data is not None and \
+                time.time() - self._last_check < self.VERSION_CHECK_INTERVAL:
+            return data
+
+        version = cache.get(self._version_key)
+        if version is None:
+            cache.add(self._version_key, uuid.uuid4().hex, None)
+            version = cache.get(self._version_key)
+        self._last_check = time.time()
+        if data is not None and version == self._version:
+            return data
+
+        with self._lock:
+            options = self._key_value_pair_model.objects.all()
+            self._cache = data = {opt.name: opt.data for opt in options}
+            self._version = version
+        return data
+
+    def _invalidate(self):
+        # The local copy is not marked as current since other processes may
+        # have written before us: it is reloaded in the next access.
+        cache.set(self._version_key, uuid.uuid4().hex, None)
+        self._last_check = 0
+
+    def invalidate_local(self):
+        """
+        Force a version check in the next access.
+        """
+
+        self._last_check = 0
 
     def __delitem__(self, key):
-        try:
-            option = self._key_value_pair_model.objects.get(name=key)
-        except self._key_value_pair_model.DoesNotExist:
+        deleted, _ = self._key_value_pair_model.objects\
+            .filter(name=key)\
+            .delete()
+        if not deleted:
             raise KeyError(key)
-        option.delete()
-        self._cache.pop(key)
+        self._invalidate()
+        if self._cache is not None:
+            self._cache.pop(key, None)
 
     def __getitem__(self, key):
-        try:
-            return self._cache[key]
-        except KeyError:
-            try:
-                option = self._key_value_pair_model.objects.get(name=key)
-            except self._key_value_pair_model.DoesNotExist:
-                raise KeyError(key)
-            self._cache[key] = result = option.data
-            return result
+        return self._data()[key]
 
     def __setitem__(self, key, value):
-        data = self._key_value_pair_model.serialize(value)
-        data_type = self._key_value_pair_model.data_type(value)
-        try:
-            option = self._key_value_pair_model.objects.get(name=key)
-        except self._key_value_pair_model.DoesNotExist:
-            option = self._key_value_pair_model(name=key)
-        option.type = data_type
-        option.value = data
-        option.save()
-        self._cache[key] = value
+        self._key_value_pair_model.objects.update_or_create(
+            name=key,
+            defaults={
+                'type': self._key_value_pair_model.data_type(value),
+                'value': self._key_value_pair_model.serialize(value),
+            }
+        )
+        self._invalidate()
+        if self._cache is not None:
+            self._cache[key] = value
 
     def __iter__(self):
-        pairs = self._key_value_pair_model.objects
-        for option in pairs.values_list('name', flat=True):
-            yield option
+        return iter(list(self._data()))
 
     def __len__(self):
-        return self._key_value_pair_model.objects.count()
+        return len(self._data())
+
+    def __contains__(self, key):
+        return key in self._data()
 
 
 class DataDict(ConfigDict):
     """
     Same as ConfigDict, but uses a separate table.
     """
+
+
+def _check_versions_on_request(**kwargs):
+    for config_dict in ConfigDict._instances:
+        config_dict.invalidate_local()
+
+
+request_started.connect(_check_versions_on_request,
+                        dispatch_uid='config-dict-version-check')
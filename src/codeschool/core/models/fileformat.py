@@ -1,3 +1,7 @@
+import threading
+
+from django.db import transaction
+
 from codeschool import models
 
 
@@ -86,32 +90,22 @@ class ProgrammingLanguage(FileFormat):
         exception if the requested language does not exist.
         """
 
-        # We save ProgrammingLanguage instances in a cache for fast access.
-        # This way we avoid unnecessary trips to the db.
-        ref = FORMAT_ALIASES.get(ref, ref)
-        lang = PROGRAMMING_LANGUAGES_CACHE.get(ref, None)
+        # Languages are looked up in an in-memory registry. This way we avoid
+        # unnecessary trips to the db.
+        lang = language_registry.get(ref)
+        if lang is not None and lang.is_supported:
+            return lang
+        if raises:
+            raise cls.DoesNotExist('invalid language: %r' % ref)
         if lang is not None:
             return lang
-
-        # Language is not in cache. Fetch it and save it on second use.
-        try:
-            if isinstance(ref, int) or ref.isdigit():
-                ref = int(ref)
-                lang = cls.objects.get(pk=ref)
-            else:
-                lang = cls.objects.get(ref=ref)
-            PROGRAMMING_LANGUAGES_CACHE[ref] = lang
-            return lang
-        except cls.DoesNotExist:
-            if raises:
-                raise cls.DoesNotExist('invalid language: %r' % ref)
-            return cls.objects.create(
-                ref=ref,
-                name=ref.title(),
-                is_language=True,
-                is_supported=False,
-                comments='*automatically created*'
-            )
+        return cls.objects.create(
+            ref=ref,
+            name=ref.title(),
+            is_language=True,
+            is_supported=False,
+            comments='*automatically created*'
+        )
 
     @classmethod
     def get_or_create_language(cls, ref, name=None):
@@ -129,6 +123,118 @@ class ProgrammingLanguage(FileFormat):
         super().save(*args, **kwargs)
 
 
+class LanguageRegistry:
+    """
+    In-memory index of all programming languages by ref, pk and alias.
+
+    The registry is loaded with a single query on the first lookup and updated
+    by the post_save and post_delete signals of FileFormat. Languages created
+    by other processes are fetched from the database on the first lookup that
+    misses.
+
+    Languages are only cached outside atomic blocks and changes are registered
+    when the transaction commits, hence rolled back data never reaches the
+    registry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_ref = {}
+        self._by_pk = {}
+        self.is_loaded = False
+
+    def load(self):
+        """
+        Load all programming languages from the database.
+        """
+
+        languages = ProgrammingLanguage._base_manager.filter(is_language=True)
+        by_ref, by_pk = {}, {}
+        for lang in languages:
+            by_ref[lang.ref] = by_pk[lang.pk] = lang
+        with self._lock:
+            self._by_ref, self._by_pk = by_ref, by_pk
+            self.is_loaded = True
+
+    def clear(self):
+        """
+        Discard all languages. The registry is reloaded on the next lookup.
+        """
+
+        with self._lock:
+            self._by_ref, self._by_pk = {}, {}
+            self.is_loaded = False
+
+    def register(self, fmt):
+        """
+        Insert or update the given file format in the registry.
+        """
+
+        if not fmt.is_language:
+            return self.discard(fmt)
+        if not isinstance(fmt, ProgrammingLanguage):
+            fmt = ProgrammingLanguage(**{
+                field.attname: getattr(fmt, field.attname)
+                for field in fmt._meta.concrete_fields
+            })
+        with self._lock:
+            old = self._by_pk.get(fmt.pk)
+            if old is not None:
+                self._by_ref.pop(old.ref, None)
+            self._by_ref[fmt.ref] = self._by_pk[fmt.pk] = fmt
+
+    def discard(self, fmt):
+        """
+        Remove the given file format from the registry.
+        """
+
+        with self._lock:
+            old = self._by_pk.pop(fmt.pk, None)
+            if old is not None:
+                self._by_ref.pop(old.ref, None)
+
+    def get(self, ref):
+        """
+        Return the programming language with the given ref, alias or pk or
+        None if it does not exist.
+        """
+
+        can_cache = not _in_transaction()
+        if not self.is_loaded and can_cache:
+            self.load()
+
+        if isinstance(ref, int) or ref.isdigit():
+            lang = self._by_pk.get(int(ref))
+            lookup = {'pk': int(ref)}
+        else:
+            ref = FORMAT_ALIASES.get(ref, ref)
+            lang = self._by_ref.get(ref)
+            lookup = {'ref': ref}
+
+        if lang is None:
+            manager = ProgrammingLanguage._base_manager
+            lang = manager.filter(is_language=True, **lookup).first()
+            if lang is not None and can_cache:
+                self.register(lang)
+        return lang
+
+
+def _in_transaction():
+    return transaction.get_connection().in_atomic_block
+
+
+def update_language_registry(sender, instance, **kwargs):
+    # Lookups in the current transaction fall back to the database until the
+    # change is committed.
+    language_registry.discard(instance)
+    transaction.on_commit(lambda: language_registry.register(instance))
+
+
+def discard_from_language_registry(sender, instance, **kwargs):
+    language_registry.discard(instance)
+    transaction.on_commit(lambda: language_registry.discard(instance))
+
+
 #
 # These functions associate data with specific programming languages and their
 # default support in codeschool.
@@ -244,7 +350,7 @@ def init_format_aliases():
 
 
 # Compute format aliases
-PROGRAMMING_LANGUAGES_CACHE = {}
+language_registry = LanguageRegistry()
 FORMAT_ALIASES = {
     'python3': 'python',
     'py3': 'python',
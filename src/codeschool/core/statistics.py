@@ -81,3 +81,24 @@ class Statistics(Sequence):
             raise ValueError('empty data set has no median')
         else:
             return (sorted_data[n // 2] + sorted_data[n // 2 - 1]) / 2
+
+    def percentile(self, q, key=lambda x: x):
+        """
+        Return the q-th percentile (0 <= q <= 100) of the data set.
+
+        Values that fall between two data points are linearly interpolated.
+        """
+
+        if not 0 <= q <= 100:
+            raise ValueError('percentile must be in the [0, 100] range')
+
+        sorted_data = self.sorted(key)
+        n = len(sorted_data)
+        if n == 0:
+            raise ValueError('empty data set has no percentiles')
+
+        pos = (n - 1) * q / 100
+        lower = int(pos)
+        upper = min(lower + 1, n - 1)
+        delta = sorted_data[upper] - sorted_data[lower]
+        return sorted_data[lower] + delta * (pos - lower)
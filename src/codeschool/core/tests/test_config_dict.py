@@ -0,0 +1,24 @@
+from codeschool.core import ConfigDict
+
+
+def test_config_dict_reads_and_writes(db):
+    config = ConfigDict()
+    config['answer'] = 42
+    config['name'] = 'codeschool'
+    config['answer'] = 43
+    assert config['answer'] == 43
+    assert set(config) == {'answer', 'name'}
+    assert len(config) == 2
+
+    del config['name']
+    assert 'name' not in config
+
+
+def test_config_dict_sees_writes_from_other_processes(db):
+    config, other = ConfigDict(), ConfigDict()
+    config['option'] = 1
+    assert other['option'] == 1
+
+    config['option'] = 2
+    other.invalidate_local()
+    assert other['option'] == 2
@@ -1,7 +1,13 @@
+from unittest import mock
+
 import pytest
+from django.apps import apps
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 
 from codeschool.core import get_programming_language
-from codeschool.core.models import ProgrammingLanguage
+from codeschool.core.models import ProgrammingLanguage, fileformat
+from codeschool.core.models.fileformat import language_registry
 
 
 def test_get_language_support_most_common_languages(db):
@@ -27,3 +33,53 @@ def test_new_unsupported_language(db):
     assert lang.is_supported is False
     assert lang.is_language is True
     assert lang.is_binary is False
+
+
+def test_get_language_by_pk(db):
+    python = get_programming_language('python')
+    assert get_programming_language(python.pk) == python
+    assert get_programming_language(str(python.pk)) == python
+
+
+@pytest.fixture
+def registry(db):
+    language_registry.clear()
+    yield language_registry
+    language_registry.clear()
+
+
+@pytest.fixture
+def autocommit(registry):
+    # Tests run inside a transaction: we simulate autocommit mode
+    with mock.patch.object(fileformat, '_in_transaction', lambda: False), \
+            mock.patch.object(fileformat.transaction, 'on_commit',
+                              lambda func: func()):
+        yield
+
+
+def test_language_registry_is_loaded_lazily(registry):
+    apps.get_app_config('core').ready()
+    assert not registry.is_loaded
+
+
+def test_language_registry_is_updated_on_save(registry, autocommit):
+    python = get_programming_language('python')
+    assert registry.is_loaded
+
+    other = ProgrammingLanguage.objects.get(pk=python.pk)
+    other.name = 'Python 3.6'
+    other.save()
+    with CaptureQueriesContext(connection) as queries:
+        assert get_programming_language('python').name == 'Python 3.6'
+    assert len(queries) == 0
+
+
+def test_language_registry_ignores_rolled_back_changes(registry):
+    registry.load()
+    python = get_programming_language('python')
+    with pytest.raises(RuntimeError), transaction.atomic():
+        python.name = 'Python 3.6'
+        python.save()
+        assert get_programming_language('python').name == 'Python 3.6'
+        raise RuntimeError
+    assert get_programming_language('python').name == 'Python 3.5'
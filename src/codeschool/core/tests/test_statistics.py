@@ -0,0 +1,20 @@
+import pytest
+
+from codeschool.core.statistics import Statistics
+
+
+def test_percentile_extremes_are_min_and_max():
+    stats = Statistics('data', [3, 1, 2, 5, 4])
+    assert stats.percentile(0) == 1
+    assert stats.percentile(100) == 5
+    assert stats.percentile(50) == stats.median()
+
+
+def test_percentile_interpolates_between_points():
+    stats = Statistics('data', [1, 2])
+    assert stats.percentile(25) == 1.25
+
+
+def test_percentile_of_empty_data_set():
+    with pytest.raises(ValueError):
+        Statistics('data', []).percentile(50)
@@ -1,7 +1,9 @@
-from collections import Counter
-from time import time
+from collections import Counter, OrderedDict, defaultdict
 
+from annoying.functions import get_config
 from decimal import Decimal
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.utils.translation import ugettext_lazy as _
 from lazyutils import lazy, lazy_classattribute
 
@@ -52,7 +54,6 @@ class GivenXp(models.Model):
     token = models.CharField(max_length=100)
     index = models.IntegerField(blank=True, null=True)
     objects = GivenXpManager()
-    _leaderboard_expire_time = time() - 1  # begin at expired state
 
     @classmethod
     def total_score(cls, user):
@@ -60,28 +61,53 @@ class GivenXp(models.Model):
         The total Xp points associated to the given user.
         """
 
-        points = cls.objects.filter(user=user).values_list('points', flat=True)
-        return sum(points)
+        points = cls.objects\
+            .filter(user=user)\
+            .aggregate(total=models.Sum('points'))['total']
+        return points or 0
 
     @classmethod
-    def leaderboard(cls, force_refresh=False):
+    def leaderboard(cls, limit=None, force_refresh=False):
         """
         Construct the leaderboard from all GivenXp entries.
 
-        The leaderboard is cached and refreshed at most every 5min.
+        Return an OrderedDict mapping user ids to their total points, ordered
+        from the highest to the lowest score. If limit is given, return only the
+        first limit users.
+
+        The leaderboard is cached and refreshed at most every
+        CODESCHOOL_LEADERBOARD_TIMEOUT seconds.
         """
 
-        if force_refresh or time() <= cls._leaderboard_expire_time:
-            cls._leaderboard_cache = counter = Counter()
-            values = cls.objects\
-                .select_related('user')\
-                .values_list('user', 'points')
+        key = 'leaderboard:given-xp:%s' % limit
+        data = None if force_refresh else cache.get(key)
+        if data is None:
+            rows = cls.objects\
+                .values('user')\
+                .annotate(total=models.Sum('points'))\
+                .order_by('-total', 'user')\
+                .values_list('user', 'total')
+            if limit is not None:
+                rows = rows[:limit]
+            data = list(rows)
+            cache.set(key, data, leaderboard_timeout())
+        return OrderedDict(data)
+
+    @classmethod
+    def rank_of(cls, user):
+        """
+        Return the position of user in the leaderboard (starting from 1).
 
-            for user, points in values:
-                counter[user] += points
-            cls._leaderboard_expire_time = time() + 5 * 60
+        Users with the same score share the same position.
+        """
 
-        return cls._leaderboard_cache
+        total = cls.total_score(user)
+        better = cls.objects\
+            .values('user')\
+            .annotate(total=models.Sum('points'))\
+            .filter(total__gt=total)\
+            .count()
+        return better + 1
 
 
 class GlobalAchievement(models.Model):
@@ -125,32 +151,102 @@ class ScoreHandler(models.TimeStampedModel):
 
         raise NotImplementedError('must be implemented in subclasses')
 
+    def get_handler_filter(self):
+        """
+        Return a dictionary of lookups that select the handlers in the same
+        tree as the current one (e.g., handlers for the same user).
+        """
+
+        raise NotImplementedError('must be implemented in subclasses')
+
+    def get_ancestor_page_ids(self):
+        """
+        Return a list with the ids of all ancestor pages, including the
+        current one.
+
+        Ancestors are computed from wagtail's materialized path using a
+        single query.
+        """
+
+        path = self.page.path
+        steplen = models.Page.steplen
+        paths = [path[:size] for size in range(steplen, len(path) + 1, steplen)]
+        return list(models.Page.objects
+                    .filter(path__in=paths)
+                    .values_list('id', flat=True))
+
     def set_diff(self, points=0, stars=0, propagate=True, commit=True,
                  optimistic=False):
         """
         Change the given resources by the given amounts and propagate to all
         the parents.
+
+        Changes are applied with a single UPDATE query that increments the
+        values of the current handler and all of its ancestors. This is safe
+        under concurrent updates.
         """
 
         # Update fields
         kwargs = {}
         if points and (points > 0 or not optimistic):
-            self.points += points
             kwargs['points'] = points
         if stars and (stars > 0 or not optimistic):
-            self.stars += stars
             kwargs['stars'] = stars
 
-        if kwargs and commit:
-            self.save(update_fields=kwargs.keys())
+        if not kwargs:
+            return
+        if not commit:
+            for field, delta in kwargs.items():
+                setattr(self, field, getattr(self, field) + delta)
+            return
+
+        self._increment_handlers(kwargs, propagate)
+        self.refresh_from_db(fields=list(kwargs))
+
+    def _increment_handlers(self, deltas, propagate=True):
+        """
+        Increment the fields of the current handler (and its ancestors, if
+        propagate is True) by the given deltas in a single UPDATE query.
+        """
+
+        with transaction.atomic():
+            if self.pk is None:
+                self.save()
+
+            if propagate:
+                page_ids = self.get_ancestor_page_ids()
+                self._create_missing_handlers(page_ids)
+                handlers = self.__class__.objects.filter(
+                    page_id__in=page_ids, **self.get_handler_filter()
+                )
+            else:
+                handlers = self.__class__.objects.filter(pk=self.pk)
+
+            handlers.update(**{field: models.F(field) + delta
+                               for field, delta in deltas.items()})
 
-        # Propagate to all parent resources
-        if propagate and kwargs and commit:
-            parent = self.get_parent()
-            kwargs['commit'] = True
-            kwargs['propagate'] = True
-            if parent is not None:
-                parent.set_diff(optimistic=False, **kwargs)
+    def _create_missing_handlers(self, page_ids):
+        """
+        Create handler objects for all given pages that do not have one.
+        """
+
+        lookup = self.get_handler_filter()
+        existing = set(self.__class__.objects
+                       .filter(page_id__in=page_ids, **lookup)
+                       .values_list('page_id', flat=True))
+        missing = [self.__class__(page_id=page_id, **lookup)
+                   for page_id in page_ids if page_id not in existing]
+        if not missing:
+            return
+
+        try:
+            with transaction.atomic():
+                self.__class__.objects.bulk_create(missing)
+        except IntegrityError:
+            # Some handler was created concurrently
+            for handler in missing:
+                self.__class__.objects.get_or_create(page_id=handler.page_id,
+                                                     **lookup)
 
     def set_values(self, points=0, stars=0, propagate=True, optimistic=False,
                    commit=True):
@@ -218,6 +314,9 @@ class TotalScore(ScoreHandler):
         score = cls.load(page)
         score.set_values(**kwargs)
 
+    def get_handler_filter(self):
+        return {}
+
     def get_parent(self):
         parent_page = self.page.get_parent()
         if parent_page is None:
@@ -243,18 +342,38 @@ class TotalScore(ScoreHandler):
         """
         Recompute the totals for the given activity and all of its children.
 
+        Page contributions are loaded with one query per concrete
+        HasScorePage subclass and subtree sums are computed in memory. All
+        TotalScore objects in the subtree are written in bulk.
+
         Set commit=False to prevent modifying the database.
         """
 
-        initial = self.contribution()
-        totals = [c.recompute_total(commit) for c in self.get_children()]
-        result = sum(totals, initial)
+        root = self.page
+        pages = dict(models.Page.objects
+                     .filter(path__startswith=root.path)
+                     .values_list('path', 'id'))
+
+        # Contributions of each page in the subtree
+        totals = {}
+        for model in _score_page_models():
+            rows = model.objects\
+                .filter(path__startswith=root.path)\
+                .values_list('path', 'points_total', 'stars_total')
+            for path, points, stars in rows:
+                totals[path] = (points or 0, Decimal(stars or 0))
+
+        totals = _subtree_sums(totals, pages, root.path)
+        result = Counter(dict(zip(['points', 'stars'],
+                                  totals.get(root.path, (0, Decimal(0))))))
         if commit:
-            fields = []
-            for k, v in result.items():
-                fields.append(k)
-                setattr(self, k, v)
-            self.save(update_fields=fields)
+            values = {pages[path]: value for path, value in totals.items()}
+            existing = self.__class__.objects\
+                .filter(page_id__in=list(pages.values()))\
+                .values_list('id', 'page_id', 'points', 'stars')
+            _write_score_rows(self.__class__, existing, values,
+                              lambda page_id: {'page_id': page_id})
+            self.points, self.stars = result['points'], result['stars']
         return result
 
 
@@ -314,23 +433,111 @@ class UserScore(ScoreHandler):
         return cls.objects.get_or_create(user=user, page=cls._wagtail_root)[0]
 
     @classmethod
-    def leaderboard(cls, page):
+    def leaderboard(cls, page, limit=None, force_refresh=False):
+        """
+        Return a (points, stars) pair of OrderedDict objects mapping user ids
+        to their respective resources in the given page.
+
+        Both dictionaries are ordered from the highest to the lowest points.
+        If limit is given, return only the first limit users. Results are
+        cached for CODESCHOOL_LEADERBOARD_TIMEOUT seconds.
+        """
+
+        key = 'leaderboard:user-score:%s:%s' % (page.pk, limit)
+        data = None if force_refresh else cache.get(key)
+        if data is None:
+            rows = cls.objects\
+                .filter(page=page)\
+                .values('user')\
+                .annotate(total_points=models.Sum('points'),
+                          total_stars=models.Sum('stars'))\
+                .order_by('-total_points', 'user')\
+                .values_list('user', 'total_points', 'total_stars')
+            if limit is not None:
+                rows = rows[:limit]
+            data = list(rows)
+            cache.set(key, data, leaderboard_timeout())
+
+        points_map, stars_map = OrderedDict(), OrderedDict()
+        for user, points, stars in data:
+            points_map[user] = points
+            stars_map[user] = stars
+        return points_map, stars_map
+
+    @classmethod
+    def rank_of(cls, user, page, resource='points'):
         """
-        Return a (points_counter, starts_counter) pair of Counter() objects
-        representing a leaderboard for the given page.
+        Return the position of user in the leaderboard of the given page
+        (starting from 1).
+
+        Resource can be either 'points' or 'stars'. Users with the same score
+        share the same position.
         """
 
-        stars_counter, points_counter = Counter(), Counter()
-        values = cls.objects\
-            .filter(page=page)\
-            .select_related('user')\
-            .values_list('user', 'stars', 'points')
+        if resource not in ('points', 'stars'):
+            raise ValueError('invalid resource: %r' % resource)
+
+        value = cls.objects\
+            .filter(user=user, page=page)\
+            .values_list(resource, flat=True)\
+            .first()
+        better = cls.objects\
+            .filter(page=page, **{resource + '__gt': value or 0})\
+            .count()
+        return better + 1
 
-        for user, stars, points in values:
-            points_counter[user] += points
-            stars_counter[user] += stars
+    @classmethod
+    def rebuild(cls, users=None, root=None):
+        """
+        Recompute all UserScore objects under the given root page from the
+        points and stars registered in the users' Progress objects.
+
+        Args:
+            users:
+                A queryset or sequence of users. Rebuild scores for all users
+                if not given.
+            root:
+                Root page (e.g., a course). Defaults to wagtail's root page.
+                Scores of pages above the root are not modified.
+        """
+
+        from codeschool.lms.activities.models import Progress
+
+        root = root or cls._wagtail_root
+        pages = dict(models.Page.objects
+                     .filter(path__startswith=root.path)
+                     .values_list('path', 'id'))
+        progress = Progress.objects\
+            .filter(activity_page__path__startswith=root.path)
+        existing = cls.objects.filter(page_id__in=list(pages.values()))
+        if users is not None:
+            progress = progress.filter(user__in=users)
+            existing = existing.filter(user__in=users)
+
+        contributions = defaultdict(dict)
+        rows = progress\
+            .values_list('user_id', 'activity_page__path', 'points', 'stars')\
+            .iterator()
+        for user_id, path, points, stars in rows:
+            contributions[user_id][path] = (points, Decimal(str(stars)))
+
+        values = {}
+        for user_id, user_values in contributions.items():
+            totals = _subtree_sums(user_values, pages, root.path)
+            for path, value in totals.items():
+                values[user_id, pages[path]] = value
+
+        existing = (
+            (id, (user_id, page_id), points, stars)
+            for id, user_id, page_id, points, stars in existing
+            .values_list('id', 'user_id', 'page_id', 'points', 'stars')
+            .iterator()
+        )
+        _write_score_rows(cls, existing, values,
+                          lambda key: {'user_id': key[0], 'page_id': key[1]})
 
-        return points_counter, stars_counter
+    def get_handler_filter(self):
+        return {'user_id': self.user_id}
 
     def get_parent(self):
         parent_page = self.page.get_parent()
@@ -345,6 +552,98 @@ class UserScore(ScoreHandler):
         return [self.load(self.user, page) for page in children_pages]
 
 
+def leaderboard_timeout():
+    """
+    Expiration time (in seconds) of cached leaderboards.
+    """
+
+    return get_config('CODESCHOOL_LEADERBOARD_TIMEOUT', 5 * 60)
+
+
+def _score_page_models():
+    """
+    Return a list of all concrete HasScorePage subclasses.
+    """
+
+    from django.apps import apps
+
+    return [model for model in apps.get_models()
+            if issubclass(model, HasScorePage)]
+
+
+def _subtree_sums(values, pages, root_path):
+    """
+    Compute subtree sums from a mapping of page paths to (points, stars)
+    tuples.
+
+    Each value is added to the page itself and to all of its ancestors up to
+    the page at root_path. Return a new mapping with the sums for each page
+    that has a non-null contribution in its subtree. Pages not in the given
+    set of paths are ignored.
+    """
+
+    steplen = models.Page.steplen
+    totals = {}
+    for path, (points, stars) in values.items():
+        for size in range(len(root_path), len(path) + 1, steplen):
+            prefix = path[:size]
+            if prefix in pages:
+                total_points, total_stars = totals.get(prefix, (0, Decimal(0)))
+                totals[prefix] = (total_points + points, total_stars + stars)
+    return totals
+
+
+def _write_score_rows(model, existing, values, make_lookup, chunk_size=500):
+    """
+    Write score values in bulk.
+
+    Args:
+        model:
+            TotalScore or UserScore.
+        existing:
+            A sequence of (id, key, points, stars) tuples with the current
+            rows.
+        values:
+            A mapping from keys to the new (points, stars) values.
+        make_lookup:
+            A function that receives a key and return the keyword arguments
+            used to create a new row.
+    """
+
+    # Update rows whose values changed. Django does not provide a bulk update
+    # method, so we use a CASE expression on each chunk.
+    changed = []
+    seen = set()
+    for id, key, points, stars in existing:
+        seen.add(key)
+        new = values.get(key, (0, Decimal(0)))
+        if (points, stars) != new:
+            changed.append((id, new))
+
+    with transaction.atomic():
+        for i in range(0, len(changed), chunk_size):
+            chunk = changed[i:i + chunk_size]
+            model.objects.filter(id__in=[id for id, _ in chunk]).update(
+                points=models.Case(
+                    *[models.When(id=id, then=models.Value(points))
+                      for id, (points, _) in chunk],
+                    output_field=models.IntegerField()
+                ),
+                stars=models.Case(
+                    *[models.When(id=id, then=models.Value(stars))
+                      for id, (_, stars) in chunk],
+                    output_field=models.DecimalField(max_digits=5,
+                                                     decimal_places=1)
+                ),
+            )
+
+        model.objects.bulk_create(
+            model(points=points, stars=stars, **make_lookup(key))
+            for key, (points, stars) in values.items()
+            if key not in seen and (points or stars)
+        )
+
+
 class HasScorePage(models.Page):
     """
     Mixin abstract page class for Page elements that implement the Score API.
@@ -0,0 +1,209 @@
+import pytest
+from django.apps import apps
+
+from codeschool import models
+from codeschool.accounts.factories import UserFactory
+from codeschool.core import get_wagtail_root
+
+pytestmark = pytest.mark.skipif(
+    not apps.is_installed('codeschool.gamification'),
+    reason='gamification app is not enabled',
+)
+
+
+@pytest.fixture
+def users(db):
+    return UserFactory.create_batch(3)
+
+
+@pytest.fixture
+def page(db):
+    return get_wagtail_root().add_child(instance=models.Page(title='Course'))
+
+
+def test_given_xp_leaderboard_is_ordered(users):
+    from codeschool.gamification.models import GivenXp
+
+    u1, u2, u3 = users
+    for user, points in [(u1, 10), (u2, 30), (u3, 20), (u1, 5)]:
+        GivenXp.objects.create(user=user, points=points, token='test',
+                               index=points)
+
+    board = GivenXp.leaderboard(force_refresh=True)
+    assert list(board.items()) == [(u2.id, 30), (u3.id, 20), (u1.id, 15)]
+    assert list(GivenXp.leaderboard(limit=2, force_refresh=True)) == \
+        [u2.id, u3.id]
+    assert GivenXp.rank_of(u3) == 2
+
+
+def test_user_score_leaderboard_is_ordered(users, page):
+    from codeschool.gamification.models import UserScore
+
+    u1, u2, u3 = users
+    for user, points in [(u1, 10), (u2, 30), (u3, 20)]:
+        UserScore.objects.create(user=user, page=page, points=points,
+                                 stars=points / 10)
+
+    points, stars = UserScore.leaderboard(page, force_refresh=True)
+    assert list(points.items()) == [(u2.id, 30), (u3.id, 20), (u1.id, 10)]
+    assert list(stars) == [u2.id, u3.id, u1.id]
+    assert UserScore.rank_of(u1, page) == 3
+
+
+@pytest.fixture
+def section(page):
+    return page.add_child(instance=models.Page(title='Section'))
+
+
+def test_set_diff_propagates_to_ancestors(users, page, section):
+    from codeschool.gamification.models import UserScore
+
+    user = users[0]
+    UserScore.load(user, section).set_diff(points=5, stars=1)
+    assert UserScore.load(user, section).points == 5
+    assert UserScore.load(user, page).points == 5
+    assert UserScore.total_score(user).points == 5
+
+
+def test_set_diff_does_not_lose_concurrent_updates(users, page, section):
+    from codeschool.gamification.models import UserScore
+
+    user = users[0]
+    first = UserScore.load(user, section)
+    second = UserScore.objects.get(pk=first.pk)
+    first.set_diff(points=5)
+    second.set_diff(points=3)
+    assert second.points == 8
+    assert UserScore.load(user, page).points == 8
+
+
+def test_set_diff_without_propagation(users, page, section):
+    from codeschool.gamification.models import UserScore
+
+    user = users[0]
+    UserScore.load(user, section).set_diff(points=5, propagate=False)
+    assert UserScore.load(user, section).points == 5
+    assert UserScore.load(user, page).points == 0
+
+
+@pytest.fixture
+def page_tree(page, section):
+    lesson = section.add_child(instance=models.Page(title='Lesson'))
+    exercise = section.add_child(instance=models.Page(title='Exercise'))
+    exam = page.add_child(instance=models.Page(title='Exam'))
+    return [page, section, lesson, exercise, exam]
+
+
+def user_score_rows(root, **kwargs):
+    from codeschool.gamification.models import UserScore
+
+    return {
+        (user_id, page_id): (points, stars)
+        for user_id, page_id, points, stars in UserScore.objects
+        .filter(page__path__startswith=root.path, **kwargs)
+        .values_list('user_id', 'page_id', 'points', 'stars')
+    }
+
+
+def test_user_score_rebuild_matches_per_row_updates(users, page_tree):
+    from codeschool.gamification.models import UserScore
+    from codeschool.lms.activities.models import Progress
+
+    page, section, lesson, exercise, exam = page_tree
+    u1, u2, u3 = users
+    for user, activity, points, stars in [(u1, lesson, 10, 1.5),
+                                          (u1, exercise, 20, 0.5),
+                                          (u1, exam, 30, 0),
+                                          (u2, exercise, 5, 1),
+                                          (u3, section, 7, 0.5)]:
+        Progress.objects.create(user=user, activity_page=activity,
+                                points=points, stars=stars)
+        UserScore.load(user, activity).set_diff(points=points, stars=stars)
+    expected = user_score_rows(page)
+    above_root = UserScore.total_score(u1).points
+
+    # Corrupt existing scores and remove some rows
+    UserScore.objects.filter(page__path__startswith=page.path)\
+        .update(points=999, stars=9)
+    UserScore.objects.filter(page=section).delete()
+    UserScore.rebuild(root=page)
+
+    assert user_score_rows(page) == expected
+    assert expected[u1.id, section.id] == (30, 2)
+    assert expected[u1.id, page.id] == (60, 2)
+    assert UserScore.total_score(u1).points == above_root
+
+
+def test_user_score_rebuild_only_touches_given_users(users, page_tree):
+    from codeschool.gamification.models import UserScore
+    from codeschool.lms.activities.models import Progress
+
+    page, section, lesson, *_ = page_tree
+    u1, u2, u3 = users
+    for user in [u1, u2]:
+        Progress.objects.create(user=user, activity_page=lesson, points=10)
+    UserScore.objects.create(user=u2, page=lesson, points=999)
+    UserScore.rebuild(users=[u1], root=page)
+
+    assert user_score_rows(page, user=u1) == {
+        (u1.id, p.id): (10, 0) for p in [page, section, lesson]
+    }
+    assert user_score_rows(page, user=u2) == {(u2.id, lesson.id): (999, 0)}
+
+
+class ScorePages:
+    """
+    Stand-in for the manager of a concrete HasScorePage subclass.
+    """
+
+    def __init__(self, contributions):
+        self.contributions = contributions
+        self.prefix = ''
+
+    def filter(self, path__startswith):
+        self.prefix = path__startswith
+        return self
+
+    def values_list(self, *fields):
+        return [(p.path, points, stars)
+                for p, (points, stars) in self.contributions.items()
+                if p.path.startswith(self.prefix)]
+
+
+def test_total_score_recompute_total_matches_per_page_sums(page_tree,
+                                                           monkeypatch):
+    from codeschool.gamification.models import TotalScore
+    from codeschool.gamification.models import score
+
+    page, section, lesson, exercise, exam = page_tree
+    contributions = {lesson: (10, 1), exercise: (20, 2), exam: (30, 0),
+                     section: (5, 0)}
+    model = type('ScorePage', (), {'objects': ScorePages(contributions)})
+    monkeypatch.setattr(score, '_score_page_models', lambda: [model])
+    TotalScore.objects.create(page=exercise, points=999)
+    TotalScore.objects.create(page=lesson, points=999)
+    contributions[lesson] = (0, 0)
+
+    # Expected totals, computed page by page
+    expected = {}
+    for tree_page in page_tree:
+        points = stars = 0
+        for other, (p, s) in contributions.items():
+            if other.path.startswith(tree_page.path):
+                points, stars = points + p, stars + s
+        if points or stars:
+            expected[tree_page.id] = (points, stars)
+
+    total = TotalScore.load(page)
+    assert total.recompute_total(commit=False) == {'points': 55, 'stars': 2}
+    assert TotalScore.objects.get(page=exercise).points == 999
+
+    assert total.recompute_total() == {'points': 55, 'stars': 2}
+    rows = TotalScore.objects\
+        .filter(page__path__startswith=page.path)\
+        .exclude(points=0, stars=0)\
+        .values_list('page_id', 'points', 'stars')
+    assert {page_id: (points, stars) for page_id, points, stars in rows} \
+        == expected
+    assert TotalScore.objects.get(page=lesson).points == 0
+    assert (total.points, total.stars) == (55, 2)
@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class ActivitiesConfig(AppConfig):
     name = 'codeschool.lms.activities'
+
+    def ready(self):
+        # Importing score_board registers its signal handlers
+        from . import score_board  # noqa: F401
+
+        # Importing rules registers the permissions of activity pages
+        from . import rules  # noqa: F401
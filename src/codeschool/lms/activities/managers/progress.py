@@ -1,7 +1,7 @@
-import csv
-import io
+from itertools import groupby
 
 from codeschool import models
+from codeschool.utils import iter_csv
 
 
 class ProgressQuerySet(models.PolymorphicQuerySet):
@@ -70,6 +70,19 @@ class ProgressQuerySet(models.PolymorphicQuerySet):
                     ...
                 ]
         """
+        return list(self.iter_gradebook(activity,
+                                        fields=fields,
+                                        user_fields=user_fields,
+                                        order_by=order_by))
+
+    def iter_gradebook(self, activity=None, *,
+                       fields=('final_grade_pc',),
+                       user_fields=('username',), order_by=None):
+        """
+        Like :meth:`gradebook`, but return an iterator that fetches rows from
+        the database in chunks.
+        """
+
         if not user_fields:
             raise ValueError('must provide at least one user field.')
         if order_by is None:
@@ -77,11 +90,10 @@ class ProgressQuerySet(models.PolymorphicQuerySet):
 
         fields = ['user__' + f for f in user_fields] + list(fields)
         activity = self._get_activity(activity)
-        return list(
-            self.filter(activity_page=activity)
-                .order_by(order_by)
-                .values_list(*fields)
-        )
+        return self.filter(activity_page=activity)\
+            .order_by(order_by)\
+            .values_list(*fields)\
+            .iterator()
 
     def gradebook_csv(self, activity=None, *,
                       header=True, dialect='excel',
@@ -101,19 +113,66 @@ class ProgressQuerySet(models.PolymorphicQuerySet):
             A string of CSV data.
         """
 
-        rows = self.gradebook(activity,
-                              fields=fields,
-                              user_fields=user_fields,
-                              order_by=order_by)
+        return ''.join(self.iter_gradebook_csv(activity,
+                                               header=header,
+                                               dialect=dialect,
+                                               fields=fields,
+                                               user_fields=user_fields,
+                                               order_by=order_by))
+
+    def iter_gradebook_csv(self, activity=None, *,
+                           header=True, dialect='excel',
+                           fields=('final_grade_pc',),
+                           user_fields=('username',), order_by=None):
+        """
+        Like :meth:`gradebook_csv`, but return an iterator over CSV lines.
+
+        This is useful to stream large gradebooks with a
+        StreamingHttpResponse.
+        """
+
+        rows = self.iter_gradebook(activity,
+                                   fields=fields,
+                                   user_fields=user_fields,
+                                   order_by=order_by)
+        header = tuple(user_fields) + tuple(fields) if header else None
+        return iter_csv(rows, header=header, dialect=dialect)
+
+    def iter_wide_gradebook(self, activities, *,
+                            field='final_grade_pc',
+                            user_fields=('username',), default=None):
+        """
+        Iterate over a "wide format" gradebook with one row per user and one
+        column per activity.
+
+        Args:
+            activities:
+                A sequence of activity pages. Each activity corresponds to a
+                column in the given order.
+            field:
+                Name of the Progress field displayed in each cell.
+            user_fields:
+                Fields extracted from the user object. They are displayed in
+                the first columns of each row.
+            default:
+                Value used when the user has no progress in some activity.
+
+        Returns:
+            An iterator over tuples of the form::
+
+                (username, grade_activity_0, grade_activity_1, ...)
+        """
 
-        # Write CSV data on a StringIO file and fetch its value
-        F = io.StringIO()
-        writer = csv.writer(F, dialect=dialect)
+        if not user_fields:
+            raise ValueError('must provide at least one user field.')
 
-        if header:
-            writer.writerow(tuple(user_fields) + tuple(fields))
-        writer.writerows(rows)
-        return F.getvalue()
+        columns = {page.id: idx for idx, page in enumerate(activities)}
+        user_fields = ['user__' + f for f in user_fields]
+        rows = self.filter(activity_page_id__in=columns)\
+            .order_by(user_fields[0], 'user_id')\
+            .values_list('user_id', 'activity_page_id', field, *user_fields)\
+            .iterator()
+        return _iter_wide_rows(rows, columns, default)
 
     def users(self, activity=None):
         """
@@ -127,5 +186,14 @@ class ProgressQuerySet(models.PolymorphicQuerySet):
         return models.User.objects.in_bulk(user_ids)
 
 
+def _iter_wide_rows(rows, columns, default):
+    # Rows of each user are consecutive: we keep only one user in memory
+    for _, user_rows in groupby(rows, key=lambda row: row[0]):
+        grades = [default] * len(columns)
+        for row in user_rows:
+            grades[columns[row[1]]] = row[2]
+        yield tuple(row[3:]) + tuple(grades)
+
+
 ProgressManager = \
     models.PolymorphicManager.from_queryset(ProgressQuerySet, 'ProgressManager')
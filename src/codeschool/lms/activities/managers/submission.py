@@ -1,11 +1,22 @@
+from django.db import connections
+from django.db.models.functions import Coalesce
+
 from codeschool import models
 
 
 class SubmissionQuerySet(models.PolymorphicQuerySet):
     _default_lexicographical_priority = (
-        'given_grade', 'score', 'stars', 'final_grade'
+        'given_grade', 'final_grade'
     )
 
+    #: Maps priority attributes to the corresponding database lookups.
+    _priority_lookups = {
+        'given_grade': 'feedback__given_grade_pc',
+        'final_grade': 'feedback__final_grade_pc',
+        'given_grade_pc': 'feedback__given_grade_pc',
+        'final_grade_pc': 'feedback__final_grade_pc',
+    }
+
     def lexicographical_priority(self, value=None):
         """
         Normalize list of priorities.
@@ -15,7 +26,28 @@ class SubmissionQuerySet(models.PolymorphicQuerySet):
         elif value is None:
             return self._default_lexicographical_priority
         else:
-            return iter(value)
+            return tuple(value)
+
+    def order_by_priority(self, attrs=None, *fields):
+        """
+        Order submissions from best to worst according to the given
+        lexicographical priority. Extra fields are placed before the priority
+        in the ordering.
+
+        Ties are broken by creation date: the most recent submission wins.
+        """
+
+        # Priorities are passed as annotations since polymorphic querysets
+        # only accept field names in order_by()
+        annotations = {}
+        ordering = list(fields)
+        for idx, attr in enumerate(self.lexicographical_priority(attrs)):
+            name = 'priority_%s' % idx
+            lookup = self._priority_lookups.get(attr, attr)
+            annotations[name] = Coalesce(lookup, models.Value(0))
+            ordering.append('-' + name)
+        ordering.append('-created')
+        return self.annotate(**annotations).order_by(*ordering)
 
     def for_activity(self, activity):
         """
@@ -31,6 +63,13 @@ class SubmissionQuerySet(models.PolymorphicQuerySet):
 
         return self.filter(progress__user=user)
 
+    def graded(self):
+        """
+        Filter submissions that already have a feedback.
+        """
+
+        return self.filter(feedback__isnull=False)
+
     def best(self, attrs=None, activity=None):
         """
         Return the best submission in the queryset.
@@ -41,22 +80,10 @@ class SubmissionQuerySet(models.PolymorphicQuerySet):
         Users may mass a different list of parameters to be compared.
         """
 
-        attrs = self.lexicographical_priority(attrs)
+        qs = self
         if activity is not None:
-            qs = self.for_activity(activity)
-        if qs.empty():
-            return None
-
-        # Filter by regular attributes: higher values are better
-        for attr in attrs:
-            qs = qs.order_by('-' + attr)
-            best_value = getattr(qs.first(), attr)
-            qs = qs.filter(**{attr: best_value})
-            if qs.count() == 1:
-                return qs.first()
-
-        # Filter by creation date
-        return qs.order_by('created').last()
+            qs = qs.for_activity(activity)
+        return qs.graded().order_by_priority(attrs).first()
 
     def best_for_user(self, user, attrs=None, activity=None):
         """
@@ -65,10 +92,37 @@ class SubmissionQuerySet(models.PolymorphicQuerySet):
         Return None if no submission is found.
         """
 
-        try:
-            return self.filter(user=user).best(attrs, activity=activity)
-        except models.User.DoesNotExist:
-            return None
+        return self.for_user(user).best(attrs, activity=activity)
+
+    def best_ids(self, attrs=None, activity=None):
+        """
+        Return a map from progress ids to the id of the best submission of
+        each progress object.
+
+        This is computed by a single query. Databases that support DISTINCT ON
+        select the best submissions directly. Other databases stream the
+        (progress, id) pairs sorted by priority and take the first of each
+        progress.
+        """
+
+        qs = self.graded()
+        if activity is not None:
+            qs = qs.for_activity(activity)
+        qs = qs.order_by_priority(attrs, 'progress')
+
+        if connections[qs.db].features.can_distinct_on_fields:
+            rows = qs\
+                .distinct('progress')\
+                .values_list('progress', 'id')
+            return dict(rows)
+
+        rows = qs\
+            .values_list('progress', 'id')\
+            .iterator()
+        best = {}
+        for progress_id, id in rows:
+            best.setdefault(progress_id, id)
+        return best
 
     def best_for_users(self, attrs=None, activity=None):
         """
@@ -77,28 +131,24 @@ class SubmissionQuerySet(models.PolymorphicQuerySet):
         Only consider submission that were graded.
         """
 
-        best_mapping = {}
-        attrs = self.lexicographical_priority(attrs)
-        qs = self.order_by('created')
+        qs = self
         if activity is not None:
             qs = qs.for_activity(activity)
 
-        for submission in qs:
-            user = submission.user
-            try:
-                best = best_mapping[user]
-            except KeyError:
-                best_mapping[user] = submission
-            else:
-                for attr in attrs:
-                    curr_value = getattr(submission, attr)
-                    best_value = getattr(best, attr)
-                    if curr_value < best_value:
-                        break
-                else:
-                    best_mapping[user] = submission
-
-        return best_mapping
+        # The best submission for the default priority is maintained in the
+        # progress object. Progress objects whose pointer was not set yet
+        # (e.g., created before the pointer existed) are computed in SQL.
+        if attrs is None:
+            missing = qs.filter(progress__best_submission__isnull=True)
+            qs = qs.filter(
+                models.Q(progress__best_submission=models.F('id')) |
+                models.Q(id__in=list(missing.best_ids().values()))
+            )
+        else:
+            qs = qs.filter(id__in=list(qs.best_ids(attrs).values()))
+
+        qs = qs.select_related('progress__user')
+        return {submission.progress.user: submission for submission in qs}
 
     def has_correct(self):
         """
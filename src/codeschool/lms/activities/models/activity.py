@@ -1,7 +1,9 @@
 import decimal
 import logging
 
-from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.exceptions import ImproperlyConfigured, ValidationError, \
+    PermissionDenied
+from django.http import StreamingHttpResponse
 from django.utils.translation import ugettext_lazy as _
 
 from codeschool import models
@@ -163,6 +165,20 @@ class Activity(models.ExtRoutablePage, metaclass=ActivityMeta):
         progress = self.progress_set.for_user(user)
         return progress.submit(request, **kwargs)
 
+    @models.route(r'^gradebook[\.]csv/$')
+    def serve_gradebook_csv(self, request):
+        """
+        Stream a CSV file with the final grade of each student.
+        """
+
+        if not self.rules.test(request.user, 'activities.inspect_activity'):
+            raise PermissionDenied
+        rows = self.progress_set.iter_gradebook_csv(self)
+        response = StreamingHttpResponse(rows, content_type='text/csv')
+        response['Content-Disposition'] = \
+            'attachment; filename="%s.csv"' % self.slug
+        return response
+
     def nav_sections(self, request):
         """
         Return a list of navigation sections for the given request.
@@ -1,12 +1,17 @@
 import model_reference
 import srvice
+from django.core.exceptions import PermissionDenied
 from django.db import transaction
-from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
 from django.utils.translation import ugettext_lazy as _
 
 from codeschool import mixins
 from codeschool import models, panels
-from ..types.score_map import ScoreTable, ScoreMap
+from codeschool.types.rules import Rules
+from codeschool.utils import streaming_csv_response
+from ..score_board import score_board as cached_score_board, \
+    iter_score_board_rows
+from ..types.score_map import ScoreMap
 
 
 class ScoreBoardMixin(models.RoutablePageMixin,
@@ -18,21 +23,19 @@ class ScoreBoardMixin(models.RoutablePageMixin,
     class Meta:
         abstract = True
 
+    rules = Rules()
+
     def score_board(self, info=None):
         """
         Return a ScoreTable object with the grades of all students from the
         sub-page activities.
-        """
 
-        info = info or 'points'
-        if info not in ['points', 'grade', 'stars', 'score']:
-            raise ValueError('invalid info: %r' % info)
+        Each column corresponds to a child page and contains the sum of grades
+        in all activities under it. Results are cached and invalidated when a
+        new feedback is given to one of these activities.
+        """
 
-        board = ScoreTable(name=self.title)
-        for page in self.get_children():
-            col = page.specific.score_board(info=info)
-            board.add_column(col)
-        return board
+        return cached_score_board(self, info or 'points')
 
     @srvice.route(r'^score-board/$')
     def serve_score_board(self, client):
@@ -43,10 +46,37 @@ class ScoreBoardMixin(models.RoutablePageMixin,
 
     @models.route(r'^score-board[\.]csv/$')
     def serve_score_board_csv(self, request):
-        board = self.score_board()
-        board.sort()
-        board.add_total('total', method='sum')
-        return HttpResponse(board.to_csv())
+        """
+        Stream the score board as a CSV file.
+        """
+
+        if not self.rules.test(request.user, 'activities.inspect_activity'):
+            raise PermissionDenied
+        try:
+            rows = iter_score_board_rows(self,
+                                         request.GET.get('info', 'points'))
+        except ValueError as ex:
+            return HttpResponseBadRequest(str(ex))
+        return streaming_csv_response(rows, filename='score-board.csv')
+
+    @models.route(r'^gradebook[\.]csv/$')
+    def serve_gradebook_csv(self, request):
+        """
+        Stream a CSV file with one row per student and one column per
+        activity under the current page.
+        """
+
+        from .activity import Activity
+        from .progress import Progress
+
+        if not self.rules.test(request.user, 'activities.inspect_activity'):
+            raise PermissionDenied
+        activities = [page for page in self.get_descendants().specific()
+                      if isinstance(page, Activity)]
+        header = ['user'] + [page.title for page in activities]
+        rows = Progress.objects.iter_wide_gradebook(activities)
+        return streaming_csv_response(rows, filename='gradebook.csv',
+                                      header=header)
 
 
 class ActivityListQuerySet(models.PageQuerySet):
@@ -158,13 +188,6 @@ class ActivityList(ScoreBoardMixin,
         if self.get_children().filter(slug=name).count() == 0:
             ActivitySection.from_template(name, self)
 
-    def score_board(self, info=None):
-        board = ScoreTable(name=self.title)
-        for page in self.get_children():
-            col = page.specific.score_board_total()
-            board.add_column(col)
-        return board
-
     # Serving pages
     template = 'lms/activities/list.jinja2'
 
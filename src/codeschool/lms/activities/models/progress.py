@@ -110,18 +110,17 @@ class Progress(models.CopyMixin,
             submission.save()
             return submission
 
-        # Collect all submissions with the same hash as current one
+        # Recycle the first submission with the same hash. This is a single
+        # indexed lookup on (progress, hash).
+        submission.hash = submission.compute_hash()
         recyclable = submission_class.objects\
-            .filter(progress=self, hash=submission.compute_hash()) \
-            .order_by('created')
-
-        # Then check if any submission is actually equal to the current amongst
-        # all candidates
-        for possibly_equal in recyclable:
-            if submission.is_equal(possibly_equal):
-                possibly_equal.recycled = True
-                possibly_equal.bump_recycles()
-                return possibly_equal
+            .filter(progress=self, hash=submission.hash)\
+            .order_by('created')\
+            .first()
+        if recyclable is not None:
+            recyclable.recycled = True
+            recyclable.bump_recycles()
+            return recyclable
         else:
             submission.save()
             return submission
@@ -174,8 +173,37 @@ class Progress(models.CopyMixin,
 
         # Update the is_correct field
         self.is_correct = self.is_correct or feedback.is_correct
+        self.update_best_submission(feedback)
         self.save()
 
+    def update_best_submission(self, feedback, commit=False):
+        """
+        Point best_submission to the submission of the given feedback if it is
+        at least as good as the current best submission.
+
+        Submissions are compared using the default lexicographical priority
+        of SubmissionQuerySet.
+        """
+
+        from codeschool.lms.activities.models import Feedback
+
+        def key(given, final):
+            return given or 0, final or 0
+
+        if self.best_submission_id is not None and \
+                self.best_submission_id != feedback.submission_id:
+            current = Feedback.objects\
+                .filter(submission_id=self.best_submission_id)\
+                .values_list('given_grade_pc', 'final_grade_pc')\
+                .first()
+            new = key(feedback.given_grade_pc, feedback.final_grade_pc)
+            if current is not None and key(*current) > new:
+                return
+
+        self.best_submission_id = feedback.submission_id
+        if commit:
+            self.save(update_fields=['best_submission'])
+
     def update_from_submissions(self, grades=True, score=True, commit=True,
                                 refresh=False):
         """
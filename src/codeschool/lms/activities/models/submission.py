@@ -27,6 +27,7 @@ class Submission(HasProgressMixin,
     class Meta:
         verbose_name = _('submission')
         verbose_name_plural = _('submissions')
+        index_together = [('progress', 'hash')]
 
     progress = models.ForeignKey('Progress', related_name='submissions')
     hash = models.CharField(max_length=32, blank=True)
@@ -111,8 +112,10 @@ class Submission(HasProgressMixin,
         Increase the recycle count by one.
         """
 
+        type(self).objects\
+            .filter(pk=self.pk)\
+            .update(num_recycles=models.F('num_recycles') + 1)
         self.num_recycles += 1
-        self.save(update_fields=['num_recycles'])
 
     def is_equal(self, other):
         """
@@ -27,3 +27,9 @@ def is_activity_inspector(user, activity):
 rules.add_perm('activities.edit_activity', is_activity_editor)
 rules.add_perm('activities.inspect_activity', is_activity_inspector)
 rules.add_perm('activities.view_submission_stats', is_activity_inspector)
+
+# Rules tested by the "rules" attribute of activity pages (see
+# codeschool.types.rules.Rules)
+rules.add_rule('activities.edit_activity', is_activity_editor)
+rules.add_rule('activities.inspect_activity', is_activity_inspector)
+rules.add_rule('activities.view_submission_stats', is_activity_inspector)
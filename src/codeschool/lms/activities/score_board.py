@@ -0,0 +1,160 @@
+"""
+Cached score boards for pages that group activities (e.g., ActivityList and
+ActivitySection).
+
+A score board has one row per user and one column per child page. The value
+of each cell is the sum of the given info (points, grade, stars or score) of
+all Progress objects in the child page subtree. The whole board is computed by
+a single grouped query and cached until some activity under the page receives
+a new feedback.
+"""
+from itertools import groupby
+
+from django.core.cache import cache
+from django.db.models import Sum
+from django.db.models.functions import Substr
+from django.dispatch import receiver
+
+from codeschool.lms.activities.signals import submission_graded_signal
+from codeschool.lms.activities.types.score_map import ScoreMap, ScoreTable
+
+#: Maps score board info to the corresponding Progress field.
+INFO_FIELDS = {
+    'points': 'points',
+    'grade': 'final_grade_pc',
+    'stars': 'stars',
+    'score': 'score',
+}
+
+#: Expiration time (in seconds) of cached score boards.
+CACHE_TIMEOUT = 60 * 60
+
+
+def _cache_key(path, info):
+    return 'score-board:%s:%s' % (path, info)
+
+
+def score_board(page, info='points'):
+    """
+    Return a ScoreTable with the grades of all students from the sub-page
+    activities of the given page.
+    """
+
+    if info not in INFO_FIELDS:
+        raise ValueError('invalid info: %r' % info)
+
+    key = _cache_key(page.path, info)
+    board = cache.get(key)
+    if board is None:
+        board = compute_score_board(page, info)
+        cache.set(key, board, CACHE_TIMEOUT)
+    return board
+
+
+def compute_score_board(page, info='points'):
+    """
+    Compute score board without using the cache.
+    """
+
+    from codeschool.lms.activities.models import Progress
+    from codeschool.models import User
+
+    field = INFO_FIELDS[info]
+    children = list(page.get_children().values_list('path', 'title'))
+    prefix_size = len(page.path) + page.steplen
+
+    # Sum all progress values grouped by user and by the child page that
+    # contains the activity
+    rows = Progress.objects\
+        .filter(activity_page__path__startswith=page.path,
+                activity_page__depth__gt=page.depth)\
+        .annotate(child_path=Substr('activity_page__path', 1, prefix_size))\
+        .values('user', 'child_path')\
+        .annotate(value=Sum(field))\
+        .order_by()
+
+    columns = {path: {} for path, _ in children}
+    for row in rows:
+        columns[row['child_path']][row['user']] = row['value'] or 0
+
+    user_ids = set()
+    for col in columns.values():
+        user_ids.update(col)
+    users = User.objects.in_bulk(user_ids)
+
+    board = ScoreTable(name=page.title)
+    for path, title in children:
+        col = ScoreMap(title, {users[id]: value
+                               for id, value in columns[path].items()})
+        board.add_column(col)
+    return board
+
+
+def iter_score_board_rows(page, info='points', total=True):
+    """
+    Iterate over the rows of the score board of the given page without
+    building the full table in memory.
+
+    The first row is a header with the column titles. Each following row has
+    the username, the value for each child page and (optionally) the total.
+
+    Arguments are validated before iteration starts, hence an invalid info
+    raises ValueError immediately.
+    """
+
+    if info not in INFO_FIELDS:
+        raise ValueError('invalid info: %r' % info)
+    return _iter_score_board_rows(page, INFO_FIELDS[info], total)
+
+
+def _iter_score_board_rows(page, field, total):
+    from codeschool.lms.activities.models import Progress
+
+    children = list(page.get_children().values_list('path', 'title'))
+    columns = {path: idx for idx, (path, _) in enumerate(children)}
+    prefix_size = len(page.path) + page.steplen
+
+    header = ['user'] + [title for _, title in children]
+    if total:
+        header.append('total')
+    yield header
+
+    rows = Progress.objects\
+        .filter(activity_page__path__startswith=page.path,
+                activity_page__depth__gt=page.depth)\
+        .annotate(child_path=Substr('activity_page__path', 1, prefix_size))\
+        .values('user__username', 'child_path')\
+        .annotate(value=Sum(field))\
+        .order_by('user__username', 'child_path')\
+        .iterator()
+
+    for username, user_rows in groupby(rows, lambda x: x['user__username']):
+        values = [0] * len(children)
+        for row in user_rows:
+            values[columns[row['child_path']]] = row['value'] or 0
+        if total:
+            values.append(sum(values))
+        yield [username] + values
+
+
+def invalidate_score_boards(page_path):
+    """
+    Discard all cached score boards that include the page with the given path.
+    """
+
+    from wagtail.wagtailcore.models import Page
+
+    steplen = Page.steplen
+    keys = [_cache_key(page_path[:size], info)
+            for size in range(steplen, len(page_path) + 1, steplen)
+            for info in INFO_FIELDS]
+    cache.delete_many(keys)
+
+
+@receiver(submission_graded_signal)
+def invalidate_score_boards_on_feedback(submission, **kwargs):
+    """
+    Invalidate score boards of all pages above the graded activity.
+    """
+
+    invalidate_score_boards(submission.progress.activity_page.path)
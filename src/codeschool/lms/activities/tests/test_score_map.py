@@ -1,3 +1,5 @@
+from unittest import mock
+
 import pytest
 
 from codeschool.lms.activities.types.score_map import \
@@ -94,3 +96,98 @@ def test_score_table_columns(score_map, score_map2, score_table):
     assert str(c1) == str(score_map)
     assert c1 == score_map
     assert c2 == score_map2
+
+
+# Score boards
+@pytest.fixture
+def board_page(db, user):
+    from wagtail.wagtailcore.models import Page
+    from codeschool import get_wagtail_root
+    from codeschool.lms.activities.models import Progress
+
+    root = get_wagtail_root().add_child(instance=Page(title='Board'))
+    for idx, points in enumerate([10, 20]):
+        section = root.add_child(instance=Page(title='Section %s' % idx))
+        for _ in range(2):
+            activity = section.add_child(instance=Page(title='Activity'))
+            Progress.objects.create(user=user, activity_page=activity,
+                                    points=points)
+    return root
+
+
+def test_score_board_sums_values_of_each_child_page(board_page, user):
+    from codeschool.lms.activities.score_board import compute_score_board
+
+    board = compute_score_board(board_page)
+    col1, col2 = board.iter_columns()
+    assert col1[user] == 20
+    assert col2[user] == 40
+
+
+def test_score_board_rows(board_page, user):
+    from codeschool.lms.activities.score_board import iter_score_board_rows
+
+    assert list(iter_score_board_rows(board_page)) == [
+        ['user', 'Section 0', 'Section 1', 'total'],
+        [user.username, 20, 40, 60],
+    ]
+
+
+def test_score_board_rows_validate_info_before_iteration(board_page):
+    from codeschool.lms.activities.score_board import iter_score_board_rows
+
+    with pytest.raises(ValueError):
+        iter_score_board_rows(board_page, 'invalid')
+
+
+def test_score_board_is_invalidated_by_feedback(board_page, user):
+    from codeschool.lms.activities.models import Progress
+    from codeschool.lms.activities.score_board import score_board
+    from codeschool.lms.activities.signals import submission_graded_signal
+
+    assert list(score_board(board_page).iter_columns())[0][user] == 20
+    progress = Progress.objects.filter(user=user).first()
+    Progress.objects.filter(id=progress.id).update(points=15)
+    assert list(score_board(board_page).iter_columns())[0][user] == 20
+
+    submission = mock.Mock(progress=progress)
+    submission_graded_signal.send(None, submission=submission, feedback=None,
+                                  automatic=True)
+    assert list(score_board(board_page).iter_columns())[0][user] == 25
+
+
+# CSV exports
+@pytest.fixture
+def section_page(db):
+    from codeschool import get_wagtail_root
+    from codeschool.accounts.factories import UserFactory
+    from codeschool.lms.activities.models import ActivitySection
+
+    section = ActivitySection(title='Section', owner=UserFactory.create())
+    return get_wagtail_root().add_child(instance=section)
+
+
+def csv_request(rf, user, **params):
+    request = rf.get('/', params)
+    request.user = user
+    return request
+
+
+def test_csv_exports_require_inspect_permission(rf, section_page):
+    from django.core.exceptions import PermissionDenied
+    from codeschool.accounts.factories import UserFactory
+
+    staff = UserFactory.create(is_staff=True)
+    for view in [section_page.serve_score_board_csv,
+                 section_page.serve_gradebook_csv]:
+        with pytest.raises(PermissionDenied):
+            view(csv_request(rf, staff))
+        response = view(csv_request(rf, section_page.owner))
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'text/csv'
+
+
+def test_score_board_csv_rejects_invalid_info(rf, section_page):
+    request = csv_request(rf, section_page.owner, info='invalid')
+    response = section_page.serve_score_board_csv(request)
+    assert response.status_code == 400
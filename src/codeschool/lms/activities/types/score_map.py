@@ -305,15 +305,20 @@ def score_board(activity, users=None, info=None):
             The information used to construct the score board.
     """
 
+    from codeschool.lms.activities.score_board import INFO_FIELDS
+    from codeschool.models import User
+
     info = info or 'points'
-    if info not in ['points', 'grade', 'stars', 'score']:
+    if info not in INFO_FIELDS:
         raise ValueError('invalid info: %r' % info)
 
-    if users is None:
-        users = activity.users()
+    progress_list = activity.progress_set.all()
+    if users is not None:
+        progress_list = progress_list.filter(user__in=users)
+    values = dict(progress_list.values_list('user_id', INFO_FIELDS[info]))
+    users = User.objects.in_bulk(values)
 
     board = ScoreMap(activity.title)
-    for user in users:
-        response = activity.responses.response_for_user(user)
-        board[user] = getattr(response, info)
-    return board
\ No newline at end of file
+    for user_id, value in values.items():
+        board[users[user_id]] = value
+    return board
@@ -0,0 +1,326 @@
+"""
+Fast attendance check-in.
+
+When a teacher opens an attendance event, the whole class checks in within a
+minute or so. The check-in path avoids the database as much as possible:
+
+1. The passphrase and expiration time of the active event of each sheet are
+   kept in the shared cache (see :func:`publish_event`).
+2. The number of attempts and the attendance status of each user are cache
+   counters. Passphrases are validated against the cached event and users are
+   rate limited by a cache counter.
+3. Users that checked in are collected in a per-process buffer that is sent in
+   batches to a celery job that writes the corresponding AttendanceCheck rows
+   (see :func:`flush`). The job reads the current state of each user from the
+   cache, so the order in which batches are written does not matter. Buffers
+   are flushed when they are full, CODESCHOOL_CHECKIN_FLUSH_INTERVAL seconds
+   after the first buffered check-in or when the process exits.
+
+Sheets that belong to a course only accept check-ins from enrolled students.
+Enrollment is checked against the cached role index of the course.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from annoying.functions import get_config
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger('codeschool.lms.attendance')
+
+#: Extra time (in seconds) that check-in records are kept in cache after the
+#: event expires. Records must live long enough to be flushed to the database.
+RECORD_TIMEOUT = 60 * 60
+
+#: Length (in seconds) of the rate limiting window.
+RATE_LIMIT_WINDOW = 10
+
+# Possible results of a check-in attempt
+OK = 'ok'
+WRONG_PASSPHRASE = 'wrong-passphrase'
+NO_EVENT = 'no-event'
+EXPIRED = 'expired'
+TOO_MANY_ATTEMPTS = 'too-many-attempts'
+RATE_LIMITED = 'rate-limited'
+NOT_ENROLLED = 'not-enrolled'
+
+
+def batch_size():
+    """
+    Maximum number of check-ins accumulated before writing to the database.
+    """
+
+    return int(get_config('CODESCHOOL_CHECKIN_BATCH_SIZE', 50))
+
+
+def flush_interval():
+    """
+    Maximum time (in seconds) that a check-in waits in the buffer.
+    """
+
+    return float(get_config('CODESCHOOL_CHECKIN_FLUSH_INTERVAL', 5.0))
+
+
+def rate_limit():
+    """
+    Maximum number of check-in requests per user in a RATE_LIMIT_WINDOW.
+    """
+
+    return int(get_config('CODESCHOOL_CHECKIN_RATE_LIMIT', 5))
+
+
+#
+# Cache records
+#
+def _event_key(sheet_id):
+    return 'attendance-checkin:sheet:%s' % sheet_id
+
+
+def _attempts_key(event_id, user_id):
+    return 'attendance-checkin:attempts:%s:%s' % (event_id, user_id)
+
+
+def _attended_key(event_id, user_id):
+    return 'attendance-checkin:attended:%s:%s' % (event_id, user_id)
+
+
+def _rate_key(user_id):
+    window = int(time.time() // RATE_LIMIT_WINDOW)
+    return 'attendance-checkin:rate:%s:%s' % (user_id, window)
+
+
+def _incr(key, timeout):
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Key expired between add() and incr()
+        cache.set(key, 1, timeout)
+        return 1
+
+
+def publish_event(event):
+    """
+    Store the passphrase and expiration time of the given event in cache so
+    check-ins can be validated without touching the database.
+    """
+
+    sheet = event.sheet
+    record = {
+        'event': event.id,
+        'passphrase': event.passphrase,
+        'expires': event.expires.timestamp(),
+        'max_attempts': sheet.max_attempts,
+        'max_string_distance': sheet.max_string_distance,
+        'course': sheet.course_id,
+    }
+    timeout = max(int(record['expires'] - time.time()), 0) + RECORD_TIMEOUT
+    cache.set(_event_key(sheet.id), record, timeout)
+    return record
+
+
+def get_active_event(sheet_id):
+    """
+    Return the cached record for the last event of the given sheet or None if
+    sheet has no events.
+    """
+
+    record = cache.get(_event_key(sheet_id))
+    if record is None:
+        from .models import Event
+
+        event = Event.objects\
+            .filter(sheet_id=sheet_id)\
+            .select_related('sheet')\
+            .order_by('-created')\
+            .first()
+        if event is None:
+            return None
+        record = publish_event(event)
+    return record
+
+
+def get_attempts(event_id, user_id):
+    """
+    Return the number of attempts registered in cache for the given user or
+    None if there is no record.
+    """
+
+    return cache.get(_attempts_key(event_id, user_id))
+
+
+def check_in(sheet_id, user_id, passphrase):
+    """
+    Try to confirm the attendance of the given user in the active event of the
+    given sheet.
+
+    Return one of the result constants OK, WRONG_PASSPHRASE, NO_EVENT, EXPIRED,
+    TOO_MANY_ATTEMPTS, RATE_LIMITED or NOT_ENROLLED.
+    """
+
+    from .models import string_distance
+
+    if _incr(_rate_key(user_id), RATE_LIMIT_WINDOW) > rate_limit():
+        return RATE_LIMITED
+
+    record = get_active_event(sheet_id)
+    error = _event_error(record, user_id)
+    if error is not None:
+        return error
+
+    event_id = record['event']
+    attended_key = _attended_key(event_id, user_id)
+    if cache.get(attended_key):
+        return OK
+
+    timeout = int(record['expires'] - time.time()) + RECORD_TIMEOUT
+    attempts = _incr(_attempts_key(event_id, user_id), timeout)
+    if attempts > record['max_attempts']:
+        return TOO_MANY_ATTEMPTS
+
+    distance = string_distance(passphrase, record['passphrase'])
+    attended = distance <= record['max_string_distance']
+    if attended:
+        cache.set(attended_key, True, timeout)
+    _buffer.add(event_id, user_id)
+    return OK if attended else WRONG_PASSPHRASE
+
+
+def _event_error(record, user_id):
+    # Return the result of check-ins that are rejected before the passphrase
+    # is checked or None if the event accepts check-ins from user.
+    if record is None:
+        return NO_EVENT
+    if record['expires'] < time.time():
+        return EXPIRED
+    if not is_enrolled(record.get('course'), user_id):
+        return NOT_ENROLLED
+    return None
+
+
+def is_enrolled(course_id, user_id):
+    """
+    Return True if the given user is a student of the given course.
+
+    Sheets without a course (course_id=None) accept any user.
+    """
+
+    if course_id is None:
+        return True
+
+    from codeschool.lms.courses.models import Course
+
+    course = Course(pk=course_id)
+    index = course.get_role_index()
+    if index is not None:
+        return user_id in index['students']
+    return course.students.filter(id=user_id).exists()
+
+
+#
+# Batch writes
+#
+class CheckinBuffer:
+    """
+    Thread-safe buffer of (event_id, user_id) pairs waiting to be written to
+    the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, event_id, user_id):
+        with self._lock:
+            self._pending.add((event_id, user_id))
+            is_full = len(self._pending) >= batch_size()
+            if self._timer is None and not is_full:
+                # Flush buffers that do not fill up in time
+                self._timer = threading.Timer(flush_interval(), self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if is_full:
+            self.flush()
+
+    def flush(self):
+        """
+        Send all pending check-ins to the database writer job.
+        """
+
+        with self._lock:
+            pending, self._pending = self._pending, set()
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        if pending:
+            from .tasks import write_checkins
+
+            write_checkins.delay(sorted(pending))
+
+
+_buffer = CheckinBuffer()
+atexit.register(_buffer.flush)
+
+
+def flush():
+    """
+    Send all check-ins buffered in the current process to the database.
+    """
+
+    _buffer.flush()
+
+
+def write_checkins(pairs):
+    """
+    Create or update the AttendanceCheck rows of the given (event_id, user_id)
+    pairs from the state stored in cache.
+    """
+
+    from .models import AttendanceCheck
+
+    pairs = [tuple(pair) for pair in pairs]
+    keys = {}
+    for event_id, user_id in pairs:
+        keys[event_id, user_id] = (_attempts_key(event_id, user_id),
+                                   _attended_key(event_id, user_id))
+    values = cache.get_many([key for pair in keys.values() for key in pair])
+
+    with transaction.atomic():
+        for event_id in {event_id for event_id, _ in pairs}:
+            user_ids = [user_id for (ev, user_id) in pairs if ev == event_id]
+            existing = dict(
+                AttendanceCheck.objects
+                .filter(event_id=event_id, user_id__in=user_ids)
+                .values_list('user_id', 'id')
+            )
+            new = []
+            updates = defaultdict(list)
+            for user_id in user_ids:
+                attempts_key, attended_key = keys[event_id, user_id]
+                attempts = values.get(attempts_key)
+                if attempts is None:
+                    # Record expired: nothing reliable to write.
+                    continue
+                attended = bool(values.get(attended_key))
+                if user_id in existing:
+                    updates[attempts, attended].append(existing[user_id])
+                else:
+                    new.append(AttendanceCheck(event_id=event_id,
+                                               user_id=user_id,
+                                               attempts=attempts,
+                                               has_attended=attended))
+
+            # Checks with the same state are updated together
+            for (attempts, attended), ids in updates.items():
+                AttendanceCheck.objects\
+                    .filter(id__in=ids)\
+                    .update(attempts=attempts, has_attended=attended)
+            AttendanceCheck.objects.bulk_create(new)
+    logger.debug('%s attendance check-ins written' % len(pairs))
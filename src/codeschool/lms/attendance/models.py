@@ -4,10 +4,13 @@ import datetime
 from random import choice
 
 import editdistance as editdistance
+from django.db import transaction
 from django.template.loader import render_to_string
 from django.utils.timezone import now
 
 from codeschool import models
+from codeschool.utils import iter_csv
+from . import checkin
 
 
 class AttendanceSheet(models.Model):
@@ -23,6 +26,8 @@ class AttendanceSheet(models.Model):
     last_event = models.ForeignKey('Event', blank=True, null=True)
     max_string_distance = models.SmallIntegerField(default=0)
     max_number_of_absence = models.IntegerField(blank=True, null=True)
+    course = models.ForeignKey('courses.Course', blank=True, null=True,
+                               related_name='attendance_sheets')
 
     @property
     def expiration_interval(self):
@@ -46,6 +51,7 @@ class AttendanceSheet(models.Model):
         )
         self.last_event = new
         self.save(update_fields=['last_event'])
+        transaction.on_commit(lambda: checkin.publish_event(new))
         return new
 
     def get_today_event(self):
@@ -58,6 +64,21 @@ class AttendanceSheet(models.Model):
         else:
             return self.new_event()
 
+    def participants(self):
+        """
+        Return a queryset with the users that should attend the events of the
+        sheet.
+
+        These are the students of the course, if the sheet belongs to a
+        course, or the users that checked in some event of the sheet.
+        """
+
+        if self.course_id is not None:
+            return self.course.students.all()
+        return models.User.objects\
+            .filter(attendancecheck__event__sheet=self)\
+            .distinct()
+
     def number_of_absences(self, user):
         """
         Return the total number of absence for user.
@@ -72,31 +93,122 @@ class AttendanceSheet(models.Model):
 
         Args:
             users:
-                A queryset of users.
+                A queryset of users. Defaults to the sheet participants (see
+                :meth:`participants`).
             method:
                 One of 'fraction' (default), 'number', 'attendance' or 
                 'attendance-fraction'
         """
 
-        try:
-            get_value_from_absence = {
-                'fraction': lambda x: x / num_events,
-                'number': lambda x: x,
-                'attendance': lambda x: num_events - x,
-                'attendance-fraction': lambda x: (num_events - x) / num_events
-            }[method]
-        except KeyError:
-            raise ValueError('invalid method: %r' % method)
+        num_events = self.events.count()
+        get_value_from_absence = _absence_method(method, num_events)
+        absences = self._absences(users, num_events)
+        return collections.OrderedDict(
+            (user, get_value_from_absence(absence))
+            for user, absence in absences.items()
+        )
+
+    def absence_summary(self, users=None):
+        """
+        Return a mapping between users and a dictionary with the values
+        computed by all absence_table() methods.
+
+        All values are computed from a single grouped query.
+        """
 
         num_events = self.events.count()
+        methods = {name: _absence_method(name, num_events)
+                   for name in ABSENCE_METHODS}
+        absences = self._absences(users, num_events)
+        return collections.OrderedDict(
+            (user, {name: func(absence) for name, func in methods.items()})
+            for user, absence in absences.items()
+        )
+
+    def _absences(self, users, num_events):
+        # Map users to their number of absences
+        users = self._annotate_attended(users)
+        return collections.OrderedDict(
+            (user, num_events - user.num_attended) for user in users
+        )
+
+    def _annotate_attended(self, users=None):
+        # Annotate the number of events of the sheet attended by each user
+        if users is None:
+            users = self.participants()
+        attended = models.Count(models.Case(
+            models.When(attendancecheck__event__sheet=self,
+                        attendancecheck__has_attended=True,
+                        then='attendancecheck__event'),
+        ), distinct=True)
+        return users.annotate(num_attended=attended)
+
+    def attendance_matrix(self, users=None):
+        """
+        Return a (users, events, matrix) tuple in which matrix is a boolean
+        NumPy array of shape (len(users), len(events)) that tells if each user
+        has attended each event.
+
+        Users and events are lists of ids in the same order of matrix rows and
+        columns. Events are sorted by creation time. This method requires
+        NumPy.
+        """
+
+        import numpy as np
+
         if users is None:
-            users = models.User.objects.all()
+            users = self.participants()
+        user_ids = list(users.values_list('id', flat=True))
+        event_ids = list(self.events
+                         .order_by('created')
+                         .values_list('id', flat=True))
+        user_index = {id: i for i, id in enumerate(user_ids)}
+        event_index = {id: j for j, id in enumerate(event_ids)}
+
+        matrix = np.zeros((len(user_ids), len(event_ids)), dtype=bool)
+        checks = self.attendance_checks\
+            .filter(has_attended=True, user__in=users)\
+            .values_list('user_id', 'event_id')\
+            .iterator()
+        rows, cols = [], []
+        for user_id, event_id in checks:
+            rows.append(user_index[user_id])
+            cols.append(event_index[event_id])
+        matrix[rows, cols] = True
+        return user_ids, event_ids, matrix
+
+    def iter_absence_table(self, users=None, method='fraction',
+                           user_fields=('username',)):
+        """
+        Iterate over (user_field, ..., value) tuples with the absence value of
+        each user computed using the given method (see :meth:`absence_table`).
+
+        Users are streamed from the database and the number of attended
+        events is computed by the database, hence memory use does not grow
+        with the number of users.
+        """
+
+        num_events = self.events.count()
+        get_value_from_absence = _absence_method(method, num_events)
+        rows = self._annotate_attended(users)\
+            .order_by(*user_fields)\
+            .values_list('num_attended', *user_fields)\
+            .iterator()
+
+        return (
+            tuple(fields) + (get_value_from_absence(num_events - attended),)
+            for attended, *fields in rows
+        )
+
+    def absence_table_csv(self, users=None, method='fraction',
+                          user_fields=('username',)):
+        """
+        Return an iterator over the CSV lines of the absence table.
+        """
 
-        result = collections.OrderedDict()
-        for user in users:
-            absence = self.user_absence(user)
-            result[user] = get_value_from_absence(absence)
-        return result
+        rows = self.iter_absence_table(users, method, user_fields)
+        header = tuple(user_fields) + (method,)
+        return iter_csv(rows, header=header)
 
     def render_dialog(self, request):
         """
@@ -124,6 +236,9 @@ class AttendanceSheet(models.Model):
         if self.last_event is None:
             return 0
 
+        attempts = checkin.get_attempts(self.last_event_id, user.id)
+        if attempts is not None:
+            return attempts
         qs = self.attendance_checks.filter(user=user, event=self.last_event)
         return qs.count()
 
@@ -173,6 +288,7 @@ class Event(models.Model):
         self.passphrase = new_random_passphrase()
         self.expires += self.sheet.expiration_interval
         self.save()
+        transaction.on_commit(lambda: checkin.publish_event(self))
 
 
 class AttendanceCheck(models.Model):
@@ -200,6 +316,34 @@ class AttendanceCheck(models.Model):
         self.save()
 
 
+#: Valid methods for AttendanceSheet.absence_table()
+ABSENCE_METHODS = ['fraction', 'number', 'attendance', 'attendance-fraction']
+
+
+def _absence_method(method, num_events):
+    """
+    Return a function that converts the number of absences to the value
+    requested by the given absence_table() method.
+
+    Sheets without events have no absences and full attendance.
+    """
+
+    try:
+        return {
+            'fraction': lambda x: _ratio(x, num_events, 0.0),
+            'number': lambda x: x,
+            'attendance': lambda x: num_events - x,
+            'attendance-fraction':
+                lambda x: _ratio(num_events - x, num_events, 1.0),
+        }[method]
+    except KeyError:
+        raise ValueError('invalid method: %r' % method)
+
+
+def _ratio(value, total, default):
+    return value / total if total else default
+
+
 def string_distance(str1, str2):
     str1 = str1.casefold()
     str2 = str2.casefold()
@@ -0,0 +1,12 @@
+from celery import shared_task
+
+
+@shared_task(ignore_result=True)
+def write_checkins(pairs):
+    """
+    Write a batch of (event_id, user_id) check-ins to the database.
+    """
+
+    from .checkin import write_checkins
+
+    write_checkins(pairs)
@@ -0,0 +1,118 @@
+import pytest
+from django.apps import apps
+
+from codeschool import models
+from codeschool.accounts.factories import UserFactory
+from codeschool.core import get_wagtail_root
+
+
+pytestmark = pytest.mark.skipif(
+    not apps.is_installed('codeschool.lms.attendance'),
+    reason='attendance app is not enabled',
+)
+
+
+@pytest.fixture
+def users(db):
+    return UserFactory.create_batch(3)
+
+
+@pytest.fixture
+def course(users):
+    from codeschool.lms.courses.models import Course
+
+    page = Course(title='Programming 101', slug='cs101',
+                  teacher=UserFactory.create())
+    get_wagtail_root().add_child(instance=page)
+    page.students.add(*users[:2])
+    return page
+
+
+@pytest.fixture
+def sheet(course):
+    from codeschool.lms.attendance.models import AttendanceSheet
+
+    return AttendanceSheet.objects.create(owner=course.teacher, course=course)
+
+
+def attend(sheet, *users):
+    from codeschool.lms.attendance.models import AttendanceCheck
+
+    event = sheet.new_event()
+    for user in users:
+        AttendanceCheck.objects.create(user=user, event=event,
+                                       has_attended=True)
+    return event
+
+
+def test_absence_table_defaults_to_course_students(sheet, users):
+    u1, u2, _ = users
+    attend(sheet, u1, u2)
+    attend(sheet, u1)
+    assert sheet.absence_table() == {u1: 0.0, u2: 0.5}
+    assert sheet.absence_table(method='number') == {u1: 0, u2: 1}
+    assert sheet.absence_table(method='attendance') == {u1: 2, u2: 1}
+
+
+def test_absence_table_without_course(users):
+    from codeschool.lms.attendance.models import AttendanceSheet
+
+    u1, u2, u3 = users
+    sheet = AttendanceSheet.objects.create(owner=u3)
+    attend(sheet, u1)
+    attend(sheet, u2)
+    assert sheet.absence_table(method='number') == {u1: 1, u2: 1}
+
+
+def test_absence_table_without_events(sheet, users):
+    u1, u2, _ = users
+    assert sheet.absence_table() == {u1: 0.0, u2: 0.0}
+    assert sheet.absence_table(method='attendance-fraction') == \
+        {u1: 1.0, u2: 1.0}
+
+
+def test_absence_table_matches_iter_absence_table(sheet, users):
+    u1, u2, _ = users
+    attend(sheet, u1)
+    attend(sheet, u2)
+    attend(sheet, u2)
+    for method in ['fraction', 'number', 'attendance', 'attendance-fraction']:
+        table = sheet.absence_table(method=method)
+        rows = list(sheet.iter_absence_table(method=method))
+        assert rows == sorted((user.username, value)
+                              for user, value in table.items())
+
+
+def test_absence_table_rejects_invalid_method(sheet):
+    with pytest.raises(ValueError):
+        sheet.absence_table(method='invalid')
+
+
+def test_attendance_matrix(sheet, users):
+    pytest.importorskip('numpy')
+
+    u1, u2, u3 = users
+    first = attend(sheet, u2)
+    second = attend(sheet, u1, u2, u3)
+    third = attend(sheet)
+    ordered = models.User.objects\
+        .filter(id__in=[u1.id, u2.id])\
+        .order_by('-id')
+    user_ids, event_ids, matrix = sheet.attendance_matrix(ordered)
+    assert user_ids == [u2.id, u1.id]
+    assert event_ids == [first.id, second.id, third.id]
+    assert matrix.shape == (2, 3)
+    assert matrix.dtype == bool
+    assert matrix.tolist() == [[True, True, False], [False, True, False]]
+
+
+def test_attendance_matrix_defaults_to_participants(sheet, users):
+    pytest.importorskip('numpy')
+
+    u1, u2, u3 = users
+    attend(sheet, u1, u3)
+    user_ids, event_ids, matrix = sheet.attendance_matrix()
+    assert sorted(user_ids) == sorted([u1.id, u2.id])
+    assert matrix.shape == (2, 1)
+    assert matrix[user_ids.index(u1.id), 0]
+    assert not matrix[user_ids.index(u2.id), 0]
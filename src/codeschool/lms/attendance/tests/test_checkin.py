@@ -0,0 +1,93 @@
+import time
+from unittest import mock
+
+import pytest
+from django.apps import apps
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import Client
+
+from codeschool.accounts.factories import UserFactory
+from codeschool.core import get_wagtail_root
+from codeschool.lms.attendance import checkin
+
+
+pytestmark = pytest.mark.skipif(
+    not apps.is_installed('codeschool.lms.attendance'),
+    reason='attendance app is not enabled',
+)
+
+
+@pytest.fixture
+def write_checkins():
+    with mock.patch('codeschool.lms.attendance.tasks.write_checkins') as task:
+        yield task
+
+
+@pytest.fixture
+def course(db):
+    from codeschool.lms.courses.models import Course
+
+    cache.clear()
+    page = Course(title='Programming 101', slug='cs101',
+                  teacher=UserFactory.create())
+    get_wagtail_root().add_child(instance=page)
+    return page
+
+
+@pytest.fixture
+def sheet(course):
+    from codeschool.lms.attendance.models import AttendanceSheet
+
+    sheet = AttendanceSheet.objects.create(owner=course.teacher, course=course)
+    sheet.new_event()
+    checkin.publish_event(sheet.last_event)
+    return sheet
+
+
+def post_checkin(sheet, user, passphrase):
+    client = Client()
+    client.force_login(user, 'django.contrib.auth.backends.ModelBackend')
+    url = reverse('attendance:checkin', kwargs={'sheet_id': sheet.id})
+    return client.post(url, {'passphrase': passphrase})
+
+
+def test_buffer_is_flushed_after_interval(settings, write_checkins):
+    settings.CODESCHOOL_CHECKIN_FLUSH_INTERVAL = 0.05
+    buffer = checkin.CheckinBuffer()
+    buffer.add(1, 2)
+    assert not write_checkins.delay.called
+    time.sleep(0.5)
+    write_checkins.delay.assert_called_once_with([(1, 2)])
+    assert len(buffer) == 0
+
+
+def test_buffer_is_flushed_when_full(settings, write_checkins):
+    settings.CODESCHOOL_CHECKIN_BATCH_SIZE = 2
+    buffer = checkin.CheckinBuffer()
+    buffer.add(1, 2)
+    buffer.add(1, 3)
+    write_checkins.delay.assert_called_once_with([(1, 2), (1, 3)])
+
+
+def test_enrolled_student_can_check_in(sheet, course, write_checkins):
+    student = UserFactory.create()
+    course.students.add(student)
+    response = post_checkin(sheet, student,
+                            sheet.last_event.passphrase)
+    assert response.status_code == 200
+    assert response.json() == {'status': checkin.OK}
+    checkin.flush()
+    write_checkins.delay.assert_called_once_with(
+        [(sheet.last_event.id, student.id)]
+    )
+
+
+def test_visitor_cannot_check_in(sheet, write_checkins):
+    visitor = UserFactory.create()
+    response = post_checkin(sheet, visitor,
+                            sheet.last_event.passphrase)
+    assert response.status_code == 403
+    assert response.json() == {'status': checkin.NOT_ENROLLED}
+    checkin.flush()
+    assert not write_checkins.delay.called
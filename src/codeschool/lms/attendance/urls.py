@@ -0,0 +1,9 @@
+from django.conf.urls import url
+
+from .views import absence_table_csv_view, checkin_view
+
+urlpatterns = [
+    url(r'^(?P<sheet_id>[0-9]+)/absence[\.]csv$', absence_table_csv_view,
+        name='absence-table-csv'),
+    url(r'^(?P<sheet_id>[0-9]+)/checkin/$', checkin_view, name='checkin'),
+]
@@ -1,3 +1,51 @@
-from django.shortcuts import render
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse, HttpResponseBadRequest, \
+    JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_POST
 
-# Create your views here.
+from . import checkin
+from .models import AttendanceSheet
+
+
+def absence_table_csv_view(request, sheet_id):
+    """
+    Stream the absence table of an attendance sheet as a CSV file.
+    """
+
+    sheet = get_object_or_404(AttendanceSheet, id=sheet_id)
+    if request.user != sheet.owner and not request.user.is_superuser:
+        raise PermissionDenied
+
+    method = request.GET.get('method', 'fraction')
+    try:
+        rows = sheet.absence_table_csv(method=method)
+    except ValueError as ex:
+        return HttpResponseBadRequest(str(ex))
+    response = StreamingHttpResponse(rows, content_type='text/csv')
+    response['Content-Disposition'] = \
+        'attachment; filename="absence-%s.csv"' % sheet.id
+    return response
+
+
+@require_POST
+@login_required
+def checkin_view(request, sheet_id):
+    """
+    Confirm the attendance of the current user in the active event of an
+    attendance sheet.
+
+    The response is a JSON object with a "status" key (see
+    :func:`codeschool.lms.attendance.checkin.check_in`). This view never
+    touches the database while the event is cached.
+    """
+
+    passphrase = request.POST.get('passphrase', '')
+    status = checkin.check_in(sheet_id, request.user.id, passphrase)
+    response = JsonResponse({'status': status})
+    if status == checkin.RATE_LIMITED:
+        response.status_code = 429
+    elif status == checkin.NOT_ENROLLED:
+        response.status_code = 403
+    return response
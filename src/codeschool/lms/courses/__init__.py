@@ -1,9 +1,10 @@
+from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 
-from codeschool import settings
-
-# Makes sure dependencies are right
-if 'codeschool.social' not in settings.INSTALLED_APPS:
+# Makes sure dependencies are right (tests import this package even if the
+# app is not installed)
+if 'codeschool.lms.courses' in settings.INSTALLED_APPS \
+        and 'codeschool.social' not in settings.INSTALLED_APPS:
     raise ImproperlyConfigured(
         'Please install codeschool.social app in order to use '
         'codeschool.lms.courses.'
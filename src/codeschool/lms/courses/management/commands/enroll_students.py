@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from codeschool.lms.courses.models import Course
+from codeschool.models import User
+
+
+class Command(BaseCommand):
+    help = 'enroll a list of students in a course.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course', type=int, help='id of the course page')
+        parser.add_argument('usernames', nargs='*',
+                            help='usernames of the students')
+        parser.add_argument('--file', '-f',
+                            help='file with one username per line')
+
+    def handle(self, *args, course, usernames=(), file=None, **options):
+        try:
+            course = Course.objects.get(id=course)
+        except Course.DoesNotExist:
+            raise CommandError('course does not exist: %s' % course)
+
+        usernames = set(usernames)
+        if file:
+            with open(file) as fd:
+                usernames.update(line.strip() for line in fd if line.strip())
+        if not usernames:
+            raise CommandError('no students given')
+
+        users = dict(User.objects
+                     .filter(username__in=usernames)
+                     .values_list('username', 'id'))
+        missing = usernames - set(users)
+        if missing:
+            raise CommandError('users not found: %s' %
+                               ', '.join(sorted(missing)))
+
+        new = course.enroll_students(users.values())
+        print('Enrolled %s new students in %s (%s already enrolled).' %
+              (len(new), course.title, len(users) - len(new)))
@@ -3,7 +3,10 @@ from collections import OrderedDict
 import model_reference
 from django import forms
 from django.apps import apps
-from django.db import transaction
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
 from django.shortcuts import render
 from django.utils.translation import ugettext_lazy as _
 from lazyutils import lazy
@@ -18,6 +21,13 @@ from bricks.helpers import hyperlink
 ACTIVITY_DESCRIPTION = _('Activities for the %(name)s course')
 
 
+#: Time (in seconds) that course role indexes are kept in cache.
+ROLE_INDEX_TIMEOUT = 60 * 60
+
+#: Courses with more members are not indexed.
+ROLE_INDEX_MAX_SIZE = 10000
+
+
 def random_subscription_passphase():
     return phrase().lower()
 
@@ -194,22 +204,34 @@ class Course(models.RoutablePageMixin, models.TimeStampedModel, models.Page):
         Register a new student in the course.
         """
 
-        self.students.add(student)
-        self.update_friendship_status(student)
+        self.enroll_students([student])
+
+    def enroll_students(self, students):
+        """
+        Register a list of students in the course.
+
+        Students that are already enrolled are ignored. All new students are
+        marked as colleagues of every other student in the course using a
+        constant number of queries.
+
+        Return the set of ids of newly enrolled students.
+        """
+
+        ids = {getattr(student, 'pk', student) for student in students}
+        with transaction.atomic():
+            enrolled = set(self.students.values_list('id', flat=True))
+            new_ids = ids - enrolled
+            if new_ids:
+                self.students.add(*new_ids)
+                create_colleague_relations(new_ids, enrolled | new_ids)
+        return new_ids
 
     def is_registered(self, user):
         """
         Check if user is associated with the course in any way.
         """
 
-        if self.teacher == user:
-            return True
-        elif user in self.students.all():
-            return True
-        elif user in self.staff.all():
-            return True
-        else:
-            return False
+        return self.get_user_role(user) != 'visitor'
 
     def update_friendship_status(self, student=None):
         """
@@ -219,20 +241,11 @@ class Course(models.RoutablePageMixin, models.TimeStampedModel, models.Page):
         If no student is given, update the status of all enrolled students.
         """
 
-        update = self._update_friendship_status
+        students = set(self.students.values_list('id', flat=True))
         if student is None:
-            for student in self.students.all():
-                update(student)
+            create_colleague_relations(students, students)
         else:
-            update(student)
-
-    def _update_friendship_status(self, student):
-        for colleague in self.students.all():
-            if colleague != student:
-                FriendshipStatus.objects.get_or_create(
-                    owner=student,
-                    other=colleague,
-                    status=FriendshipStatus.STATUS_COLLEAGUE)
+            create_colleague_relations({student.pk}, students)
 
     def get_user_role(self, user):
         """Return a string describing the most privileged role the user has
@@ -250,13 +263,67 @@ class Course(models.RoutablePageMixin, models.TimeStampedModel, models.Page):
             visitors can access the course contents.
         """
 
-        if user == self.teacher:
-            return 'teacher'
-        if user in self.staff.all():
-            return 'staff'
-        if user in self.students.all():
-            return 'student'
-        return 'visitor'
+        user_id = getattr(user, 'pk', user)
+        if user_id is None:
+            return 'visitor'
+        return self.roles_for_users([user_id])[user_id]
+
+    def roles_for_users(self, users):
+        """
+        Return a dictionary mapping the id of each of the given users to their
+        respective roles in the course.
+
+        Roles are computed with a constant number of queries.
+        """
+
+        ids = {getattr(user, 'pk', user) for user in users}
+        index = self.get_role_index()
+        if index is None:
+            index = {
+                'staff': set(self.staff
+                             .filter(id__in=ids)
+                             .values_list('id', flat=True)),
+                'students': set(self.students
+                                .filter(id__in=ids)
+                                .values_list('id', flat=True)),
+            }
+
+        roles = {}
+        for user_id in ids:
+            if user_id == self.teacher_id:
+                roles[user_id] = 'teacher'
+            elif user_id in index['staff']:
+                roles[user_id] = 'staff'
+            elif user_id in index['students']:
+                roles[user_id] = 'student'
+            else:
+                roles[user_id] = 'visitor'
+        return roles
+
+    def get_role_index(self):
+        """
+        Return a dictionary with the sets of ids of staff members and students
+        of the course.
+
+        The index is stored in the shared cache and is invalidated when the
+        staff or students lists change. Return None for courses with more than
+        ROLE_INDEX_MAX_SIZE members.
+        """
+
+        key = _role_index_key(self.pk)
+        index = cache.get(key)
+        if index is None:
+            staff = set(self.staff.values_list('id', flat=True))
+            students = set(self.students.values_list('id', flat=True))
+            if len(staff) + len(students) > ROLE_INDEX_MAX_SIZE:
+                index = {'too_large': True}
+            else:
+                index = {'staff': staff, 'students': students}
+            cache.set(key, index, ROLE_INDEX_TIMEOUT)
+
+        if index.get('too_large'):
+            return None
+        return index
 
     def info_dict(self):
         """
@@ -334,3 +401,104 @@ class Course(models.RoutablePageMixin, models.TimeStampedModel, models.Page):
         ], heading=_('Subscription')),
 
     ]
+
+
+def _role_index_key(course_id):
+    return 'course-roles:%s' % course_id
+
+
+def invalidate_role_index(course_ids):
+    """
+    Discard the cached role indexes of the given courses.
+
+    Indexes are discarded immediately and again when the current transaction
+    commits, since concurrent requests may cache the old memberships before
+    the changes are committed.
+    """
+
+    keys = [_role_index_key(id) for id in course_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+@receiver(m2m_changed, sender=Course.staff.through)
+def invalidate_role_index_on_membership_change(
+        instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidate role indexes when students or staff members change.
+    """
+
+    if not reverse:
+        if action.startswith('post_'):
+            invalidate_role_index([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        invalidate_role_index(pk_set)
+    elif action == 'pre_clear':
+        # We must fetch related courses before they are removed
+        related = kwargs['model'].objects.filter(
+            models.Q(students=instance) | models.Q(staff=instance)
+        )
+        invalidate_role_index(related.values_list('id', flat=True))
+
+
+def create_colleague_relations(users, colleagues, batch_size=1000):
+    """
+    Create the missing FriendshipStatus objects between each user in users
+    and each user in colleagues (in both directions).
+
+    Both arguments are sets of user ids. Existing relations are not modified.
+    Return the number of created objects.
+    """
+
+    users, colleagues = set(users), set(colleagues)
+    if not users or len(colleagues | users) < 2:
+        return 0
+
+    pairs = _missing_colleague_pairs(users, colleagues)
+    try:
+        with transaction.atomic():
+            _create_colleague_pairs(pairs, batch_size)
+    except IntegrityError:
+        # Some relation was created concurrently. Try again with a fresh list
+        # of missing pairs.
+        pairs = _missing_colleague_pairs(users, colleagues)
+        _create_colleague_pairs(pairs, batch_size)
+    return len(pairs)
+
+
+def _missing_colleague_pairs(users, colleagues):
+    """
+    Return the set of (owner, other) pairs between users and colleagues that
+    do not have a FriendshipStatus object.
+    """
+
+    from codeschool.social.friends.models import FriendshipStatus
+
+    existing = set(
+        FriendshipStatus.objects
+        .filter(owner_id__in=users, other_id__in=colleagues)
+        .values_list('owner_id', 'other_id')
+    )
+    existing.update(
+        FriendshipStatus.objects
+        .filter(owner_id__in=colleagues, other_id__in=users)
+        .values_list('owner_id', 'other_id')
+    )
+    pairs = {(user, colleague) for user in users for colleague in colleagues
+             if user != colleague}
+    pairs.update([(other, owner) for owner, other in pairs])
+    return pairs - existing
+
+
+def _create_colleague_pairs(pairs, batch_size):
+    from codeschool.social.friends.models import FriendshipStatus
+
+    # We bypass FriendshipStatus.save() since reciprocal relations are
+    # created explicitly
+    FriendshipStatus.objects.bulk_create(
+        (FriendshipStatus(owner_id=owner, other_id=other,
+                          status=FriendshipStatus.STATUS_COLLEAGUE)
+         for owner, other in pairs),
+        batch_size=batch_size,
+    )
@@ -0,0 +1,80 @@
+import pytest
+from django.apps import apps
+from django.core.management import call_command, CommandError
+
+from codeschool.accounts.factories import UserFactory
+from codeschool.core import get_wagtail_root
+
+
+pytestmark = pytest.mark.skipif(
+    not apps.is_installed('codeschool.lms.courses'),
+    reason='courses app is not enabled',
+)
+
+
+@pytest.fixture
+def course(db):
+    from codeschool.lms.courses.models import Course
+
+    teacher = UserFactory.create()
+    page = Course(title='Programming 101', slug='cs101', teacher=teacher)
+    get_wagtail_root().add_child(instance=page)
+    return page
+
+
+@pytest.fixture
+def students(db):
+    return UserFactory.create_batch(3)
+
+
+def colleague_pairs(users):
+    from codeschool.social.friends.models import FriendshipStatus
+
+    ids = [user.id for user in users]
+    return set(FriendshipStatus.objects
+               .filter(owner_id__in=ids, other_id__in=ids,
+                       status=FriendshipStatus.STATUS_COLLEAGUE)
+               .values_list('owner_id', 'other_id'))
+
+
+def test_enroll_students_creates_colleague_relations(course, students):
+    new = course.enroll_students(students)
+    assert new == {user.id for user in students}
+    assert set(course.students.all()) == set(students)
+    assert colleague_pairs(students) == {
+        (a.id, b.id) for a in students for b in students if a != b
+    }
+
+
+def test_enroll_students_ignores_enrolled_students(course, students):
+    course.enroll_students(students[:2])
+    new = course.enroll_students(students)
+    assert new == {students[2].id}
+    assert len(colleague_pairs(students)) == 6
+    assert course.enroll_students(students) == set()
+
+
+def test_enroll_students_keeps_existing_relations(course, students):
+    from codeschool.social.friends.models import FriendshipStatus
+
+    a, b, c = students
+    FriendshipStatus.objects.create(owner=a, other=b,
+                                    status=FriendshipStatus.STATUS_FRIEND)
+    course.enroll_students(students)
+    status = FriendshipStatus.objects.get(owner=a, other=b).status
+    assert status == FriendshipStatus.STATUS_FRIEND
+    assert FriendshipStatus.objects.filter(owner=b, other=a).exists()
+
+
+def test_enroll_students_command(course, students, tmpdir):
+    path = tmpdir.join('students.txt')
+    path.write('\n'.join(user.username for user in students[1:]) + '\n')
+    call_command('enroll_students', str(course.id), students[0].username,
+                 '--file', str(path))
+    assert set(course.students.all()) == set(students)
+
+
+def test_enroll_students_command_rejects_unknown_users(course, students):
+    with pytest.raises(CommandError):
+        call_command('enroll_students', str(course.id), 'not-a-user')
+    assert not course.students.exists()
@@ -0,0 +1,77 @@
+from unittest import mock
+
+import pytest
+from django.apps import apps
+from django.core.cache import cache
+
+from codeschool.accounts.factories import UserFactory
+from codeschool.core import get_wagtail_root
+
+
+pytestmark = pytest.mark.skipif(
+    not apps.is_installed('codeschool.lms.courses'),
+    reason='courses app is not enabled',
+)
+
+
+@pytest.fixture
+def course(db):
+    from codeschool.lms.courses.models import Course
+
+    cache.clear()
+    teacher = UserFactory.create()
+    page = Course(title='Programming 101', slug='cs101', teacher=teacher)
+    get_wagtail_root().add_child(instance=page)
+    return page
+
+
+@pytest.fixture
+def users(db):
+    return UserFactory.create_batch(3)
+
+
+def test_user_roles(course, users):
+    student, staff, visitor = users
+    course.students.add(student)
+    course.staff.add(staff)
+    assert course.get_user_role(course.teacher) == 'teacher'
+    assert course.get_user_role(staff) == 'staff'
+    assert course.get_user_role(student) == 'student'
+    assert course.get_user_role(visitor) == 'visitor'
+    assert course.get_user_role(None) == 'visitor'
+    assert course.roles_for_users(users) == {
+        student.id: 'student', staff.id: 'staff', visitor.id: 'visitor',
+    }
+
+
+def test_role_index_is_invalidated_on_membership_change(course, users):
+    student = users[0]
+    assert course.get_user_role(student) == 'visitor'
+    course.students.add(student)
+    assert course.get_user_role(student) == 'student'
+    course.students.remove(student)
+    assert course.get_user_role(student) == 'visitor'
+    student.courses_as_student.add(course)
+    assert course.get_user_role(student) == 'student'
+    student.courses_as_student.clear()
+    assert course.get_user_role(student) == 'visitor'
+
+
+def test_role_index_is_invalidated_on_commit(course, users):
+    from codeschool.lms.courses.models import course as course_module
+
+    with mock.patch.object(course_module.transaction, 'on_commit') as hook:
+        course.students.add(users[0])
+    callback, = [args[0] for args, kwargs in hook.call_args_list]
+    course.get_role_index()
+    callback()
+    assert cache.get(course_module._role_index_key(course.pk)) is None
+
+
+def test_large_courses_are_not_indexed(course, users):
+    from codeschool.lms.courses.models import course as course_module
+
+    course.students.add(*users)
+    with mock.patch.object(course_module, 'ROLE_INDEX_MAX_SIZE', 2):
+        assert course.get_role_index() is None
+        assert course.get_user_role(users[0]) == 'student'
@@ -36,5 +36,6 @@ class CodingIoQuestionAdmin(QuestionAdmin):
         panels.MultiFieldPanel([
             panels.FieldPanel('language'),
             panels.FieldPanel('timeout'),
+            panels.FieldPanel('fail_fast'),
         ], heading=_('Options'))
     ]
@@ -0,0 +1,245 @@
+"""
+On-disk cache of compiled programs.
+
+Compiled languages (C and C++) are rebuilt by ejudge every time a program
+runs. Regrading a question or running the post tests compiles the same sources
+again and identical sources from different students are compiled repeatedly.
+
+This module stores executables in a content-addressed directory keyed by the
+source, the language and the compiler arguments. All grading processes in a
+node share the same directory. The least recently used executables are
+removed when the directory grows beyond CODESCHOOL_BUILD_CACHE_MAX_SIZE.
+
+Executables are compiled in a sandbox and then written to the cache by the
+grading process. The cache directory is private to the user running the
+grading process, so student programs (which run as an unprivileged user)
+can neither tamper with cached executables nor read executables compiled from
+answer keys. The grading process reads the cached executable and sends it to
+the sandbox, where the special :data:`ARTIFACT_LANGUAGE` build manager writes
+it to the build directory instead of compiling the source.
+
+This module is also imported inside the sandbox, hence it must not use
+Django at import time.
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+
+from ejudge import registry
+from ejudge.build_manager import CompiledLanguageBuildManager
+from ejudge.exceptions import BuildError
+
+logger = logging.getLogger('codeschool.questions.coding_io')
+
+#: Languages whose executables are cached.
+CACHED_LANGUAGES = ('c', 'gcc', 'C', 'cc', 'c++', 'cpp', 'g++', 'C++')
+
+#: ejudge language used to run cached executables.
+ARTIFACT_LANGUAGE = 'codeschool-artifact'
+
+READ_ONLY_EXECUTABLE = (stat.S_IRUSR | stat.S_IXUSR | stat.S_IRGRP |
+                        stat.S_IXGRP | stat.S_IROTH | stat.S_IXOTH)
+
+
+def cache_dir():
+    """
+    Directory that stores cached executables.
+    """
+
+    from annoying.functions import get_config
+
+    default = os.path.join(tempfile.gettempdir(), 'codeschool-build-cache')
+    return get_config('CODESCHOOL_BUILD_CACHE_DIR', None) or default
+
+
+def max_size():
+    """
+    Maximum size (in bytes) of the cache directory.
+    """
+
+    from annoying.functions import get_config
+
+    return int(get_config('CODESCHOOL_BUILD_CACHE_MAX_SIZE', 512 * 2 ** 20))
+
+
+def artifact_key(source, lang):
+    """
+    Return the cache key for the executable built from the given source and
+    language.
+    """
+
+    manager_class = registry.build_manager_class(lang)
+    build_args = manager_class(source).get_build_args()
+    data = json.dumps([manager_class.language, build_args, source])
+    return hashlib.sha256(data.encode('utf8')).hexdigest()
+
+
+def prepare(source, lang, sandbox=True):
+    """
+    Make sure the executable for the given source is in the cache.
+
+    Return a (source, lang) pair that should be passed to ejudge instead of
+    the original values. Programs that cannot be cached (e.g., languages that
+    are not compiled or programs with build errors) are returned unchanged.
+    """
+
+    if lang not in CACHED_LANGUAGES:
+        return source, lang
+
+    path = _ensure_cache_dir()
+    if path is None:
+        return source, lang
+
+    key = artifact_key(source, lang)
+    data = _load(os.path.join(path, key))
+    if data is None:
+        data = _compile(source, lang, sandbox)
+        if data is None:
+            return source, lang
+        _store(path, key, data)
+        _evict(path, max_size())
+
+    executable = base64.b64encode(data).decode('ascii')
+    payload = json.dumps({'executable': executable, 'source': source})
+    return payload, ARTIFACT_LANGUAGE
+
+
+def compile_artifact(source, lang, is_sandboxed=True):
+    """
+    Compile source code and return the base64 encoded executable or None if
+    the build fails.
+
+    This function runs inside the sandbox.
+    """
+
+    manager = registry.build_manager(lang, source, is_sandboxed=is_sandboxed)
+    try:
+        manager.build()
+    except BuildError:
+        return None
+    try:
+        executable = os.path.join(manager.build_path, manager.executable_name)
+        with open(executable, 'rb') as file:
+            return base64.b64encode(file.read()).decode('ascii')
+    finally:
+        shutil.rmtree(manager.build_path, ignore_errors=True)
+
+
+def _compile(source, lang, sandbox):
+    if not sandbox:
+        data = compile_artifact(source, lang, is_sandboxed=False)
+    else:
+        from boxed.jsonbox import run as run_sandbox
+
+        manager_class = registry.build_manager_class(lang)
+        data = run_sandbox(compile_artifact, args=(source, lang),
+                           imports=manager_class(source).get_modules())
+    return None if data is None else base64.b64decode(data)
+
+
+def _ensure_cache_dir():
+    # The cache directory must belong to the current user and must not be
+    # accessible by anyone else. Otherwise the cache is disabled.
+    path = cache_dir()
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    if info.st_uid != os.getuid():
+        logger.warning('build cache disabled: %r is not safe' % path)
+        return None
+    if stat.S_IMODE(info.st_mode) != 0o700:
+        os.chmod(path, 0o700)
+    return path
+
+
+def _load(artifact):
+    # Return the cached executable and mark it as recently used. Return None
+    # if it is not in the cache.
+    try:
+        with open(artifact, 'rb') as file:
+            data = file.read()
+        os.utime(artifact)
+    except FileNotFoundError:
+        return None
+    return data
+
+
+def _store(path, key, data):
+    # Write to a temporary file and rename it so other processes never see
+    # partially written executables.
+    fd, tmp_path = tempfile.mkstemp(dir=path, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.chmod(tmp_path, stat.S_IRUSR)
+        os.replace(tmp_path, os.path.join(path, key))
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def _evict(path, limit):
+    """
+    Remove least recently used entries until the cache is smaller than limit.
+    """
+
+    entries = sorted(_entries(path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_path in entries:
+        if total <= limit:
+            break
+        try:
+            os.unlink(entry_path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _entries(path):
+    # Yield (mtime, size, path) tuples for each executable in the cache.
+    for entry in os.scandir(path):
+        if entry.name.startswith('.'):
+            continue
+        try:
+            info = entry.stat()
+        except FileNotFoundError:
+            continue
+        yield info.st_mtime, info.st_size, entry.path
+
+
+class ArtifactBuildManager(CompiledLanguageBuildManager):
+    """
+    Build manager that writes a cached executable to the build directory.
+
+    The source must be a JSON string with the base64 encoded executable and
+    the original source code.
+    """
+
+    source_extension = '.txt'
+    language = ARTIFACT_LANGUAGE
+    build_args = []
+
+    def syntax_check(self):
+        pass
+
+    def compile_files(self):
+        try:
+            data = base64.b64decode(json.loads(self.source)['executable'])
+        except (ValueError, KeyError) as ex:
+            raise BuildError('invalid cached executable: %s' % ex)
+        executable = os.path.join(self.build_path, self.executable_name)
+        with open(executable, 'wb') as file:
+            file.write(data)
+        os.chmod(executable, READ_ONLY_EXECUTABLE)
+        self.log('debug', 'executable loaded from the build cache')
+
+
+registry.register(
+    ARTIFACT_LANGUAGE,
+    'codeschool.questions.coding_io.build_cache.ArtifactBuildManager',
+    'ejudge.langs.c_family.CLanguageExecutionManager',
+)
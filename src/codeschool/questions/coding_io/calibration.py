@@ -0,0 +1,152 @@
+"""
+Calibration of per test case timeouts.
+
+A single timeout for all test cases of a question is either too tight for
+heavy test cases or too loose for light ones: a program with an infinite loop
+wastes the full timeout on every test case. When a test state is created, the
+answer keys run against the expanded tests and the wall time of each test case
+is stored in :attr:`TestState.timings`. Grading then uses a timeout of
+CODESCHOOL_TIMEOUT_FACTOR times the reference time of each test case, bounded
+by CODESCHOOL_TIMEOUT_MIN and CODESCHOOL_TIMEOUT_MAX. Calibrated timeouts
+never exceed the timeout of the question.
+
+Calibration only runs in the background job that computes test states, since
+it executes every answer key on all test cases.
+Test states are calibrated after they are created, hence a marker in the
+shared cache tells other processes to reload tests they parsed before the
+calibration.
+
+Submissions in languages without an answer key use the question timeout.
+"""
+import logging
+
+from annoying.functions import get_config
+from django.core.cache import cache
+
+from .ejudge import run_code
+from .usage import ResourceUsage
+
+logger = logging.getLogger('codeschool.questions.coding_io')
+
+#: Expiration time (in seconds) of the calibration markers.
+CALIBRATED_MARKER_TIMEOUT = 30 * 24 * 60 * 60
+
+
+def is_enabled():
+    """
+    Return True if test cases should use calibrated timeouts.
+    """
+
+    return bool(get_config('CODESCHOOL_TIMEOUT_CALIBRATION', True))
+
+
+def timeout_factor():
+    """
+    Ratio between the timeout and the reference time of a test case.
+    """
+
+    return float(get_config('CODESCHOOL_TIMEOUT_FACTOR', 5.0))
+
+
+def timeout_bounds():
+    """
+    Return the (min, max) values of calibrated timeouts in seconds.
+    """
+
+    return (float(get_config('CODESCHOOL_TIMEOUT_MIN', 0.5)),
+            float(get_config('CODESCHOOL_TIMEOUT_MAX', 10.0)))
+
+
+def calibrate(answers, tests):
+    """
+    Run each answer key against the expanded tests and return a dictionary
+    mapping language refs to the list of wall times of each test case.
+
+    Answer keys that cannot be measured (e.g., programs that fail some test
+    case) are ignored.
+    """
+
+    _, max_timeout = timeout_bounds()
+    timings = {}
+    for answer in answers:
+        lang = answer.language.ejudge_ref()
+        try:
+            timings[lang] = measure(answer.source, tests, lang, max_timeout)
+        except Exception as ex:
+            logger.warning('could not calibrate %s answer key: %s' % (lang, ex))
+    return timings
+
+
+def measure(source, tests, lang, timeout):
+    """
+    Return a list with the wall time (in seconds) spent by source in each
+    test case.
+    """
+
+    inputs = tests.inputs()
+    usage = ResourceUsage()
+    _check(run_code(source, inputs, lang, timeout, usage=usage))
+    if len(usage) == len(inputs):
+        return [round(case[0], 4) for case in usage.cases]
+
+    # Programs that did not run in a warm worker are only measured as a whole.
+    # We run each test case separately instead. This also measures the
+    # sandbox startup time, which only makes timeouts more lenient.
+    result = []
+    for case in inputs:
+        usage = ResourceUsage()
+        _check(run_code(source, [case], lang, timeout, usage=usage))
+        result.append(round(usage.wall_time, 4))
+    return result
+
+
+def _check(result):
+    if result.has_error_test_case:
+        raise ValueError('reference program failed: %s' %
+                         result.get_error_type())
+
+
+def mark_calibrated(question_id, state_hash):
+    """
+    Register that the test state with the given hash was calibrated.
+    """
+
+    cache.set(_marker_key(question_id, state_hash), True,
+              CALIBRATED_MARKER_TIMEOUT)
+
+
+def is_calibrated(question_id, state_hash):
+    """
+    Return True if the test state with the given hash was calibrated after it
+    was created.
+    """
+
+    return cache.get(_marker_key(question_id, state_hash)) is not None
+
+
+def _marker_key(question_id, state_hash):
+    return 'coding-io-calibrated:%s:%s' % (question_id, state_hash)
+
+
+def case_timeouts(tests, lang, ceiling=None):
+    """
+    Return a list with the timeout of each test case of the given expanded
+    tests or None if tests are not calibrated for the given language.
+
+    Timeouts are never larger than the optional ceiling (usually the question
+    timeout).
+    """
+
+    if not is_enabled():
+        return None
+    timings = (tests.meta.get('timings') or {}).get(lang)
+    if not timings or len(timings) != len(tests):
+        return None
+
+    factor = timeout_factor()
+    min_timeout, max_timeout = timeout_bounds()
+    if ceiling:
+        max_timeout = min(max_timeout, ceiling)
+        min_timeout = min(min_timeout, max_timeout)
+    return [min(max(factor * time, min_timeout), max_timeout)
+            for time in timings]
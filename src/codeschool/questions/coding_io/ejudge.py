@@ -1,9 +1,19 @@
 import logging
+import multiprocessing
+import time
+from concurrent import futures
 
 import ejudge
 from annoying.functions import get_config
+from iospec import IoSpec
+from iospec.feedback import Feedback, get_feedback
 
 from codeschool.core.models import ProgrammingLanguage
+from . import sandbox_pool
+from .failfast import Outcome
+from .usage import measure
+
+_grading_executor = None
 
 
 def ejudge_kwargs(lang, timeout):
@@ -32,26 +42,361 @@ def ejudge_kwargs(lang, timeout):
     )
 
 
-def run_code(source, inputs, lang=None, timeout=None):
+def run_code(source, inputs, lang=None, timeout=None, usage=None):
     """
     Runs source code with given inputs and return the corresponding IoSpec
     tree.
+
+    Resources spent by the program are registered in the optional usage
+    object (see :mod:`codeschool.questions.coding_io.usage`).
+    """
+
+    kwargs = ejudge_kwargs(lang, timeout)
+    result = sandbox_pool.run(source, inputs, kwargs['lang'],
+                              kwargs['timeout'], kwargs['sandbox'],
+                              usage=usage)
+    if result is not None:
+        return result
+    source = use_build_cache(source, kwargs)
+    if usage is None:
+        return ejudge.run(source, inputs, **kwargs)
+    with measure(usage.add_total):
+        return ejudge.run(source, inputs, **kwargs)
+
+
+def use_build_cache(source, kwargs):
+    """
+    Compile programs in compiled languages into the build cache (see
+    :mod:`codeschool.questions.coding_io.build_cache`).
+
+    Return the source that should be passed to ejudge and update the lang
+    argument of the given ejudge kwargs.
     """
 
-    return ejudge.run(source, inputs, **ejudge_kwargs(lang, timeout))
+    if not get_config('CODESCHOOL_BUILD_CACHE', True):
+        return source
+
+    from . import build_cache
+
+    try:
+        source, kwargs['lang'] = build_cache.prepare(source, kwargs['lang'],
+                                                     kwargs['sandbox'])
+    except Exception as ex:
+        logger.warning('build cache failed: %s' % ex)
+    return source
 
 
-def grade_code(source, answer_key, lang=None, timeout=5, stream=False):
+def grade_code(source, answer_key, lang=None, timeout=5, stream=False,
+               parallel=None, usage=None, timeouts=None, fail_fast=False,
+               order=None, outcome=None):
     """
     Compare results of running the given source code with the iospec answer
     key.
+
+    If parallel is True, each test case is graded by a separate worker of the
+    grading pool (see :func:`get_grading_executor`). The default is to run in
+    parallel only if CODESCHOOL_GRADING_WORKERS > 1. Compiled programs are
+    graded in parallel only if they come from the build cache, since each
+    worker would otherwise compile the program again.
+
+    Python and pytuga programs that are graded serially run in a warm sandbox
+    worker (see :mod:`codeschool.questions.coding_io.sandbox_pool`). Compiled
+    programs are built only once (see :func:`use_build_cache`).
+
+    The wall time, CPU time and peak RSS of each test case are registered in
+    the optional usage object (see :mod:`codeschool.questions.coding_io.usage`).
+    Runs that do not use a warm worker only register their wall time.
+
+    An optional list of timeouts sets the timeout of each test case (see
+    :mod:`codeschool.questions.coding_io.calibration`). Serial runs that fall
+    back to ejudge use the largest of these timeouts for all test cases.
+
+    If fail_fast is True, test cases run in the given order (a list of
+    indexes) and grading stops at the first zero graded test case. The failed
+    and skipped test cases are registered in the optional outcome object (see
+    :mod:`codeschool.questions.coding_io.failfast`).
     """
 
     if stream is None:
         stream = lang not in ['python', 'pytuga']
+    if outcome is None:
+        outcome = Outcome()
+    if fail_fast:
+        order = list(range(len(answer_key)) if order is None else order)
+        answer_key, timeouts = _reorder(answer_key, timeouts, order)
+
+    kwargs = ejudge_kwargs(lang, max(timeouts) if timeouts else timeout)
+    source = use_build_cache(source, kwargs)
+    options = dict(stream=stream, usage=usage, timeouts=timeouts)
+    feedback = _grade_in_parallel(source, answer_key, parallel, kwargs,
+                                  fail_fast=fail_fast, outcome=outcome,
+                                  **options)
+    if feedback is None and fail_fast:
+        feedback = _grade_fail_fast(source, answer_key, kwargs, outcome,
+                                    **options)
+    elif feedback is None:
+        feedback = _grade_serially(source, answer_key, kwargs, **options)
+    if fail_fast:
+        outcome.reorder(order)
+    return feedback
+
+
+def _reorder(answer_key, timeouts, order):
+    # Return the answer key and timeouts in the given order.
+    answer_key = IoSpec([answer_key[idx] for idx in order])
+    if timeouts:
+        timeouts = [timeouts[idx] for idx in order]
+    return answer_key, timeouts
+
+
+def _grade_in_parallel(source, answer_key, parallel, kwargs, stream, usage,
+                       timeouts, fail_fast, outcome):
+    # Return None if test cases cannot be graded in parallel.
+    if parallel is None:
+        parallel = grading_workers() > 1
+    if not parallel or len(answer_key) < 2 or needs_build(kwargs['lang']):
+        return None
+    executor = get_grading_executor(kwargs['sandbox'])
+    if executor is None:
+        return None
+    return grade_code_parallel(
+        executor, source, answer_key, usage=usage, timeouts=timeouts,
+        fail_fast=fail_fast, outcome=outcome, compare_streams=stream,
+        **kwargs
+    )
+
+
+def _grade_serially(source, answer_key, kwargs, stream, usage, timeouts):
+    result = sandbox_pool.run(source, answer_key, kwargs['lang'],
+                              kwargs['timeout'], kwargs['sandbox'],
+                              compare_streams=stream, fast=True, usage=usage,
+                              timeouts=timeouts)
+    if result is not None:
+        return get_feedback(result, answer_key, stream=stream)
+    if usage is None:
+        return ejudge.grade(source, answer_key, compare_streams=stream,
+                            **kwargs)
+    with measure(usage.add_total):
+        return ejudge.grade(source, answer_key, compare_streams=stream,
+                            **kwargs)
+
+
+def _grade_fail_fast(source, answer_key, kwargs, outcome, stream, usage,
+                     timeouts):
+    # Test cases run in chunks and grading stops after the first zero graded
+    # test case. Results are compared with the answer key in the current
+    # process: only the inputs are sent to the sandbox. Warm workers run one
+    # test case per job. Other programs run in chunks of increasing sizes
+    # (1, 2, 4, ...) to amortize the startup time of the sandbox.
+    is_warm = sandbox_pool.get_pool(kwargs['lang'], kwargs['sandbox'])
+    growth = 1 if is_warm else 2
+    feedback_list = []
+    start, size = 0, 1
+    while start < len(answer_key):
+        cases = IoSpec(list(answer_key[start:start + size]))
+        chunk_timeouts = timeouts[start:start + size] if timeouts else None
+        result = _run_cases(source, cases, kwargs, stream, usage,
+                            chunk_timeouts)
+        feedback_list.extend(_feedback_until_zero(result, cases, stream))
+        if feedback_list[-1].grade == 0:
+            break
+        start, size = start + size, size * growth
+
+    feedback = merge_feedback(feedback_list)
+    failed = len(feedback_list) - 1 if feedback.grade == 0 else None
+    outcome.register(len(answer_key), range(len(feedback_list)), failed)
+    return feedback
+
+
+def _run_cases(source, cases, kwargs, stream, usage, timeouts):
+    # Run test cases in a warm worker or fall back to ejudge. Stops at the
+    # first error test case.
+    result = sandbox_pool.run(source, cases, kwargs['lang'],
+                              kwargs['timeout'], kwargs['sandbox'],
+                              compare_streams=stream, fast=True, usage=usage,
+                              timeouts=timeouts)
+    if result is not None:
+        return result
+    if timeouts:
+        kwargs = dict(kwargs, timeout=max(timeouts))
+    if usage is None:
+        return ejudge.run(source, cases, fast=True, compare_streams=stream,
+                          **kwargs)
+    with measure(usage.add_total):
+        return ejudge.run(source, cases, fast=True, compare_streams=stream,
+                          **kwargs)
+
+
+def _feedback_until_zero(result, cases, stream):
+    # Yield the feedback of each test case until the first zero graded one.
+    for case, key in zip(result, cases):
+        feedback = get_feedback(case, key, stream=stream)
+        yield feedback
+        if feedback.grade == 0:
+            return
+
+
+def needs_build(lang):
+    """
+    Return True if programs in the given ejudge language are compiled before
+    each run.
+    """
+
+    from .build_cache import CACHED_LANGUAGES
+
+    return lang in CACHED_LANGUAGES
+
+
+def grading_workers():
+    """
+    Maximum number of test cases that can be graded simultaneously for a
+    single submission.
+    """
+
+    return int(get_config('CODESCHOOL_GRADING_WORKERS', 1))
+
+
+def map_programs(func, items):
+    """
+    Return a list with the results of func(item) for each item.
+
+    Items are processed in threads if programs run in the sandbox, since each
+    program then runs in its own subprocess. Programs that run outside the
+    sandbox execute in the current process and are processed serially (see
+    also :func:`get_grading_executor`).
+    """
+
+    items = list(items)
+    if len(items) < 2 or not get_config('CODESCHOOL_SANDBOX', True):
+        return [func(item) for item in items]
+    with futures.ThreadPoolExecutor(len(items)) as executor:
+        return list(executor.map(func, items))
+
+
+def get_grading_executor(sandbox=True):
+    """
+    Return the executor used to grade test cases in parallel.
+
+    Return None if test cases cannot be executed in parallel in the current
+    process.
+    """
+
+    global _grading_executor
+
+    if _grading_executor is None:
+        workers = grading_workers()
+
+        # Daemonic processes (e.g., celery prefork workers) cannot spawn child
+        # processes. Sandboxed test cases run in their own subprocess, so
+        # threads are enough to run them in parallel.
+        if not multiprocessing.current_process().daemon:
+            _grading_executor = futures.ProcessPoolExecutor(workers)
+        elif sandbox:
+            _grading_executor = futures.ThreadPoolExecutor(workers)
+        else:
+            return None
+    return _grading_executor
+
+
+def grade_code_parallel(executor, source, answer_key, usage=None,
+                        timeouts=None, fail_fast=False, outcome=None,
+                        **kwargs):
+    """
+    Grade each test case of answer_key in a separate job of the given executor
+    and merge all results in a single Feedback object.
+
+    The merged feedback is the same as the one obtained from a serial run: it
+    corresponds to the first test case with the lowest grade. Since no grade
+    is lower than zero, jobs for test cases after the first zero graded
+    test case (wrong answers, build errors, etc) are cancelled.
+
+    Resources of the test cases that contribute to the merged feedback are
+    registered in the optional usage object. An optional list of timeouts
+    overrides the timeout of each test case.
+
+    If fail_fast is True, all pending jobs are cancelled as soon as any test
+    case receives a zero grade.
+    """
+
+    jobs = _submit_cases(executor, source, answer_key, timeouts, kwargs)
+    results, resources = [None] * len(jobs), [None] * len(jobs)
+    first_zero = _collect_results(jobs, results, resources, fail_fast)
+
+    used = [idx for idx, feedback in enumerate(results[:first_zero + 1])
+            if feedback is not None]
+    if usage is not None:
+        for idx in used:
+            usage.add_case(*resources[idx])
+    if outcome is not None:
+        failed = first_zero if first_zero < len(results) else None
+        outcome.register(len(results), used, failed)
+    return merge_feedback(results[idx] for idx in used)
+
+
+def _submit_cases(executor, source, answer_key, timeouts, kwargs):
+    # Submit a job for each test case and return a map from jobs to indexes.
+    jobs = {}
+    for idx, case in enumerate(answer_key):
+        case_kwargs = kwargs
+        if timeouts:
+            case_kwargs = dict(kwargs, timeout=timeouts[idx])
+        job = executor.submit(_grade_test_case, source,
+                              IoSpec([case]).to_json(), case_kwargs)
+        jobs[job] = idx
+    return jobs
+
+
+def _collect_results(jobs, results, resources, fail_fast):
+    # Fill the results and resources lists as jobs finish and cancel jobs
+    # that cannot change the final result. Return the index of the first zero
+    # graded test case (or the number of test cases if there is none).
+    first_zero = len(results)
+    pending = set(jobs)
+    while pending:
+        done, pending = futures.wait(pending,
+                                     return_when=futures.FIRST_COMPLETED)
+        for job in done:
+            idx = jobs[job]
+            feedback_json, resources[idx] = job.result()
+            results[idx] = Feedback.from_json(feedback_json)
+            if results[idx].grade == 0:
+                first_zero = min(first_zero, idx)
+
+        # Cases after the first zero graded one cannot change the final result
+        if fail_fast and first_zero < len(results):
+            skipped = set(pending)
+        else:
+            skipped = {job for job in pending if jobs[job] > first_zero}
+        for job in skipped:
+            job.cancel()
+        pending -= skipped
+    return first_zero
+
+
+def merge_feedback(feedback_list):
+    """
+    Merge a sequence of per test case feedback objects.
+
+    Return the first feedback with the lowest grade.
+    """
+
+    result = None
+    for feedback in feedback_list:
+        if result is None or feedback.grade < result.grade:
+            result = feedback
+    return result
+
 
-    return ejudge.grade(source, answer_key, compare_streams=stream,
-                        **ejudge_kwargs(lang, timeout))
+def _grade_test_case(source, case_json, kwargs):
+    # Runs in the grading pool. Arguments and results are passed as JSON
+    # compatible structures to avoid pickling iospec objects.
+    #
+    # Returns the feedback and a (wall, cpu, rss) tuple. Only the wall time
+    # can be attributed to the test case (see the usage module).
+    case = IoSpec.from_json(case_json)
+    start = time.perf_counter()
+    feedback = ejudge.grade(source, case, **kwargs)
+    return feedback.to_json(), (time.perf_counter() - start, None, None)
 
 
 def expand_from_code(source, answer_key, lang, timeout=5):
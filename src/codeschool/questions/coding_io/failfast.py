@@ -0,0 +1,139 @@
+"""
+Fail-fast grading.
+
+Questions with fail_fast=True stop executing test cases after the first test
+case that receives a zero grade (wrong answers, build errors, timeouts, etc).
+Since the final grade is the lowest grade of all test cases, stopping at a
+zero grade never changes the result. Only the test case shown in the feedback
+may be different.
+
+Test cases are executed in decreasing order of failures, so wrong programs
+tend to fail on the first executed test case. Failure counts of each test
+state are kept in the shared cache and a snapshot is saved in
+:attr:`TestState.failure_counts` every FAILURE_SNAPSHOT_INTERVAL failures.
+The snapshot restores the counts if they are evicted from the cache.
+"""
+from django.core.cache import cache
+
+#: Number of failures registered between two snapshots of the failure counts.
+FAILURE_SNAPSHOT_INTERVAL = 50
+
+#: Expiration time (in seconds) of failure counts in the cache.
+FAILURE_COUNTS_TIMEOUT = 30 * 24 * 60 * 60
+
+
+class Outcome:
+    """
+    Collects which test cases failed or were skipped in a fail-fast grading
+    run.
+
+    Indexes refer to the original positions of test cases in the answer key.
+    """
+
+    def __init__(self):
+        self.failed = None
+        self.skipped = []
+
+    def register(self, num_cases, executed, failed=None):
+        """
+        Register the positions of the executed and failed test cases.
+        """
+
+        executed = set(executed)
+        self.failed = failed
+        self.skipped = [idx for idx in range(num_cases) if idx not in executed]
+
+    def reorder(self, order):
+        """
+        Convert positions in the execution order to the original indexes.
+        """
+
+        if self.failed is not None:
+            self.failed = order[self.failed]
+        self.skipped = sorted(order[idx] for idx in self.skipped)
+
+
+def case_order(question, tests, which):
+    """
+    Return a list with the indexes of the given expanded tests in decreasing
+    order of failures. Ties keep the original order.
+    """
+
+    counts = failure_counts(question, tests, which)
+    return sorted(range(len(tests)), key=lambda idx: -counts[idx])
+
+
+def failure_counts(question, tests, which):
+    """
+    Return a list with the number of failures of each test case.
+    """
+
+    prefix = _prefix(question, tests, which)
+    keys = ['%s:%s' % (prefix, idx) for idx in range(len(tests))]
+    data = cache.get_many(keys)
+    if len(data) < len(keys):
+        snapshot = _load_snapshot(question, tests, which)
+        for idx, key in enumerate(keys):
+            if key not in data:
+                data[key] = snapshot[idx] if idx < len(snapshot) else 0
+                cache.add(key, data[key], FAILURE_COUNTS_TIMEOUT)
+    return [data[key] for key in keys]
+
+
+def record_failure(question, tests, which, idx):
+    """
+    Register a failure in the test case with the given index.
+    """
+
+    prefix = _prefix(question, tests, which)
+    key = '%s:%s' % (prefix, idx)
+    if cache.get(key) is None:
+        failure_counts(question, tests, which)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, FAILURE_COUNTS_TIMEOUT)
+
+    total_key = prefix + ':total'
+    cache.add(total_key, 0, FAILURE_COUNTS_TIMEOUT)
+    try:
+        total = cache.incr(total_key)
+    except ValueError:
+        return
+    if total % FAILURE_SNAPSHOT_INTERVAL == 0:
+        save_snapshot(question, tests, which)
+
+
+def save_snapshot(question, tests, which):
+    """
+    Save the failure counts of the test state that produced the given tests.
+    """
+
+    from .models import TestState
+
+    counts = failure_counts(question, tests, which)
+    state = TestState.objects\
+        .filter(question_id=question.id,
+                hash=tests.meta.get('test_state_hash'))\
+        .only('id', 'failure_counts')\
+        .first()
+    if state is not None:
+        state.failure_counts = dict(state.failure_counts or {}, **{which: counts})
+        state.save(update_fields=['failure_counts'])
+
+
+def _load_snapshot(question, tests, which):
+    from .models import TestState
+
+    data = TestState.objects\
+        .filter(question_id=question.id,
+                hash=tests.meta.get('test_state_hash'))\
+        .values_list('failure_counts', flat=True)\
+        .first()
+    return (data or {}).get(which) or []
+
+
+def _prefix(question, tests, which):
+    return 'coding-io-failures:%s:%s:%s' % (
+        question.id, tests.meta.get('test_state_hash'), which
+    )
@@ -0,0 +1,128 @@
+"""
+Cross-user cache of grading results.
+
+Identical programs submitted to the same question are very common (think of
+the canonical solution of a simple exercise). Grading results only depend on
+the source code, the language, the test cases and the timeouts, hence the
+resulting feedback can be shared by all submissions with the same key.
+
+Results are stored in the default django cache (which is shared by all web and
+celery workers) with a small in-process LRU cache in front of it. Hit and miss
+counters are kept in the shared cache and are reported in the grading metrics
+endpoint.
+"""
+import logging
+
+from annoying.functions import get_config
+from django.core.cache import cache
+
+from codeschool.utils import LRUCache, md5hash_seq
+
+logger = logging.getLogger('codeschool.questions.coding_io')
+
+#: Size of the in-process LRU cache.
+LOCAL_CACHE_SIZE = 512
+
+_local_cache = LRUCache(LOCAL_CACHE_SIZE)
+
+
+def is_enabled():
+    """
+    Return True if grading results should be shared between submissions.
+    """
+
+    return bool(get_config('CODESCHOOL_FEEDBACK_CACHE', True))
+
+
+def cache_timeout():
+    """
+    Expiration time (in seconds) of results in the shared cache.
+    """
+
+    return get_config('CODESCHOOL_FEEDBACK_CACHE_TIMEOUT', 7 * 24 * 60 * 60)
+
+
+def feedback_key(source_hash, language, test_state_hash, for_pre_test,
+                 timeout, timeouts=None, fail_fast=False):
+    """
+    Return the cache key for the given grading parameters.
+
+    The optional list of per test case timeouts (see
+    :mod:`codeschool.questions.coding_io.calibration`) is part of the key,
+    since it may change after the test state is calibrated. Fail-fast results
+    (see :mod:`codeschool.questions.coding_io.failfast`) do not grade all test
+    cases and are stored under different keys.
+    """
+
+    digest = md5hash_seq([
+        source_hash,
+        language,
+        test_state_hash,
+        'pre' if for_pre_test else 'post',
+        repr(float(timeout)),
+        repr(timeouts and [float(x) for x in timeouts]),
+        'fail-fast' if fail_fast else 'full',
+    ])
+    return 'coding-io-feedback:%s' % digest
+
+
+def lookup(key):
+    """
+    Return a (json_feedback, skipped) pair stored for the given key or None.
+    """
+
+    data = _local_cache.get(key)
+    if data is None:
+        data = cache.get(key)
+        if data is not None:
+            _local_cache.set(key, data)
+
+    _incr('hits' if data is not None else 'misses')
+    if data is None:
+        return None
+    return data['feedback'], data['skipped']
+
+
+def store(key, json_feedback, skipped=None):
+    """
+    Store json feedback and the list of indexes of skipped test cases under
+    the given key.
+    """
+
+    data = {'feedback': json_feedback, 'skipped': skipped}
+    _local_cache.set(key, data)
+    cache.set(key, data, cache_timeout())
+
+
+def clear_local():
+    """
+    Clear the in-process cache.
+    """
+
+    _local_cache.clear()
+
+
+def _incr(name):
+    key = 'coding-io-feedback-cache:%s' % name
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def metrics():
+    """
+    Return a dictionary with hit/miss counters.
+    """
+
+    hits = cache.get('coding-io-feedback-cache:hits') or 0
+    misses = cache.get('coding-io-feedback-cache:misses') or 0
+    total = hits + misses
+    return {
+        'enabled': is_enabled(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else None,
+        'local_size': len(_local_cache),
+    }
@@ -0,0 +1,161 @@
+"""
+Asynchronous grading of CodingIoQuestion submissions.
+
+When CODESCHOOL_ASYNC_GRADING is enabled, submissions are not graded inside the
+web worker that received the request. Instead, a job is sent to the celery
+queue named by CODESCHOOL_GRADING_QUEUE and the submission id is returned to
+the browser as a ticket that can be used to poll for the resulting feedback.
+
+Queue bookkeeping (pending/running jobs and grading latencies) is stored in the
+shared cache so it is visible by all web and celery workers.
+"""
+import logging
+import time
+
+from annoying.functions import get_config
+from django.core.cache import cache
+from django.db import transaction
+
+from codeschool.core.statistics import Statistics
+
+logger = logging.getLogger('codeschool.questions.coding_io')
+
+#: Timeout for the queue counters. Counters never expire: an expired counter
+#: would be recreated with zero while jobs are still running and the following
+#: decrements would make it negative.
+COUNTER_TIMEOUT = None
+
+#: Maximum number of latency samples used to compute the percentiles.
+MAX_LATENCY_SAMPLES = 1000
+
+#: Delay (in seconds) before a job retries to acquire a grading slot.
+SLOT_RETRY_DELAY = 1.0
+
+#: Maximum number of attempts to acquire a grading slot. After that, the job
+#: is graded anyway. This prevents slots leaked by a crashing worker from
+#: blocking the queue forever.
+SLOT_MAX_RETRIES = 600
+
+
+def is_enabled():
+    """
+    Return True if submissions should be graded asynchronously.
+    """
+
+    return bool(get_config('CODESCHOOL_ASYNC_GRADING', False))
+
+
+def queue_name():
+    """
+    Name of the celery queue that receives grading jobs.
+    """
+
+    return get_config('CODESCHOOL_GRADING_QUEUE', 'grading')
+
+
+def concurrency_limit():
+    """
+    Maximum number of jobs that can be graded simultaneously.
+    """
+
+    return int(get_config('CODESCHOOL_GRADING_QUEUE_CONCURRENCY', 4))
+
+
+def _key(name):
+    return 'grading-queue:%s:%s' % (queue_name(), name)
+
+
+def _incr(name, delta=1):
+    key = _key(name)
+    cache.add(key, 0, COUNTER_TIMEOUT)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # Key was evicted between add() and incr()
+        cache.set(key, max(delta, 0), COUNTER_TIMEOUT)
+        return max(delta, 0)
+
+
+def enqueue(submission):
+    """
+    Schedule the automatic grading of the given submission and return a ticket
+    that can be used to query the grading status.
+    """
+
+    from .tasks import grade_submission
+
+    ticket = submission.id
+    enqueued_at = time.time()
+
+    def send_job():
+        _incr('pending')
+        grade_submission.apply_async(args=(ticket, enqueued_at),
+                                     queue=queue_name())
+        logger.debug('submission %s sent to grading queue' % ticket)
+
+    # Workers must see the submission saved in the current transaction.
+    transaction.on_commit(send_job)
+    return ticket
+
+
+def acquire_slot(force=False):
+    """
+    Try to reserve one of the grading slots.
+
+    Return True if a slot was reserved. Callers must call release_slot() after
+    grading finishes. If force is True, the slot is reserved even if the
+    concurrency limit was reached.
+    """
+
+    if _incr('running') > concurrency_limit() and not force:
+        _incr('running', -1)
+        return False
+    _incr('pending', -1)
+    return True
+
+
+def release_slot():
+    """
+    Release a slot reserved by acquire_slot().
+    """
+
+    _incr('running', -1)
+
+
+def register_latency(latency):
+    """
+    Register the time (in seconds) spent between enqueuing a submission and
+    having its feedback available.
+    """
+
+    # This read-modify-write cycle may lose a few samples under concurrent
+    # access. This is acceptable since samples are only used for metrics.
+    key = _key('latency')
+    samples = cache.get(key) or []
+    samples.append(latency)
+    cache.set(key, samples[-MAX_LATENCY_SAMPLES:], None)
+
+
+def metrics():
+    """
+    Return a dictionary with the current queue depth and the grading latency
+    percentiles.
+    """
+
+    samples = Statistics('latency', cache.get(_key('latency')) or [])
+    data = {
+        'queue': queue_name(),
+        'concurrency': concurrency_limit(),
+        'pending': max(cache.get(_key('pending')) or 0, 0),
+        'running': max(cache.get(_key('running')) or 0, 0),
+        'latency': {'samples': len(samples)},
+    }
+    if samples:
+        data['latency'].update(
+            mean=samples.mean(),
+            max=samples.max(),
+            p50=samples.percentile(50),
+            p90=samples.percentile(90),
+            p99=samples.percentile(99),
+        )
+    return data
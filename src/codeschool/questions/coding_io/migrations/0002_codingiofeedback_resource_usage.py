@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import jsonfield.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coding_io', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='codingiofeedback',
+            name='wall_time',
+            field=models.FloatField(blank=True, help_text='Total wall time (in seconds) spent running test cases.', null=True, verbose_name='wall time'),
+        ),
+        migrations.AddField(
+            model_name='codingiofeedback',
+            name='cpu_time',
+            field=models.FloatField(blank=True, help_text='Total CPU time (in seconds) spent running test cases.', null=True, verbose_name='CPU time'),
+        ),
+        migrations.AddField(
+            model_name='codingiofeedback',
+            name='peak_rss',
+            field=models.IntegerField(blank=True, help_text='Peak resident set size (in kB) of the program.', null=True, verbose_name='peak memory'),
+        ),
+        migrations.AddField(
+            model_name='codingiofeedback',
+            name='usage_json',
+            field=jsonfield.fields.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import jsonfield.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coding_io', '0002_codingiofeedback_resource_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teststate',
+            name='timings',
+            field=jsonfield.fields.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import jsonfield.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coding_io', '0003_teststate_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='codingioquestion',
+            name='fail_fast',
+            field=models.BooleanField(default=False, help_text='Stop grading at the first failed test case. Test cases that fail more often run first. This gives faster feedback (e.g., during live contests) without changing grades.', verbose_name='fail fast'),
+        ),
+        migrations.AddField(
+            model_name='codingiofeedback',
+            name='skipped',
+            field=jsonfield.fields.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='teststate',
+            name='failure_counts',
+            field=jsonfield.fields.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -3,7 +3,10 @@ from iospec.feedback import Feedback
 from lazyutils import lazy, delegate_to
 
 from codeschool import models
+from codeschool.questions.coding_io import failfast, feedback_cache
+from codeschool.questions.coding_io.calibration import case_timeouts
 from codeschool.questions.coding_io.ejudge import grade_code
+from codeschool.questions.coding_io.usage import ResourceUsage
 from codeschool.questions.models import QuestionFeedback
 from ..render import render
 
@@ -18,6 +21,27 @@ class CodingIoFeedback(QuestionFeedback):
     )
     json_feedback = models.JSONField(blank=True, null=True)
 
+    # Resources spent by the grading run (see the coding_io.usage module)
+    wall_time = models.FloatField(
+        _('wall time'),
+        blank=True, null=True,
+        help_text=_('Total wall time (in seconds) spent running test cases.'),
+    )
+    cpu_time = models.FloatField(
+        _('CPU time'),
+        blank=True, null=True,
+        help_text=_('Total CPU time (in seconds) spent running test cases.'),
+    )
+    peak_rss = models.IntegerField(
+        _('peak memory'),
+        blank=True, null=True,
+        help_text=_('Peak resident set size (in kB) of the program.'),
+    )
+    usage_json = models.JSONField(blank=True, null=True)
+
+    # Indexes of test cases that were not executed in fail-fast mode
+    skipped = models.JSONField(blank=True, null=True)
+
     feedback_status = property(lambda x: x.feedback.status)
     is_wrong_answer = delegate_to('feedback')
     is_presentation_error = delegate_to('feedback')
@@ -33,19 +57,89 @@ class CodingIoFeedback(QuestionFeedback):
             return None
 
     def update_autograde(self):
+        question = self.question
+        submission = self.submission
+        language_ref = submission.language.ejudge_ref()
+
         if self.for_pre_test:
-            tests = self.question.get_expanded_pre_tests()
+            which, tests = 'pre', question.get_expanded_pre_tests()
         else:
-            tests = self.question.get_expand_post_tests()
-        source = self.submission.source
-        language_ref = self.submission.language.ejudge_ref()
+            which, tests = 'post', question.get_expand_post_tests()
+        timeouts = case_timeouts(tests, language_ref, question.timeout)
+
+        # Identical programs share grading results, even between different
+        # users
+        use_cache = feedback_cache.is_enabled()
+        if use_cache:
+            key = feedback_cache.feedback_key(
+                submission.hash or submission.compute_hash(),
+                language_ref,
+                question.test_state_hash,
+                self.for_pre_test,
+                question.timeout,
+                timeouts,
+                question.fail_fast,
+            )
+            cached = feedback_cache.lookup(key)
+            if cached is not None:
+                json_feedback, self.skipped = cached
+                self.set_json_feedback(json_feedback)
+                return
+
+        # Fail-fast questions run the most failed test cases first
+        order = None
+        if question.fail_fast:
+            order = failfast.case_order(question, tests, which)
 
-        feedback = grade_code(source, tests,
+        usage = ResourceUsage()
+        outcome = failfast.Outcome()
+        feedback = grade_code(submission.source, tests,
                               lang=language_ref,
-                              timeout=self.question.timeout)
-        feedback.pprint()
-        self.json_feedback = feedback.to_json()
-        self.given_grade_pc = feedback.grade * 100
+                              timeout=question.timeout,
+                              usage=usage,
+                              timeouts=timeouts,
+                              fail_fast=question.fail_fast,
+                              order=order,
+                              outcome=outcome)
+        self.set_json_feedback(feedback.to_json())
+        self.set_usage(usage)
+        self.skipped = outcome.skipped or None
+        if question.fail_fast and outcome.failed is not None \
+                and not feedback.is_build_error:
+            failfast.record_failure(question, tests, which, outcome.failed)
+
+        # Do not share results obtained from an outdated test state
+        state_hash = tests.meta.get('test_state_hash')
+        if use_cache and state_hash == question.test_state_hash:
+            feedback_cache.store(key, self.json_feedback, self.skipped)
+
+    def set_json_feedback(self, json_feedback):
+        """
+        Update json_feedback and the given grade from a json feedback
+        structure.
+        """
+
+        self.json_feedback = json_feedback
+        self.given_grade_pc = json_feedback['grade'] * 100
+        self.__dict__.pop('feedback', None)
+
+    def set_usage(self, usage):
+        """
+        Update resource usage fields from a ResourceUsage object.
+        """
+
+        self.wall_time = usage.wall_time
+        self.cpu_time = usage.cpu_time
+        self.peak_rss = usage.peak_rss
+        self.usage_json = usage.to_json() or None
+
+    @property
+    def usage(self):
+        """
+        A ResourceUsage object with the per test case resources.
+        """
+
+        return ResourceUsage.from_json(self.usage_json)
 
     def render_message(self, **kwargs):
         return render(self.feedback)
@@ -1,9 +1,11 @@
 import logging
+import time
 from difflib import Differ
 
 import srvice
 from annoying.functions import get_config
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from django.utils.html import escape
 from django.utils.translation import ugettext_lazy as _, ugettext as __
 
@@ -14,15 +16,32 @@ from codeschool.core.models import ProgrammingLanguage
 from codeschool.fixes.parent_refresh import register_parent_prefetch
 from codeschool.questions.coding_io.models import TestState
 from codeschool.questions.models import Question
-from codeschool.utils import md5hash_seq
+from codeschool.utils import md5hash_seq, LRUCache
 from iospec import parse as parse_iospec, IoSpec
 from .submission import CodingIoSubmission
+from .. import calibration
 from .. import ejudge
+from .. import grading_queue
+from .. import regrade
 from .. import validators
 
 differ = Differ()
 logger = logging.getLogger('codeschool.questions.coding_io')
 
+#: Interval (in seconds) between two consecutive requests for the grading status
+#: of a submission in the grading queue.
+GRADING_STATUS_POLL_INTERVAL = 1.5
+
+#: Interval (in seconds) between two consecutive checks for a test state that
+#: is being computed in the background.
+TEST_STATE_POLL_INTERVAL = 0.25
+
+#: Maximum number of parsed test expansions kept in memory by each process.
+EXPANDED_TESTS_CACHE_SIZE = 256
+
+# Maps (question id, test state hash, 'pre' | 'post') to parsed IoSpec objects
+_expanded_tests_cache = LRUCache(EXPANDED_TESTS_CACHE_SIZE)
+
 
 @register_parent_prefetch
 class CodingIoQuestion(Question):
@@ -35,6 +54,8 @@ class CodingIoQuestion(Question):
         verbose_name = _('Programming question (IO-based)')
         verbose_name_plural = _('Programming questions (IO-based)')
 
+    instant_autograde = True
+
     num_pre_tests = models.PositiveIntegerField(
         _('# of pre-test examples'),
         default=3,
@@ -82,6 +103,15 @@ class CodingIoQuestion(Question):
             'each test case.'
         ),
     )
+    fail_fast = models.BooleanField(
+        _('fail fast'),
+        default=False,
+        help_text=_(
+            'Stop grading at the first failed test case. Test cases that fail '
+            'more often run first. This gives faster feedback (e.g., during '
+            'live contests) without changing grades.'
+        ),
+    )
     default_placeholder = models.TextField(
         _('placeholder'),
         blank=True,
@@ -179,62 +209,187 @@ class CodingIoQuestion(Question):
         Return True if test state has changed.
         """
 
-        return self.test_state_hash == compute_test_state_hash(self)
+        return self.test_state_hash != compute_test_state_hash(self)
 
-    def get_current_test_state(self, update=False):
+    def get_current_test_state(self, update=False, wait=None, calibrate=False):
         """
         Return a current TestState object synchronized with the current
         pre and post tests.
 
+        Test states are normally computed by a background job scheduled when
+        the question is saved. If the current test state is not available, it
+        waits up to ``wait`` seconds (defaults to CODESCHOOL_TEST_STATE_WAIT)
+        for the background job and then falls back to the most recent test
+        state of the question. Tests are expanded inline only if the question
+        has no test state at all or if ``update=True``.
+
+        Answer keys are timed to calibrate timeouts only if ``calibrate=True``.
+        This is done by the background job, since it runs every answer key on
+        all test cases.
+
         It raises a ValidationError if an error is encountered during the
         recreation of the test state.
         """
 
         if update:
-            hash = compute_test_state_hash(self)
-        else:
-            hash = self.test_state_hash
+            return self._update_test_state(calibrate)
+
+        hash = self.test_state_hash
+        if wait is None:
+            wait = get_config('CODESCHOOL_TEST_STATE_WAIT', 2.0)
+        state = self._wait_test_state(hash, wait)
+        if state is not None:
+            return state
+
+        state = TestState.objects\
+            .filter(question=self)\
+            .order_by('-created')\
+            .first()
+        if state is not None:
+            logger.warning('%r: using outdated test state %s' %
+                           (self.title, state.hash))
+            return state
+        return self.create_test_state(hash)
+
+    def _update_test_state(self, calibrate):
+        # Return the test state for the current tests, creating it if needed.
+        hash = compute_test_state_hash(self)
+        try:
+            state = TestState.objects.get(question=self, hash=hash)
+        except TestState.DoesNotExist:
+            return self.create_test_state(hash, calibrate=calibrate)
+        if calibrate and state.timings is None:
+            self.calibrate_test_state(state)
+        return state
+
+    def _wait_test_state(self, hash, wait):
+        # Poll the database for the test state with the given hash. Return
+        # None if it is not available after wait seconds.
+        deadline = time.time() + wait
+        while True:
+            try:
+                return TestState.objects.get(question=self, hash=hash)
+            except TestState.DoesNotExist:
+                if time.time() >= deadline:
+                    return None
+                time.sleep(TEST_STATE_POLL_INTERVAL)
+
+    def create_test_state(self, hash=None, calibrate=False):
+        """
+        Expand pre and post tests and save the results in a new TestState
+        object.
+
+        It raises a ValidationError if tests cannot be expanded or if the
+        answer keys produce inconsistent expansions. If calibrate is True,
+        answer keys are also timed on each expanded test case in order to
+        calibrate timeouts.
+        """
+
+        hash = hash or compute_test_state_hash(self)
+
+        def expand(x):
+            result = expand_tests(self, x)
+            check_expansions_with_all_programs(self, result)
+            return result
+
+        pre_tests = expand(self.pre_tests)
+        post_tests = expand(self.post_tests)
+        timings = None
+        if calibrate:
+            timings = self._calibrate(pre_tests, post_tests)
 
         try:
+            with transaction.atomic():
+                return TestState.objects.create(
+                    question=self,
+                    hash=hash,
+                    pre_tests_source=self.pre_tests_source,
+                    post_tests_source=self.post_tests_source,
+                    pre_tests_source_expansion=pre_tests.source(),
+                    post_tests_source_expansion=post_tests.source(),
+                    timings=timings,
+                )
+        except IntegrityError:
+            # Test state was created concurrently by another worker
             return TestState.objects.get(question=self, hash=hash)
-        except TestState.DoesNotExist:
-            pre_tests = self.pre_tests
-            post_tests = self.post_tests
-
-            def expand(x):
-                result = expand_tests(self, x)
-                check_expansions_with_all_programs(self, result)
-                return result
-
-            pre_source = expand(pre_tests).source()
-            post_source = expand(post_tests).source()
-
-            return TestState.objects.create(
-                question=self,
-                hash=hash,
-                pre_tests_source=self.pre_tests_source,
-                post_tests_source=self.post_tests_source,
-                pre_tests_source_expansion=pre_source,
-                post_tests_source_expansion=post_source,
+
+    def calibrate_test_state(self, state):
+        """
+        Time the answer keys on the expanded tests of the given test state and
+        save the results in its timings field.
+        """
+
+        timings = self._calibrate(
+            parse_iospec(state.pre_tests_source_expansion),
+            parse_iospec(state.post_tests_source_expansion),
+        )
+        if timings is not None:
+            state.timings = timings
+            state.save(update_fields=['timings'])
+            self._discard_expanded_tests(state.hash)
+            transaction.on_commit(
+                lambda: calibration.mark_calibrated(self.id, state.hash)
             )
 
+    def _calibrate(self, pre_tests, post_tests):
+        if not calibration.is_enabled():
+            return None
+        answers = list(self.answers_with_code().select_related('language'))
+        return {
+            'pre': calibration.calibrate(answers, pre_tests),
+            'post': calibration.calibrate(answers, post_tests),
+        }
+
     def get_expanded_pre_tests(self):
         """
         Return an IoSpec object with the result of pre tests expansions.
+
+        The result is shared by all callers in the current process and should
+        not be modified.
         """
 
-        state = self.get_current_test_state()
-        source = state.pre_tests_source_expansion
-        return parse_iospec(source)
+        return self._get_expanded_tests('pre')
 
     def get_expand_post_tests(self):
         """
         Return an IoSpec object with the result of post tests expansions.
+
+        The result is shared by all callers in the current process and should
+        not be modified.
         """
 
-        state = self.get_current_test_state()
-        source = state.post_tests_source_expansion
-        return parse_iospec(source)
+        return self._get_expanded_tests('post')
+
+    def _get_expanded_tests(self, which):
+        key = (self.id, self.test_state_hash, which)
+        tests = _expanded_tests_cache.get(key)
+        if tests is not None and self._has_new_timings(tests):
+            tests = None
+        if tests is None:
+            state = self.get_current_test_state()
+            source = getattr(state, '%s_tests_source_expansion' % which)
+            tests = parse_iospec(source)
+            tests.set_meta('test_state_hash', state.hash)
+            tests.set_meta('timings', (state.timings or {}).get(which))
+
+            # Outdated test states are used only while the current one is
+            # computed in the background
+            if state.hash == self.test_state_hash:
+                _expanded_tests_cache.set(key, tests)
+        return tests
+
+    def _has_new_timings(self, tests):
+        # Tests cached before the test state was calibrated by the background
+        # job (possibly in another process) must be reloaded.
+        if tests.meta.get('timings') is not None:
+            return False
+        state_hash = tests.meta.get('test_state_hash')
+        return calibration.is_enabled() \
+            and calibration.is_calibrated(self.id, state_hash)
+
+    def _discard_expanded_tests(self, hash):
+        for which in ['pre', 'post']:
+            _expanded_tests_cache.discard((self.id, hash, which))
 
     def __expand_tests_to_source(self, tests):
         """
@@ -291,6 +446,7 @@ class CodingIoQuestion(Question):
 
     # Saving & validation
     def save(self, *args, **kwargs):
+        old_hash = self.test_state_hash
         self.test_state_hash = compute_test_state_hash(self)
 
         if not self.author_name and self.owner:
@@ -299,14 +455,24 @@ class CodingIoQuestion(Question):
             self.author_name = '%s <%s>' % (name, email)
 
         super().save(*args, **kwargs)
+        self._update_test_state_hash()
 
-    def clean(self):
-        super().clean()
-
-        if self.has_test_state_changed() or self.has_code_changed():
+        # Tests are expanded in the background after the question is saved
+        if old_hash != self.test_state_hash:
             logger.debug('%r: recomputing tests' % self.title)
+            self._discard_expanded_tests(old_hash)
             self.schedule_validation()
 
+    def _update_test_state_hash(self):
+        # Answer keys are saved after the question row, hence the hash
+        # computed before saving may use outdated source hashes.
+        hash = compute_test_state_hash(self)
+        if hash != self.test_state_hash:
+            self.test_state_hash = hash
+            CodingIoQuestion.objects\
+                .filter(id=self.id)\
+                .update(test_state_hash=hash)
+
     def full_clean(self, *args, **kwargs):
         if self.__answers:
             self.answers = self.__answers
@@ -336,26 +502,52 @@ class CodingIoQuestion(Question):
         """
         Schedule full validation to be performed in the background.
 
-        This executes the full_clean_code() method
+        Validation runs after the current transaction commits and executes the
+        mark_invalid_code_fields() method.
         """
 
-        print('scheduling full code validation... (we are now executing on the'
-              'foreground).')
-        self.mark_invalid_code_fields()
+        from ..tasks import expand_test_state
+
+        def send_job():
+            if get_config('CODESCHOOL_BACKGROUND_VALIDATION', True):
+                expand_test_state.delay(self.id)
+            else:
+                self.mark_invalid_code_fields()
+
+        transaction.on_commit(send_job)
 
-    def mark_invalid_code_fields(self):
+    def mark_invalid_code_fields(self, calibrate=False):
         """
-        Performs a full code validation with .full_clean_code() and marks all
-        errors found in the question.
+        Performs a full validation of tests and answer keys, computes the
+        current test state and marks all errors found in the question.
+
+        If calibrate is True, also calibrate the timeouts of the test state
+        (see :meth:`get_current_test_state`).
+
+        Return True if no errors were found.
         """
 
-        return
+        error_field = error_message = ''
         try:
-            self.full_clean(force_expansions=True)
+            self.full_clean_answer_keys()
+            self.get_current_test_state(update=True, calibrate=calibrate)
         except ValidationError as ex:
-            print(ex)
-            print(dir(ex))
-            raise
+            if hasattr(ex, 'error_dict'):
+                error_field, errors = next(iter(ex.error_dict.items()))
+                error_message = '\n'.join(
+                    msg for error in errors for msg in error.messages
+                )
+            else:
+                error_message = '\n'.join(ex.messages)
+            logger.info('%r: invalid tests: %s' % (self.title, error_message))
+
+        self.error_field = error_field[:20]
+        self.error_message = error_message
+        CodingIoQuestion.objects\
+            .filter(id=self.id)\
+            .update(error_field=self.error_field,
+                    error_message=self.error_message)
+        return not error_message
 
     def validate_tests(self):
         """
@@ -517,15 +709,17 @@ class CodingIoQuestion(Question):
         language = get_programming_language(language)
         return super().submit(user_or_request, language=language, **kwargs)
 
-    def run_post_grading(self, **kwargs):
+    def run_post_grading(self):
         """
-        Runs post tests for all submissions made to this question.
+        Close question and schedule a job that runs post tests for all
+        submissions made to this question.
+
+        Return the id of the regrade job.
         """
 
-        for response in self.responses.all():
-            response.run_post_grading(tests=self.post_tests_expanded, **kwargs)
         self.closed = True
         self.save()
+        return self.regrade_post()
 
     def nav_section_for_activity(self, request):
         url = self.get_absolute_url
@@ -592,6 +786,58 @@ class CodingIoQuestion(Question):
             source=source,
         )
 
+    def serve_ajax_feedback(self, client, submission):
+        """
+        Grade submission inline or send it to the grading queue if
+        CODESCHOOL_ASYNC_GRADING is enabled.
+
+        Questions without instant_autograde are not graded here.
+        """
+
+        if not self.instant_autograde:
+            return super().serve_ajax_feedback(client, submission)
+        if not grading_queue.is_enabled():
+            feedback = submission.auto_feedback()
+            client.dialog(html=feedback.render_message())
+            return
+
+        ticket = grading_queue.enqueue(submission)
+        client.dialog(html=_('Your submission is on the correction queue!'))
+        self.schedule_grading_status_poll(client, ticket)
+
+    def schedule_grading_status_poll(self, client, ticket):
+        """
+        Makes the browser ask for the grading status of the given ticket after
+        a small delay.
+        """
+
+        delay = int(GRADING_STATUS_POLL_INTERVAL * 1000)
+        client.js(
+            'setTimeout(function () {'
+            '    srvice("grading-status.api", {ticket: %d});'
+            '}, %d);' % (ticket, delay)
+        )
+
+    @srvice.route(r'^grading-status.api/$')
+    def route_grading_status(self, client, ticket):
+        """
+        Show the feedback for the submission identified by the given ticket or
+        keep polling if it was not graded yet.
+        """
+
+        submissions = self.submissions.filter(progress__user=client.request.user)
+        if not submissions.filter(id=ticket).exists():
+            client.dialog(html=_('Submission not found.'))
+            return
+
+        feedback = self.feedback_class.objects\
+            .filter(submission_id=ticket)\
+            .first()
+        if feedback is None:
+            self.schedule_grading_status_poll(client, int(ticket))
+        else:
+            client.dialog(html=feedback.render_message())
+
     @srvice.route(r'^placeholder/$')
     def route_placeholder(self, request, language):
         """
@@ -605,10 +851,13 @@ class CodingIoQuestion(Question):
     #
     def regrade_post(self):
         """
-        Regrade all submissions using the post tests.
+        Schedule a job that regrades all submissions using the post tests.
+
+        Return the job id. Job progress can be inspected with
+        :func:`codeschool.questions.coding_io.regrade.job_status`.
         """
 
-        self.responses.regrade_with(self.post_tests_expanded)
+        return regrade.start_regrade(self, for_pre_test=False)
 
     def action_expand_tests(self, client, *args, **kwargs):
         self._expand_tests()
@@ -618,8 +867,9 @@ class CodingIoQuestion(Question):
                       '<h2>Post-test</h2><pre>%s</pre>' % (pre, post))
 
     def action_grade_with_post_tests(self, client, *args, **kwargs):
-        self.regrade_post()
-        client.dialog('<p>Successful operation!</p>')
+        job_id = self.regrade_post()
+        client.dialog('<p>Regrading submissions in the background (job %s).'
+                      '</p>' % job_id)
 
 
 def compute_test_state_hash(question):
@@ -671,12 +921,18 @@ def expand_tests_from_program(question, tests: IoSpec, language=None):
 
     language = get_programming_language(language)
     answer_key = question.answers.get(language=language)
+    return expand_tests_from_source(question, tests, answer_key.source,
+                                    language)
 
-    if not answer_key.source:
-        raise ValueError('cannot expand from %s: no program set' % language)
 
-    source = answer_key.source
-    language_ref = language.ejudge_ref()
+def expand_tests_from_source(question, tests: IoSpec, source, language):
+    """
+    Like expand_tests_from_program(), but uses the given source code instead of
+    fetching the reference program from the database.
+    """
+
+    if not source:
+        raise ValueError('cannot expand from %s: no program set' % language)
 
     if tests.is_simple:
         return tests.copy()
@@ -700,25 +956,32 @@ def check_expansions_with_all_programs(question, tests: IoSpec):
     program may be run with a different set of inputs.
     """
 
-    answers = list(question.answers_with_code())
+    answers = list(question.answers_with_code().select_related('language'))
 
     # We can get away with providing no checker program if the tests are
-    # simple.
-    if not answers and tests.is_expanded:
+    # simple. Tests that are not expanded cannot reach this point without an
+    # answer key (see expand_tests())
+    if not answers:
         return
 
     # Other cases require more work: first we expand for each possible
-    # language. Collect tuples of (expansion, language)
-    languages = [answer.language for answer in answers]
-    first, *tail = [
-        (expand_tests_from_program(question, tests, language), language)
-        for language in languages]
+    # language. Answer keys are fetched in the current thread and programs
+    # may run concurrently.
+    def expand(answer):
+        return expand_tests_from_source(question, tests, answer.source,
+                                        answer.language)
+
+    expansions = ejudge.map_programs(expand, answers)
 
     # All expansions should be equal.
-    for expansion in tail:
-        if expansion[0] != first[0]:
-            raise RuntimeError('different expansions yielded different ')
+    first, *tail = expansions
+    for answer, expansion in zip(answers[1:], tail):
+        if expansion != first:
+            raise validators.inconsistent_expansion_error(
+                answers[0].language, first,
+                answer.language, expansion,
+            )
 
     question.check_with_code(answers[0].source, tests, answers[0].language,
                              question.timeout)
-    return first[0]
+    return first
@@ -1,5 +1,3 @@
-import json
-
 from codeschool import models
 from codeschool.questions.models import QuestionSubmission
 from codeschool.utils import queryset_class, md5hash, manager_instance
@@ -23,10 +21,9 @@ class CodingIoSubmissionQuerySet(queryset_class(QuestionSubmission)):
         """
         Return a dictionary with source code from the best submission by each
         user.
-        """
 
-        def source(data):
-            return json.loads(data)['source']
+        With the default priority, this requires a single query.
+        """
 
         best = self.best_for_users(attrs, activity=activity)
         return {user: submission.source for user, submission in best.items()}
@@ -20,6 +20,14 @@ class TestState(models.Model):
     pre_tests_source_expansion = models.TextField(blank=True)
     post_tests_source_expansion = models.TextField(blank=True)
 
+    # Maps 'pre' and 'post' to dictionaries with the wall time of each test
+    # case for each answer key language (see the coding_io.calibration module)
+    timings = models.JSONField(blank=True, null=True)
+
+    # Snapshot of the number of failures of each 'pre' and 'post' test case
+    # (see the coding_io.failfast module)
+    failure_counts = models.JSONField(blank=True, null=True)
+
     @property
     def is_current(self):
         return self.hash == self.question.test_state_hash
@@ -0,0 +1,336 @@
+"""
+Batch regrading of CodingIoQuestion submissions.
+
+Regrading a question (e.g., running the post tests after the question closes)
+may involve thousands of submissions. Many of them are identical programs,
+hence the engine grades each distinct (source, language) pair only once and
+writes the results back in a few grouped queries:
+
+1. Submission ids and hashes are streamed from the database and grouped by
+   hash.
+2. Each distinct program is graded by a pool of worker threads (the programs
+   themselves run in sandboxed subprocesses).
+3. Feedback objects that share the same result are updated with a single
+   UPDATE query. Missing feedback objects are created individually since
+   bulk_create() does not support multi-table inheritance.
+4. Progress grades are recomputed from the best submission of each user and
+   written in bulk. Score boards are invalidated once.
+
+Regrading runs in a celery job. The job state (progress and ETA) is stored in
+the shared cache and can be polled with :func:`job_status`.
+"""
+import logging
+import time
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+from concurrent import futures
+
+from annoying.functions import get_config
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from codeschool import models
+from codeschool.lms.activities.score_board import invalidate_score_boards
+from . import feedback_cache
+from .calibration import case_timeouts
+from .ejudge import grade_code
+from .usage import ResourceUsage, FEEDBACK_FIELDS
+
+logger = logging.getLogger('codeschool.questions.coding_io')
+
+#: Expiration time (in seconds) of job records.
+JOB_TIMEOUT = 24 * 60 * 60
+
+#: Number of submissions fetched from the database in each query.
+CHUNK_SIZE = 500
+
+
+def regrade_workers():
+    """
+    Number of programs graded simultaneously by a regrade job.
+    """
+
+    return int(get_config('CODESCHOOL_REGRADE_WORKERS', 4))
+
+
+#
+# Job records
+#
+def _job_key(job_id):
+    return 'coding-io-regrade:%s' % job_id
+
+
+def job_status(job_id):
+    """
+    Return a dictionary with the state of the given regrade job or None if job
+    does not exist.
+
+    The dictionary has the following keys:
+        id, question, status ('pending', 'running', 'done' or 'failed'),
+        total, graded, unique, started, eta, error.
+    """
+
+    return cache.get(_job_key(job_id))
+
+
+def _update_job(job, **kwargs):
+    if job is not None:
+        job.update(kwargs)
+        cache.set(_job_key(job['id']), job, JOB_TIMEOUT)
+
+
+def fail_job(job_id, error):
+    """
+    Mark the given regrade job as failed.
+    """
+
+    _update_job(job_status(job_id), status='failed', error=str(error))
+
+
+def start_regrade(question, for_pre_test=False):
+    """
+    Schedule a regrade job for all submissions of the given question and
+    return the job id.
+    """
+
+    from .tasks import regrade_question
+
+    job_id = uuid.uuid4().hex
+    job = {
+        'id': job_id,
+        'question': question.id,
+        'status': 'pending',
+        'total': None,
+        'graded': 0,
+        'unique': None,
+        'started': None,
+        'eta': None,
+        'error': None,
+    }
+    _update_job(job)
+    transaction.on_commit(
+        lambda: regrade_question.delay(question.id, for_pre_test, job_id)
+    )
+    return job_id
+
+
+#
+# Regrade engine
+#
+def regrade_submissions(question, for_pre_test=False, job_id=None):
+    """
+    Regrade all submissions of the given question using the pre or post tests.
+
+    Return a dictionary with the number of graded submissions and distinct
+    programs.
+    """
+
+    job = job_status(job_id) if job_id else None
+    start = time.time()
+
+    try:
+        _update_job(job, status='running', started=start)
+        groups = _group_by_hash(question)
+        total = sum(len(ids) for ids in groups.values())
+        _update_job(job, total=total, unique=len(groups))
+
+        if for_pre_test:
+            tests = question.get_expanded_pre_tests()
+        else:
+            tests = question.get_expand_post_tests()
+
+        graded = 0
+        results = _grade_all(question, groups, tests, for_pre_test)
+        for hash, json_feedback, usage in results:
+            ids = groups[hash]
+            _write_feedback(question, ids, json_feedback, for_pre_test, usage)
+            graded += len(ids)
+            elapsed = time.time() - start
+            eta = elapsed / graded * (total - graded)
+            _update_job(job, graded=graded, eta=eta)
+
+        _update_progress_grades(question)
+        invalidate_score_boards(question.path)
+    except Exception as ex:
+        _update_job(job, status='failed', error=str(ex))
+        raise
+
+    _update_job(job, status='done', eta=0)
+    logger.info('%r: regraded %s submissions (%s distinct programs) in %.1fs' %
+                (question.title, total, len(groups), time.time() - start))
+    return {'total': total, 'unique': len(groups)}
+
+
+def _group_by_hash(question):
+    """
+    Map submission hashes to lists of submission ids.
+    """
+
+    groups = defaultdict(list)
+    rows = question.submissions\
+        .order_by()\
+        .values_list('id', 'hash')\
+        .iterator()
+    for id, hash in rows:
+        groups[hash].append(id)
+    return groups
+
+
+def _iter_programs(question, groups):
+    """
+    Yield (hash, source, language) tuples for each distinct program.
+    """
+
+    submission_class = question.submission_class
+    representatives = [ids[0] for ids in groups.values()]
+    for chunk in _chunks(representatives):
+        rows = submission_class.objects\
+            .filter(id__in=chunk)\
+            .select_related('language')\
+            .only('hash', 'source', 'language')
+        for submission in rows:
+            yield submission.hash, submission.source, submission.language
+
+
+def _grade_all(question, groups, tests, for_pre_test):
+    """
+    Grade each distinct program in a pool of workers.
+
+    Yield (hash, json_feedback, usage) tuples as results become available.
+    Usage is None for results taken from the feedback cache.
+    """
+
+    timeout = question.timeout
+    state_hash = question.test_state_hash
+
+    def grade(source, language_ref, timeouts):
+        usage = ResourceUsage()
+        feedback = grade_code(source, tests, lang=language_ref,
+                              timeout=timeout, usage=usage, timeouts=timeouts)
+        return feedback.to_json(), usage
+
+    with futures.ThreadPoolExecutor(regrade_workers()) as executor:
+        jobs = {}
+        for hash, source, language in _iter_programs(question, groups):
+            language_ref = language.ejudge_ref()
+            # Regrades always run all test cases (fail_fast=False)
+            timeouts = case_timeouts(tests, language_ref, timeout)
+            key = feedback_cache.feedback_key(hash, language_ref, state_hash,
+                                              for_pre_test, timeout, timeouts)
+            cached = feedback_cache.lookup(key)
+            if cached is not None:
+                yield hash, cached[0], None
+            else:
+                job = executor.submit(grade, source, language_ref, timeouts)
+                jobs[job] = hash, key
+
+        for job in futures.as_completed(jobs):
+            hash, key = jobs[job]
+            json_feedback, usage = job.result()
+            if tests.meta.get('test_state_hash') == state_hash:
+                feedback_cache.store(key, json_feedback)
+            yield hash, json_feedback, usage
+
+
+def _write_feedback(question, ids, json_feedback, for_pre_test, usage=None):
+    """
+    Write the given json feedback to all submissions with the given ids.
+
+    Resource usage fields are only updated if usage is given.
+    """
+
+    feedback_class = question.feedback_class
+    submission_class = question.submission_class
+
+    # Compute grades in a template object
+    template = feedback_class(manual_grading=False, for_pre_test=for_pre_test)
+    template.set_json_feedback(json_feedback)
+    template.update_final_grade()
+    fields = {}
+    if usage is not None:
+        template.set_usage(usage)
+        fields = {name: getattr(template, name) for name in FEEDBACK_FIELDS}
+
+    with transaction.atomic():
+        graded = set()
+        for chunk in _chunks(ids):
+            feedback_class.objects\
+                .filter(submission_id__in=chunk)\
+                .update(json_feedback=template.json_feedback,
+                        for_pre_test=for_pre_test,
+                        manual_grading=False,
+                        given_grade_pc=template.given_grade_pc,
+                        final_grade_pc=template.final_grade_pc,
+                        is_correct=template.is_correct,
+                        skipped=None,
+                        modified=timezone.now(),
+                        **fields)
+            graded.update(feedback_class.objects
+                          .filter(submission_id__in=chunk)
+                          .values_list('submission_id', flat=True))
+
+        missing = [id for id in ids if id not in graded]
+        for submission in submission_class.objects.filter(id__in=missing):
+            feedback = feedback_class(submission=submission,
+                                      manual_grading=False,
+                                      for_pre_test=for_pre_test)
+            feedback.set_json_feedback(json_feedback)
+            feedback.update_final_grade()
+            if usage is not None:
+                feedback.set_usage(usage)
+            feedback.save()
+
+
+def _update_progress_grades(question):
+    """
+    Recompute the grades and best submissions of all progress objects of the
+    question from the best regraded submission of each user.
+
+    Progress rows are written in bulk with a CASE expression per chunk.
+    Progress objects are not saved individually and no
+    submission_graded_signal is sent for each of them: listeners that
+    aggregate grades (e.g., score boards) are invalidated once by
+    :func:`regrade_submissions`.
+    """
+
+    from codeschool.lms.activities.models import Progress, Submission
+
+    best = Submission.objects.for_activity(question).best_ids()
+    with transaction.atomic():
+        for chunk in _chunks(list(best)):
+            grades = {
+                submission_id: (given or Decimal(0), final or Decimal(0),
+                                is_correct)
+                for submission_id, given, final, is_correct in
+                question.feedback_class.objects
+                .filter(submission_id__in=[best[id] for id in chunk])
+                .values_list('submission_id', 'given_grade_pc',
+                             'final_grade_pc', 'is_correct')
+            }
+            rows = {id: (best[id],) + grades[best[id]]
+                    for id in chunk if best[id] in grades}
+            if rows:
+                Progress.objects.filter(id__in=list(rows)).update(
+                    best_submission=_case(Progress, 'best_submission', rows, 0),
+                    given_grade_pc=_case(Progress, 'given_grade_pc', rows, 1),
+                    final_grade_pc=_case(Progress, 'final_grade_pc', rows, 2),
+                    is_correct=_case(Progress, 'is_correct', rows, 3),
+                    has_feedback=True,
+                )
+
+
+def _case(model, field, rows, idx):
+    # CASE expression that sets field to rows[id][idx] in the row with each
+    # id. Django does not provide a bulk update method.
+    return models.Case(
+        *[models.When(id=id, then=models.Value(values[idx]))
+          for id, values in rows.items()],
+        output_field=model._meta.get_field(field)
+    )
+
+
+def _chunks(seq):
+    for i in range(0, len(seq), CHUNK_SIZE):
+        yield seq[i:i + CHUNK_SIZE]
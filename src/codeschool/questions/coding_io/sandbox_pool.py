@@ -0,0 +1,384 @@
+"""
+Pools of warm sandbox workers for languages that run inside the Python
+interpreter (python and pytuga).
+
+Running a program through ejudge starts a new sandboxed interpreter that has
+to import ejudge and the language support modules before running any student
+code. For small programs, this dominates the grading time. A pool keeps a few
+pre-started workers (see :mod:`codeschool.questions.coding_io.sandbox_worker`)
+for each language. Jobs are sent to idle workers as JSON lines over a pipe.
+
+Student code never runs in the worker itself: each test case runs in a child
+forked from the warm worker, so jobs cannot affect each other. Workers are
+replaced after CODESCHOOL_SANDBOX_POOL_MAX_JOBS jobs, when they crash or when
+they miss the deadline of a job.
+"""
+import json
+import logging
+import os
+import queue
+import select
+import subprocess
+import sys
+import threading
+import time
+
+from annoying.functions import get_config
+from iospec import IoSpec, ErrorTestCase
+
+logger = logging.getLogger('codeschool.questions.coding_io')
+
+#: Languages that can be executed by warm workers.
+POOL_LANGUAGES = ('python', 'pytuga')
+
+#: Time (in seconds) that a worker may take beyond the job timeout before
+#: being killed.
+DEADLINE_MARGIN = 1.0
+
+#: Time (in seconds) that each test case may take beyond its timeout. It must
+#: be larger than sandbox_worker.KILL_MARGIN.
+CASE_MARGIN = 1.0
+
+#: Maximum time (in seconds) for a worker to start.
+STARTUP_TIMEOUT = 30.0
+
+#: Interval (in seconds) between checks for an available worker.
+IDLE_WAIT = 0.1
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'sandbox_worker.py')
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def is_enabled():
+    """
+    Return True if python and pytuga programs should run in warm workers.
+    """
+
+    return bool(get_config('CODESCHOOL_SANDBOX_POOL', True))
+
+
+def pool_size():
+    """
+    Number of workers in each language pool.
+    """
+
+    return int(get_config('CODESCHOOL_SANDBOX_POOL_SIZE', 4))
+
+
+def max_jobs():
+    """
+    Number of jobs executed by a worker before it is replaced.
+    """
+
+    return int(get_config('CODESCHOOL_SANDBOX_POOL_MAX_JOBS', 100))
+
+
+class WorkerError(RuntimeError):
+    """
+    Raised when a worker crashes or sends an invalid response.
+    """
+
+
+class SandboxWorker:
+    """
+    A running sandbox worker process.
+    """
+
+    def __init__(self, lang, sandbox=True):
+        from boxed.core import pythonpath
+
+        if sandbox:
+            command = ['python_boxed', '-S', '-s', WORKER_SCRIPT, lang,
+                       'nobody']
+        else:
+            command = [sys.executable, '-S', '-s', WORKER_SCRIPT, lang]
+        self.lang = lang
+        self.jobs = 0
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            env={'PYTHONPATH': pythonpath(),
+                 'PATH': os.environ.get('PATH', os.defpath)},
+        )
+        try:
+            header = self._receive(STARTUP_TIMEOUT)
+        except (TimeoutError, WorkerError):
+            self.kill()
+            raise
+        if header.get('status') != 'ready':
+            self.kill()
+            raise WorkerError('invalid worker header: %r' % header)
+
+    def _receive(self, timeout):
+        stdout = self.process.stdout
+        ready, _, _ = select.select([stdout], [], [], timeout)
+        if not ready:
+            raise TimeoutError
+        line = stdout.readline()
+        if not line:
+            raise WorkerError('worker exited with code %s' %
+                              self.process.poll())
+        try:
+            return json.loads(line)
+        except ValueError:
+            raise WorkerError('invalid response: %r' % line)
+
+    def run(self, source, inputs, timeout, compare_streams=False, fast=False,
+            timeouts=None):
+        """
+        Run source with the given list of lists of inputs and return a
+        response dictionary (see the sandbox_worker module).
+
+        Raises TimeoutError if the worker does not answer before the deadline.
+        """
+
+        job = {
+            'source': source,
+            'inputs': inputs,
+            'timeout': timeout,
+            'timeouts': timeouts,
+            'compare_streams': compare_streams,
+            'fast': fast,
+        }
+        self.jobs += 1
+        try:
+            self.process.stdin.write(json.dumps(job) + '\n')
+            self.process.stdin.flush()
+        except OSError as ex:
+            raise WorkerError(ex)
+
+        # Each test case may take up to timeout seconds plus the time the
+        # worker takes to kill it
+        if not timeouts:
+            timeouts = [timeout or 0] * max(len(inputs), 1)
+        deadline = sum(timeouts) + CASE_MARGIN * len(timeouts)
+        return self._receive(deadline + DEADLINE_MARGIN)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def kill(self):
+        if self.is_alive():
+            self.process.kill()
+        self.process.wait()
+
+
+class SandboxPool:
+    """
+    A fixed size pool of warm workers for a single language.
+    """
+
+    def __init__(self, lang, size=None, jobs_per_worker=None, sandbox=True):
+        self.lang = lang
+        self.size = size or pool_size()
+        self.jobs_per_worker = jobs_per_worker or max_jobs()
+        self.sandbox = sandbox
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._started = 0
+        self.counters = {
+            'jobs': 0,
+            'busy': 0,
+            'started': 0,
+            'recycled': 0,
+            'crashed': 0,
+            'timeouts': 0,
+        }
+
+    def _count(self, name, delta=1):
+        with self._lock:
+            self.counters[name] += delta
+
+    def _acquire(self):
+        # Start a new worker if the pool is not full. Otherwise, wait for an
+        # idle one. Workers may be recycled while we wait, hence we check the
+        # number of running workers periodically.
+        while True:
+            worker = self._get_idle()
+            if worker is not None:
+                return worker
+            if self._reserve():
+                return self._start()
+            worker = self._get_idle(IDLE_WAIT)
+            if worker is not None:
+                return worker
+
+    def _get_idle(self, timeout=None):
+        try:
+            if timeout is None:
+                return self._idle.get_nowait()
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _reserve(self):
+        with self._lock:
+            if self._started < self.size:
+                self._started += 1
+                return True
+            return False
+
+    def _start(self):
+        try:
+            worker = SandboxWorker(self.lang, self.sandbox)
+        except Exception:
+            with self._lock:
+                self._started -= 1
+            raise
+        self._count('started')
+        return worker
+
+    def _release(self, worker, recycle=False):
+        is_exhausted = worker.jobs >= self.jobs_per_worker
+        if recycle or is_exhausted or not worker.is_alive():
+            worker.kill()
+            with self._lock:
+                self._started -= 1
+            self._count('recycled')
+        else:
+            self._idle.put(worker)
+
+    def run(self, source, inputs, timeout, compare_streams=False, fast=False,
+            usage=None, timeouts=None):
+        """
+        Run source code with the given list of lists of inputs in a warm
+        worker and return the resulting IoSpec.
+
+        If fast is True, execution stops at the first error test case. The
+        resources spent by each test case are registered in the given
+        :class:`codeschool.questions.coding_io.usage.ResourceUsage` object.
+        An optional list of timeouts overrides the timeout of each test case.
+        """
+
+        start = time.perf_counter()
+        try:
+            response = self._run_job(source, inputs, timeout, compare_streams,
+                                     fast, timeouts)
+        except TimeoutError:
+            if usage is not None:
+                usage.add_total(time.perf_counter() - start)
+            return IoSpec([ErrorTestCase.timeout()])
+        return self._unpack(response, usage)
+
+    def _unpack(self, response, usage):
+        # Return the IoSpec result of a response and register log messages and
+        # resource usage.
+        for level, message in response.get('messages', ()):
+            getattr(logger, level)(message)
+        if response['status'] != 'ok':
+            raise WorkerError(response.get('error', 'unknown error'))
+        if usage is not None:
+            for wall, cpu, rss in response.get('usage', ()):
+                usage.add_case(wall, cpu, rss)
+        return IoSpec.from_json(response['result'])
+
+    def _run_job(self, *args):
+        # Run job in an idle worker and return the response dictionary.
+        worker = self._acquire()
+        self._count('busy')
+        self._count('jobs')
+        recycle = True
+        try:
+            response = worker.run(*args)
+        except TimeoutError:
+            self._count('timeouts')
+            raise
+        except WorkerError:
+            self._count('crashed')
+            raise
+        else:
+            recycle = False
+        finally:
+            self._count('busy', -1)
+            self._release(worker, recycle)
+        return response
+
+    def metrics(self):
+        """
+        Return a dictionary with the pool size, utilization and worker
+        counters.
+        """
+
+        with self._lock:
+            data = dict(self.counters, lang=self.lang, size=self.size,
+                        running=self._started, idle=self._idle.qsize())
+        data['utilization'] = data['busy'] / self.size
+        return data
+
+    def close(self):
+        """
+        Kill all idle workers.
+        """
+
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.kill()
+            with self._lock:
+                self._started -= 1
+
+
+def get_pool(lang, sandbox=True):
+    """
+    Return the pool of workers for the given language or None if language
+    cannot be executed by warm workers.
+    """
+
+    if lang not in POOL_LANGUAGES or not is_enabled():
+        return None
+    key = lang, sandbox
+    try:
+        return _pools[key]
+    except KeyError:
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key] = SandboxPool(lang, sandbox=sandbox)
+            return _pools[key]
+
+
+def run(source, inputs, lang, timeout, sandbox=True, compare_streams=False,
+        fast=False, usage=None, timeouts=None):
+    """
+    Run program in a warm worker and return the resulting IoSpec.
+
+    Return None if the language is not supported by the pool or if the worker
+    failed. Callers should then use the regular ejudge functions.
+    """
+
+    pool = get_pool(lang, sandbox)
+    if pool is None:
+        return None
+    if isinstance(inputs, IoSpec):
+        inputs = inputs.inputs()
+    inputs = [list(map(str, case)) for case in inputs]
+
+    try:
+        return pool.run(source, inputs, timeout, compare_streams, fast,
+                        usage, timeouts)
+    except Exception as ex:
+        logger.warning('sandbox pool failed (%s): falling back to ejudge' % ex)
+        return None
+
+
+def metrics():
+    """
+    Return a list with the metrics of all pools in the current process.
+    """
+
+    return [pool.metrics() for pool in list(_pools.values())]
+
+
+def close_all():
+    """
+    Kill all idle workers of all pools.
+    """
+
+    for pool in list(_pools.values()):
+        pool.close()
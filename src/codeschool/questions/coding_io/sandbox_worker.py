@@ -0,0 +1,259 @@
+"""
+Warm sandbox worker.
+
+This script is executed as a standalone program by
+:mod:`codeschool.questions.coding_io.sandbox_pool` (it must not import Django
+or codeschool modules). It pre-imports ejudge and the language support
+modules, lowers its privileges and then runs jobs received as JSON lines.
+
+Student code never runs in the worker process. Each test case runs in a child
+process forked from the warm worker. The child closes the protocol file
+descriptors before running any student code and sends its result back through
+a pipe that is used only once. Changes to the global state (builtins,
+imported modules, etc) die with the child and cannot leak into other jobs.
+The worker measures the resources of each child with os.wait4().
+
+Usage:
+    python_boxed -S -s sandbox_worker.py <lang> [<user>]
+
+Each job is a JSON object with the keys source, inputs, timeout,
+compare_streams, fast and an optional list with the timeout of each test case
+(timeouts). Jobs never contain the expected outputs: results are compared with
+the answer key by the grading process. The response is a JSON object with the
+keys:
+
+    status:
+        'ok' or 'error'.
+    result:
+        The resulting IoSpec JSON data (if status is 'ok').
+    messages:
+        A list of (level, message) log messages.
+    usage:
+        A list of [wall time, CPU time, peak RSS] triples for each executed
+        test case. Times are in seconds and RSS is in kB.
+    error:
+        The traceback (if status is 'error').
+"""
+import json
+import os
+import pwd
+import select
+import signal
+import sys
+import time
+import traceback
+
+#: Time (in seconds) that a test case may run beyond its timeout before the
+#: child process is killed.
+KILL_MARGIN = 0.5
+
+
+def open_channels():
+    """
+    Move the protocol streams to private file descriptors and point stdin and
+    stdout to /dev/null so student code cannot interfere with the protocol.
+    """
+
+    reader = os.fdopen(os.dup(0), 'r', encoding='utf8')
+    writer = os.fdopen(os.dup(1), 'w', encoding='utf8')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    sys.stdin = open(os.devnull, 'r')
+    sys.stdout = open(os.devnull, 'w')
+    return reader, writer
+
+
+def send(writer, data):
+    writer.write(json.dumps(data) + '\n')
+    writer.flush()
+
+
+def lower_privileges(username):
+    if username == 'root':
+        raise PermissionError('cannot run sandbox as root')
+    os.setuid(pwd.getpwnam(username).pw_uid)
+
+
+def run_case(job, inputs, timeout, lang):
+    """
+    Run a single test case in the current process and return a JSON
+    serializable dictionary with the result and log messages.
+    """
+
+    from ejudge.functions import run_worker
+
+    result, messages = run_worker(job['source'], [inputs], lang,
+                                  timeout=timeout,
+                                  compare_streams=job['compare_streams'],
+                                  sandbox=False,
+                                  is_sandboxed=True,
+                                  raises=False)
+    return {'result': result, 'messages': messages}
+
+
+def run_in_child(func, closed_fds, timeout):
+    """
+    Execute func() in a forked child process.
+
+    Return a tuple (data, usage) with the raw bytes sent by the child (None if
+    it was killed after the timeout) and a [wall, cpu, rss] list with the
+    resources spent by the child.
+    """
+
+    read_fd, write_fd = os.pipe()
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        for fd in closed_fds:
+            os.close(fd)
+        _child_main(func, write_fd)
+
+    os.close(write_fd)
+    deadline = None if timeout is None else start + timeout + KILL_MARGIN
+    try:
+        data = read_all(read_fd, deadline)
+    finally:
+        os.close(read_fd)
+
+    # Processes started by the student code are in the child's process group
+    for target in (pid, -pid):
+        try:
+            os.kill(target, signal.SIGKILL)
+        except OSError:
+            pass
+    _, _, rusage = os.wait4(pid, 0)
+    cpu = rusage.ru_utime + rusage.ru_stime
+    return data, [time.perf_counter() - start, cpu, rusage.ru_maxrss]
+
+
+def _child_main(func, write_fd):
+    # Never returns: the child must not run the worker loop
+    try:
+        os.setpgid(0, 0)
+        try:
+            data = func()
+        except BaseException:
+            data = {'error': traceback.format_exc()}
+        with os.fdopen(write_fd, 'wb') as fd:
+            fd.write(json.dumps(data).encode('utf8'))
+    finally:
+        os._exit(0)
+
+
+def read_all(fd, deadline=None):
+    """
+    Read from file descriptor until EOF. Return None if deadline passes
+    before that.
+    """
+
+    chunks = []
+    while True:
+        remaining = None if deadline is None else deadline - time.perf_counter()
+        if remaining is not None and remaining <= 0:
+            return None
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if not ready:
+            return None
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def parse_case(data, inputs):
+    """
+    Return a (IoSpec, messages) pair from the data sent by a child process
+    that ran the given inputs.
+    """
+
+    from iospec import IoSpec, ErrorTestCase, In
+
+    if data is None:
+        return IoSpec([ErrorTestCase.timeout(map(In, inputs))]), []
+    payload = _load_payload(data)
+    if 'error' in payload:
+        raise RuntimeError(payload['error'])
+    try:
+        return IoSpec.from_json(payload['result']), list(payload['messages'])
+    except Exception:
+        # The child crashed or student code wrote to the result pipe
+        error = ErrorTestCase.runtime(
+            map(In, inputs),
+            error_message='RuntimeError: program terminated unexpectedly.'
+        )
+        return IoSpec([error]), []
+
+
+def _load_payload(data):
+    try:
+        payload = json.loads(data.decode('utf8'))
+    except ValueError:
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+
+def run_job(job, lang, closed_fds):
+    """
+    Run each test case of job in a separate child process and return a tuple
+    (result, messages, usage).
+    """
+
+    from iospec import IoSpec
+
+    cases, messages, usage = [], [], []
+    timeouts = job.get('timeouts') or [job['timeout']] * len(job['inputs'])
+    for inputs, timeout in zip(job['inputs'], timeouts):
+        data, case_usage = run_in_child(
+            lambda: run_case(job, inputs, timeout, lang), closed_fds, timeout
+        )
+        result, case_messages = parse_case(data, inputs)
+        usage.append(case_usage)
+        cases.extend(result)
+        messages.extend(case_messages)
+        if result.has_error_test_case:
+            if result.get_error_type() == 'build' or job.get('fast'):
+                break
+
+    spec = IoSpec(cases)
+    spec.set_meta('lang', lang)
+    return spec.to_json(), messages, usage
+
+
+def handle(line, lang, closed_fds):
+    """
+    Return the response to the given job line.
+    """
+
+    try:
+        result, messages, usage = run_job(json.loads(line), lang, closed_fds)
+    except Exception:
+        return {'status': 'error', 'error': traceback.format_exc()}
+    return {'status': 'ok', 'result': result, 'messages': messages,
+            'usage': usage}
+
+
+def main(lang, user=None):
+    reader, writer = open_channels()
+
+    # Import ejudge and the language support modules by running a trivial
+    # program in the worker itself
+    run_case({'source': '', 'compare_streams': False}, [], None, lang)
+
+    if user:
+        lower_privileges(user)
+
+    protocol_fds = [reader.fileno(), writer.fileno()]
+    send(writer, {'status': 'ready', 'pid': os.getpid()})
+    for line in reader:
+        send(writer, handle(line, lang, protocol_fds))
+
+
+if __name__ == '__main__':
+    # The script directory has a module named ejudge that would shadow the
+    # ejudge package.
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:] = [path for path in sys.path
+                   if os.path.abspath(path or '.') != script_dir]
+    main(*sys.argv[1:])
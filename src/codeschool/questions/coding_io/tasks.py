@@ -1,6 +1,74 @@
+import logging
+import time
+
 from celery import shared_task
 
+from . import grading_queue
+
+logger = logging.getLogger('codeschool.questions.coding_io')
+
 
 @shared_task
 def test_task(*args, **kwargs):
     print('task called with %s args and %s kwargs' % (args, kwargs))
+
+
+@shared_task(bind=True, max_retries=grading_queue.SLOT_MAX_RETRIES,
+             ignore_result=True)
+def grade_submission(self, submission_id, enqueued_at):
+    """
+    Performs the automatic grading of the submission with the given id.
+
+    Jobs that could not acquire a grading slot after SLOT_MAX_RETRIES
+    attempts are graded anyway.
+    """
+
+    from .models import CodingIoSubmission
+
+    is_last_attempt = self.request.retries >= self.max_retries
+    if not grading_queue.acquire_slot(force=is_last_attempt):
+        raise self.retry(countdown=grading_queue.SLOT_RETRY_DELAY)
+    if is_last_attempt:
+        logger.warning('submission %s graded beyond the concurrency limit' %
+                       submission_id)
+
+    try:
+        submission = CodingIoSubmission.objects.get(id=submission_id)
+        if not submission.has_feedback:
+            submission.auto_feedback()
+    finally:
+        grading_queue.release_slot()
+    grading_queue.register_latency(time.time() - enqueued_at)
+
+
+@shared_task(ignore_result=True)
+def expand_test_state(question_id):
+    """
+    Computes the current test state of the question with the given id,
+    calibrate its timeouts and register any validation errors in the question.
+    """
+
+    from .models import CodingIoQuestion
+
+    try:
+        question = CodingIoQuestion.objects.get(id=question_id)
+    except CodingIoQuestion.DoesNotExist:
+        return
+    question.mark_invalid_code_fields(calibrate=True)
+
+
+@shared_task(ignore_result=True)
+def regrade_question(question_id, for_pre_test, job_id):
+    """
+    Regrade all submissions of the question with the given id.
+    """
+
+    from .models import CodingIoQuestion
+    from .regrade import regrade_submissions, fail_job
+
+    try:
+        question = CodingIoQuestion.objects.get(id=question_id)
+    except Exception as ex:
+        fail_job(job_id, ex)
+        raise
+    regrade_submissions(question, for_pre_test, job_id)
@@ -0,0 +1,60 @@
+import os
+import stat
+
+import ejudge
+import pytest
+
+from codeschool.questions.coding_io import build_cache
+from iospec import Out, In, StandardTestCase
+
+C_SOURCE = r'''#include <stdio.h>
+int main() {
+    char name[100];
+    printf("x: ");
+    scanf("%99s", name);
+    printf("%s\n", name);
+    return 0;
+}
+'''
+
+
+@pytest.fixture
+def cache_dir(settings, tmpdir):
+    path = str(tmpdir.join('cache'))
+    settings.CODESCHOOL_BUILD_CACHE_DIR = path
+    return path
+
+
+def run_artifact(source, lang):
+    return ejudge.run(source, [['foo']], lang=lang, sandbox=False,
+                      raises=False, timeout=5)
+
+
+def test_prepare_compiles_into_private_cache_dir(cache_dir):
+    source, lang = build_cache.prepare(C_SOURCE, 'c', sandbox=False)
+    key = build_cache.artifact_key(C_SOURCE, 'c')
+    assert lang == build_cache.ARTIFACT_LANGUAGE
+    assert os.listdir(cache_dir) == [key]
+    assert stat.S_IMODE(os.stat(cache_dir).st_mode) == 0o700
+    assert cache_dir not in source
+
+
+def test_prepare_reuses_cached_executable(cache_dir, monkeypatch):
+    build_cache.prepare(C_SOURCE, 'c', sandbox=False)
+    monkeypatch.setattr(build_cache, '_compile', None)
+    source, lang = build_cache.prepare(C_SOURCE, 'c', sandbox=False)
+    result = run_artifact(source, lang)
+    assert list(result) == [
+        StandardTestCase([Out('x: '), In('foo'), Out('foo')])
+    ]
+
+
+def test_prepare_does_not_cache_build_errors(cache_dir):
+    source, lang = build_cache.prepare('int main() {', 'c', sandbox=False)
+    assert (source, lang) == ('int main() {', 'c')
+    assert os.listdir(cache_dir) == []
+
+
+def test_artifact_build_manager_rejects_invalid_payload():
+    result = run_artifact('{"source": ""}', build_cache.ARTIFACT_LANGUAGE)
+    assert result.get_error_type() == 'build'
@@ -139,3 +139,105 @@ def test_fibonacci_question_creation(db):
     assert question.post_tests is not None
     assert question.post_tests.is_expanded is False
     assert question.answers.count() == 1
+
+
+def test_regrade_submissions_with_post_tests(db, user, request_with_user):
+    from codeschool.questions.coding_io.regrade import regrade_submissions
+
+    question = example('simple')
+    submission = question.submit(request_with_user,
+                                 source=source('hello.py'),
+                                 language='python')
+    submission.auto_feedback()
+    result = regrade_submissions(question)
+    assert result == {'total': 1, 'unique': 1}
+
+    feedback = Feedback.objects.get(submission=submission)
+    assert feedback.for_pre_test is False
+    assert feedback.given_grade_pc == 100
+    submission.progress.refresh_from_db()
+    assert submission.progress.is_correct
+
+
+def test_regrade_updates_progress_grades_in_bulk(db, user, rf):
+    from codeschool.accounts.factories import UserFactory
+    from codeschool.lms.activities.models import Progress
+    from codeschool.lms.activities.signals import submission_graded_signal
+    from codeschool.questions.coding_io.regrade import regrade_submissions
+
+    question = example('simple')
+    submissions = []
+    for src in ['hello.py', 'hello-wrong.py']:
+        request = rf.get('/')
+        request.user = UserFactory.create()
+        submission = question.submit(request, source=source(src),
+                                     language='python')
+        submission.auto_feedback()
+        submissions.append(submission)
+    good, bad = submissions
+
+    # Regrades must also decrease grades
+    Progress.objects.filter(id=good.progress_id)\
+        .update(given_grade_pc=0, final_grade_pc=0, is_correct=False,
+                best_submission=None)
+    Progress.objects.filter(id=bad.progress_id)\
+        .update(given_grade_pc=100, final_grade_pc=100, is_correct=True)
+
+    received = []
+
+    def receiver(sender, submission, **kwargs):
+        received.append(submission.id)
+
+    submission_graded_signal.connect(receiver)
+    try:
+        regrade_submissions(question)
+    finally:
+        submission_graded_signal.disconnect(receiver)
+    assert received == []
+
+    good_progress = Progress.objects.get(id=good.progress_id)
+    assert good_progress.final_grade_pc == 100
+    assert good_progress.is_correct
+    assert good_progress.best_submission_id == good.id
+    bad_progress = Progress.objects.get(id=bad.progress_id)
+    assert bad_progress.final_grade_pc == 0
+    assert not bad_progress.is_correct
+    assert bad_progress.best_submission_id == bad.id
+
+
+def test_best_submission_is_maintained(db, user, request_with_user):
+    from codeschool.questions.coding_io.models import CodingIoSubmission
+
+    question = example('simple')
+    good = question.submit(request_with_user, source=source('hello.py'),
+                           language='python')
+    good.auto_feedback()
+    bad = question.submit(request_with_user, source=source('hello-wrong.py'),
+                          language='python')
+    bad.auto_feedback()
+
+    bad.progress.refresh_from_db()
+    assert bad.progress.best_submission_id == good.id
+    codes = CodingIoSubmission.objects\
+        .for_activity(question)\
+        .best_code_for_users()
+    assert codes == {user: good.source}
+
+
+def test_best_submission_without_pointer(db, user, request_with_user):
+    from codeschool.lms.activities.models import Progress
+    from codeschool.questions.coding_io.models import CodingIoSubmission
+
+    question = example('simple')
+    good = question.submit(request_with_user, source=source('hello.py'),
+                           language='python')
+    good.auto_feedback()
+    bad = question.submit(request_with_user, source=source('hello-wrong.py'),
+                          language='python')
+    bad.auto_feedback()
+
+    Progress.objects.filter(id=good.progress_id).update(best_submission=None)
+    codes = CodingIoSubmission.objects\
+        .for_activity(question)\
+        .best_code_for_users()
+    assert codes == {user: good.source}
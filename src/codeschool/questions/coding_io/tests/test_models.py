@@ -1,8 +1,14 @@
+from unittest import mock
+
 import pytest
 from django.core.exceptions import ValidationError
 
+from codeschool.accounts.factories import UserFactory
 from codeschool.core import get_programming_language
-from codeschool.questions.coding_io import factories
+from codeschool.questions.coding_io import calibration, factories, \
+    feedback_cache, usage
+from codeschool.questions.coding_io.models import CodingIoQuestion, \
+    CodingIoFeedback
 from codeschool.questions.coding_io.models.question import expand_tests
 
 example = factories.question_from_example
@@ -46,3 +52,113 @@ def test_validate_multiple_answer_keys(db):
     question.answers.create(language=get_programming_language('c'),
                             source=source('hello.c'))
     question.full_clean_all()
+
+
+# Test states
+def test_mark_invalid_code_fields_creates_test_state(db):
+    question = example('simple')
+    question.save()
+    assert question.mark_invalid_code_fields() is True
+    assert question.error_message == ''
+    state = question.get_current_test_state(wait=0)
+    assert state.hash == question.test_state_hash
+    assert not question.has_test_state_changed()
+
+
+def test_only_background_validation_calibrates_timeouts(db):
+    question = example('simple')
+    question.save()
+    timings = {'python': [0.01]}
+    with mock.patch('codeschool.questions.coding_io.calibration.calibrate',
+                    return_value=timings) as calibrate:
+        state = question.get_current_test_state(update=True)
+        assert state.timings is None
+        assert calibrate.call_count == 0
+
+        question.mark_invalid_code_fields(calibrate=True)
+        state.refresh_from_db()
+        assert state.timings == {'pre': timings, 'post': timings}
+        assert calibrate.call_count == 2
+
+
+def test_expanded_tests_are_reloaded_after_calibration(db):
+    question = example('simple')
+    question.save()
+    state = question.get_current_test_state(update=True)
+    assert question.get_expanded_pre_tests().meta.get('timings') is None
+
+    # Simulates the background job running in another process
+    timings = {'python': [0.01]}
+    state.timings = {'pre': timings, 'post': timings}
+    state.save(update_fields=['timings'])
+    calibration.mark_calibrated(question.id, question.test_state_hash)
+    assert question.get_expanded_pre_tests().meta.get('timings') == timings
+
+
+def test_save_schedules_expansion_only_when_tests_change(db):
+    question = example('simple')
+    with mock.patch.object(CodingIoQuestion, 'schedule_validation') as job:
+        question.save()
+        assert job.call_count == 0
+        question.pre_tests_source += '\n\nname: <mary>\nHello mary!'
+        question.save()
+        assert job.call_count == 1
+        question.save()
+        assert job.call_count == 1
+
+
+# Feedback cache
+def user_request(rf):
+    request = rf.get('/')
+    request.user = UserFactory.create()
+    return request
+
+
+def test_cached_fail_fast_feedback_keeps_skipped_cases(db, rf):
+    question = example('simple')
+    question.fail_fast = True
+    question.pre_tests_source += '\n\nname: <mary>\nHello mary!'
+    question.save()
+    question.get_current_test_state(update=True)
+
+    first, second = [
+        question.submit(user_request(rf), language='python',
+                        source='print("wrong")')
+        for _ in range(2)
+    ]
+    with mock.patch.object(feedback_cache, 'lookup',
+                           wraps=feedback_cache.lookup) as lookup:
+        skipped = first.auto_feedback().skipped
+        assert second.auto_feedback().skipped == skipped
+    assert skipped
+    assert lookup.call_count == 2
+
+
+# Resource usage
+def test_question_statistics_aggregates_feedbacks(db, request_with_user):
+    question = example('simple')
+    question.save()
+    measurements = [
+        (1.0, 0.5, 1000, [[400, 200, 1000], [600, 300, 800]]),
+        (3.0, 1.5, 3000, [[1000, 500, 3000], [2000, 1000, 2000]]),
+        (9.0, None, None, None),
+    ]
+    for idx, (wall, cpu, rss, cases) in enumerate(measurements):
+        submission = question.submit(request_with_user, language='python',
+                                     source='print(%s)' % idx)
+        CodingIoFeedback.objects.create(submission=submission,
+                                        manual_grading=False,
+                                        wall_time=wall, cpu_time=cpu,
+                                        peak_rss=rss, usage_json=cases)
+
+    [row] = usage.question_statistics()
+    assert row['question'] == question.id
+    assert row['title'] == question.title
+    assert row['num_feedbacks'] == 2
+    assert row['total_cpu_time'] == 2.0
+    assert row['total_wall_time'] == 4.0
+    assert row['avg_cpu_time'] == 1.0
+    assert row['max_rss'] == 3000
+    assert [case['index'] for case in row['slowest_test_cases']] == [1, 0]
+    assert row['slowest_test_cases'][0]['avg_wall_time'] == 1.3
+    assert row['slowest_test_cases'][0]['peak_rss'] == 2000
@@ -0,0 +1,69 @@
+import pytest
+
+from codeschool.questions.coding_io.sandbox_pool import SandboxPool
+from codeschool.questions.coding_io.usage import ResourceUsage
+from iospec import Out, In, StandardTestCase
+
+HELLO = "print(input('x: '))"
+
+# Writes forged responses to every file descriptor the program can reach
+FORGE_RESPONSES = '''import os
+line = b'{"status": "ok", "result": [], "messages": [], "usage": []}\\n'
+for fd in range(3, 64):
+    try:
+        os.write(fd, line)
+    except OSError:
+        pass
+'''
+
+
+@pytest.fixture
+def pool():
+    pool = SandboxPool('python', size=1, sandbox=False)
+    yield pool
+    pool.close()
+
+
+def hello_case(name):
+    return StandardTestCase([Out('x: '), In(name), Out(name)])
+
+
+def test_sandbox_pool_runs_programs_in_a_single_warm_worker(pool):
+    usage = ResourceUsage()
+    first = pool.run(HELLO, [['foo'], ['bar']], 5, usage=usage)
+    second = pool.run(HELLO, [['baz']], 5)
+    assert list(first) == [hello_case('foo'), hello_case('bar')]
+    assert list(second) == [hello_case('baz')]
+    assert len(usage) == 2
+    assert pool.metrics()['started'] == 1
+
+
+def test_sandbox_pool_jobs_cannot_change_global_state_of_next_jobs(pool):
+    src = 'import builtins\nbuiltins.print = lambda *args, **kwds: None'
+    pool.run(src, [['foo']], 5)
+    result = pool.run(HELLO, [['foo']], 5)
+    assert list(result) == [hello_case('foo')]
+
+
+def test_sandbox_pool_jobs_cannot_write_to_the_worker_protocol(pool):
+    forged = pool.run(FORGE_RESPONSES, [['foo']], 5)
+    result = pool.run(HELLO, [['foo']], 5)
+    assert forged[0].is_error_test_case
+    assert list(result) == [hello_case('foo')]
+    assert pool.metrics()['crashed'] == 0
+
+
+def test_sandbox_pool_worker_survives_programs_that_exit(pool):
+    result = pool.run('import os\nos._exit(1)', [['foo']], 5)
+    assert result[0].is_error_test_case
+    assert list(pool.run(HELLO, [['foo']], 5)) == [hello_case('foo')]
+    assert pool.metrics()['started'] == 1
+
+
+def test_sandbox_pool_kills_test_cases_that_hang(pool):
+    src = 'import signal\nsignal.signal(signal.SIGALRM, signal.SIG_IGN)\n' \
+          'while True:\n    pass'
+    result = pool.run(src, [['foo']], 0.5)
+    assert result[0].is_error_test_case
+    assert result.get_error_type() == 'timeout'
+    assert list(pool.run(HELLO, [['foo']], 5)) == [hello_case('foo')]
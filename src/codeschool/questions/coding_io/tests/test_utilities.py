@@ -1,4 +1,22 @@
-from codeschool.questions.coding_io.ejudge import expand_from_code
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import RequestFactory
+
+from codeschool.questions.coding_io import build_cache, feedback_cache, \
+    grading_queue, usage
+from codeschool.questions.coding_io.views import usage_statistics_view
+from codeschool.questions.coding_io.calibration import case_timeouts
+from codeschool.questions.coding_io.failfast import Outcome
+from codeschool.questions.coding_io.sandbox_pool import SandboxWorker
+
+from codeschool.questions.coding_io.ejudge import expand_from_code, \
+    grade_code, grade_code_parallel, ejudge_kwargs
+from codeschool.questions.coding_io.validators import \
+    inconsistent_expansion_error
 from iospec import parse, Out, In, StandardTestCase
 
 
@@ -17,3 +35,182 @@ def test_expand_from_code_keep_simple_cases():
     expanded = expand_from_code(src, iospec, lang='python')
     expected = StandardTestCase([Out('x: '), In('foo'), Out('foo')])
     assert expanded[0] == expected
+
+
+def test_parallel_grading_selects_first_wrong_case():
+    src = "x = input('x: ')\nprint(x if x != 'bar' else 'wrong')"
+    iospec = parse(
+        'x: <foo>\n'
+        'foo\n'
+        '\n'
+        'x: <bar>\n'
+        'bar\n'
+        '\n'
+        'x: <baz>\n'
+        'baz'
+    )
+    serial = grade_code(src, iospec, lang='python', parallel=False)
+    with ThreadPoolExecutor(2) as executor:
+        parallel = grade_code_parallel(executor, src, iospec,
+                                       compare_streams=False,
+                                       **ejudge_kwargs('python', 5))
+    assert parallel.grade == serial.grade == 0
+    assert parallel.answer_key == serial.answer_key
+
+
+def test_fail_fast_grading_runs_given_order_first():
+    src = "x = input('x: ')\nprint(x if x != 'baz' else 'wrong')"
+    iospec = parse(
+        'x: <foo>\n'
+        'foo\n'
+        '\n'
+        'x: <bar>\n'
+        'bar\n'
+        '\n'
+        'x: <baz>\n'
+        'baz'
+    )
+    outcome = Outcome()
+    feedback = grade_code(src, iospec, lang='python', parallel=False,
+                          fail_fast=True, order=[2, 0, 1], outcome=outcome)
+    assert feedback.grade == 0
+    assert outcome.failed == 2
+    assert outcome.skipped == [0, 1]
+
+
+def test_fail_fast_grading_sends_only_inputs_to_warm_workers(settings):
+    settings.CODESCHOOL_SANDBOX = False
+    src = "x = input('x: ')\nprint(x if x != 'bar' else 'wrong')"
+    iospec = parse('x: <foo>\nfoo\n\nx: <bar>\nbar\n\nx: <baz>\nbaz')
+    jobs = []
+    run = SandboxWorker.run
+
+    def spy(worker, source, inputs, *args):
+        jobs.append(inputs)
+        return run(worker, source, inputs, *args)
+
+    outcome = Outcome()
+    with mock.patch.object(SandboxWorker, 'run', spy):
+        feedback = grade_code(src, iospec, lang='python', parallel=False,
+                              fail_fast=True, outcome=outcome)
+    assert feedback.grade == 0
+    assert jobs == [[['foo']], [['bar']]]
+    assert outcome.skipped == [2]
+
+
+def test_inconsistent_expansion_error_shows_first_different_case():
+    iospec1 = parse('x: <1>\n1\n\nx: <2>\n2')
+    iospec2 = parse('x: <1>\n1\n\nx: <2>\n3')
+    error = inconsistent_expansion_error('python', iospec1, 'c', iospec2)
+    assert error.code == 'inconsistent_expansion'
+    assert error.params['index'] == 2
+    assert error.params['lang1'] == 'python'
+    assert error.params['lang2'] == 'c'
+    assert '3' in error.params['case2']
+
+
+def test_build_cache_key_depends_on_source_and_language():
+    key = build_cache.artifact_key('int main() {}', 'c')
+    assert key == build_cache.artifact_key('int main() {}', 'gcc')
+    assert key != build_cache.artifact_key('int main() {}', 'cpp')
+    assert key != build_cache.artifact_key('int main() { }', 'c')
+
+
+def test_build_cache_evicts_least_recently_used(tmpdir):
+    for mtime, name in enumerate(['old', 'middle', 'new']):
+        tmpdir.join(name).write('x' * 10)
+        os.utime(str(tmpdir.join(name)), (mtime, mtime))
+    build_cache._evict(str(tmpdir), 20)
+    assert sorted(os.listdir(str(tmpdir))) == ['middle', 'new']
+
+
+def test_resource_usage_json_roundtrip():
+    data = usage.ResourceUsage()
+    data.add_case(0.5, 0.25, 1000)
+    data.add_case(0.25, 0.125, 2000)
+    assert data.to_json() == [[500, 250, 1000], [250, 125, 2000]]
+    assert data.wall_time == 0.75
+    assert data.peak_rss == 2000
+    assert usage.ResourceUsage.from_json(data.to_json()).cases == data.cases
+
+
+def test_resource_usage_keeps_unmeasured_values_as_none():
+    data = usage.ResourceUsage()
+    data.add_case(0.5, 0.25, 1000)
+    data.add_case(0.25, None, None)
+    assert data.to_json() == [[500, 250, 1000], [250, None, None]]
+    assert data.cpu_time is None
+    assert data.peak_rss is None
+    assert usage.ResourceUsage.from_json(data.to_json()).cases == data.cases
+
+    total = usage.ResourceUsage()
+    with usage.measure(total.add_total):
+        pass
+    assert total.wall_time >= 0
+    assert total.cpu_time is None and total.peak_rss is None
+
+
+def test_slowest_test_cases_are_sorted_by_average_wall_time():
+    cases = usage.slowest_test_cases([[[10, 5, 100], [30, 20, 200]],
+                                      [[10, 5, 300]]])
+    assert [case['index'] for case in cases] == [1, 0]
+    assert cases[1]['runs'] == 2
+    assert cases[1]['peak_rss'] == 300
+
+
+def test_slowest_test_cases_ignore_unmeasured_values():
+    cases = usage.slowest_test_cases([[[10, None, None]], [[30, 20, None]]])
+    assert cases[0]['avg_wall_time'] == 0.02
+    assert cases[0]['avg_cpu_time'] == 0.02
+    assert cases[0]['peak_rss'] is None
+
+
+def test_usage_statistics_view_clamps_limit():
+    request = RequestFactory().get('/', {'limit': '-5'})
+    request.user = mock.Mock(is_active=True, is_staff=True)
+    with mock.patch.object(usage, 'question_statistics',
+                           return_value=[]) as statistics:
+        response = usage_statistics_view(request)
+    statistics.assert_called_once_with(1)
+    assert json.loads(response.content.decode('utf8')) == {'questions': []}
+
+
+def test_case_timeouts_scale_reference_timings():
+    tests = parse('x: <1>\n1\n\nx: <2>\n2\n\nx: <3>\n3')
+    tests.set_meta('timings', {'python': [0.01, 1.0, 60.0]})
+    assert case_timeouts(tests, 'python') == [0.5, 5.0, 10.0]
+    assert case_timeouts(tests, 'c') is None
+
+
+def test_case_timeouts_never_exceed_question_timeout():
+    tests = parse('x: <1>\n1\n\nx: <2>\n2')
+    tests.set_meta('timings', {'python': [0.01, 1.0]})
+    assert case_timeouts(tests, 'python', 2.0) == [0.5, 2.0]
+    assert case_timeouts(tests, 'python', 0.25) == [0.25, 0.25]
+
+
+def test_grading_queue_slots_respect_concurrency_limit():
+    cache.delete_many([grading_queue._key('running'),
+                       grading_queue._key('pending')])
+    limit = grading_queue.concurrency_limit()
+    assert all(grading_queue.acquire_slot() for _ in range(limit))
+    assert not grading_queue.acquire_slot()
+    assert grading_queue.acquire_slot(force=True)
+    for _ in range(limit + 1):
+        grading_queue.release_slot()
+    assert grading_queue.metrics()['running'] == 0
+
+
+def test_feedback_key_depends_on_case_timeouts():
+    args = ('hash', 'python', 'state', True, 1.0)
+    key = feedback_cache.feedback_key(*args)
+    assert key == feedback_cache.feedback_key(*args, timeouts=None)
+    assert key != feedback_cache.feedback_key(*args, timeouts=[0.5, 1.0])
+    assert feedback_cache.feedback_key(*args, timeouts=[0.5, 1.0]) != \
+        feedback_cache.feedback_key(*args, timeouts=[0.5, 0.75])
+
+
+def test_feedback_key_depends_on_fail_fast_mode():
+    args = ('hash', 'python', 'state', True, 1.0)
+    assert feedback_cache.feedback_key(*args) != \
+        feedback_cache.feedback_key(*args, fail_fast=True)
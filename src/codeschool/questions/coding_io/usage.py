@@ -0,0 +1,199 @@
+"""
+Resource accounting for grading runs.
+
+Grading functions accept an optional :class:`ResourceUsage` object that
+collects wall time, CPU time and peak resident set size (RSS) of each test
+case. Warm workers (see :mod:`codeschool.questions.coding_io.sandbox_worker`)
+run each test case in its own child process and measure it with os.wait4().
+
+Programs executed directly by ejudge run in child processes that we cannot
+measure individually: the resource usage of child processes is shared by all
+threads of the grading process and ru_maxrss is a high water mark of all
+children. Those runs only register their wall time and store None (NULL) as
+their CPU time and peak RSS.
+"""
+import time
+from contextlib import contextmanager
+
+#: CodingIoFeedback fields that store resource usage.
+FEEDBACK_FIELDS = ('wall_time', 'cpu_time', 'peak_rss', 'usage_json')
+
+
+class ResourceUsage:
+    """
+    Collects the resource usage of each test case of a grading run.
+
+    If the usage of individual test cases is not known, totals can be
+    registered with :meth:`add_total`. Values that were not measured are
+    None.
+    """
+
+    def __init__(self):
+        self.cases = []
+        self._totals = None
+
+    def __len__(self):
+        return len(self.cases)
+
+    def add_case(self, wall, cpu, rss):
+        """
+        Register the wall time, CPU time (in seconds) and peak RSS (in kB) of
+        a test case.
+        """
+
+        self.cases.append((wall, cpu, rss))
+
+    def add_total(self, wall, cpu=None, rss=None):
+        """
+        Register totals for a run whose test cases were not measured
+        individually.
+
+        Totals of successive runs are accumulated.
+        """
+
+        if self._totals:
+            wall += self._totals[0]
+            cpu = _sum([cpu, self._totals[1]])
+            rss = _max([rss, self._totals[2]])
+        self._totals = (wall, cpu, rss)
+
+    @property
+    def wall_time(self):
+        if self._totals:
+            return self._totals[0]
+        return sum(case[0] for case in self.cases)
+
+    @property
+    def cpu_time(self):
+        if self._totals:
+            return self._totals[1]
+        return _sum(case[1] for case in self.cases)
+
+    @property
+    def peak_rss(self):
+        if self._totals:
+            return self._totals[2]
+        return _max(case[2] for case in self.cases)
+
+    def to_json(self):
+        """
+        Compact JSON representation: a list of [wall_ms, cpu_ms, rss_kb]
+        triples for each test case.
+        """
+
+        return [[int(wall * 1000), None if cpu is None else int(cpu * 1000),
+                 None if rss is None else int(rss)]
+                for wall, cpu, rss in self.cases]
+
+    @classmethod
+    def from_json(cls, data):
+        usage = cls()
+        for wall, cpu, rss in data or ():
+            usage.add_case(wall / 1000, None if cpu is None else cpu / 1000,
+                           rss)
+        return usage
+
+
+def _sum(values):
+    # Sum of values or None if some value is unknown.
+    values = list(values)
+    return None if None in values else sum(values)
+
+
+def _max(values):
+    # Maximum of values or None if some value is unknown.
+    values = list(values)
+    return None if None in values else max(values, default=0)
+
+
+@contextmanager
+def measure(callback):
+    """
+    Context manager that calls callback(wall, None, None) with the wall time
+    spent inside the block.
+    """
+
+    start = time.perf_counter()
+    yield
+    callback(time.perf_counter() - start, None, None)
+
+
+#
+# Statistics
+#
+def question_statistics(limit=20, sample_size=200):
+    """
+    Return a list with the questions that spent most CPU time in grading.
+
+    Each item is a dictionary with the question id and title, the number of
+    measured feedbacks, total and average times, peak RSS and a list with
+    the slowest test cases. Test case statistics are computed from the
+    sample_size most recent feedbacks of each question.
+    """
+
+    from codeschool.models import Avg, Count, Max, Sum, Page
+    from .models import CodingIoFeedback
+
+    rows = CodingIoFeedback.objects\
+        .filter(cpu_time__isnull=False)\
+        .order_by()\
+        .values('submission__progress__activity_page')\
+        .annotate(num_feedbacks=Count('id'),
+                  total_cpu_time=Sum('cpu_time'),
+                  total_wall_time=Sum('wall_time'),
+                  avg_cpu_time=Avg('cpu_time'),
+                  avg_wall_time=Avg('wall_time'),
+                  max_rss=Max('peak_rss'))\
+        .order_by('-total_cpu_time')[:limit]
+
+    result = []
+    for row in rows:
+        question_id = row.pop('submission__progress__activity_page')
+        samples = CodingIoFeedback.objects\
+            .filter(submission__progress__activity_page_id=question_id,
+                    usage_json__isnull=False)\
+            .order_by('-id')\
+            .values_list('usage_json', flat=True)[:sample_size]
+        row['question'] = question_id
+        row['slowest_test_cases'] = slowest_test_cases(samples)
+        result.append(row)
+
+    titles = dict(Page.objects
+                  .filter(id__in=[row['question'] for row in result])
+                  .values_list('id', 'title'))
+    for row in result:
+        row['title'] = titles.get(row['question'])
+    return result
+
+
+def slowest_test_cases(usage_list, limit=5):
+    """
+    Aggregate a sequence of compact usage lists (see
+    :meth:`ResourceUsage.to_json`) by test case index and return the limit
+    test cases with the highest average wall time.
+    """
+
+    totals = {}
+    for data in usage_list:
+        for idx, case in enumerate(data or ()):
+            totals.setdefault(idx, []).append(case)
+
+    cases = [
+        {
+            'index': idx,
+            'runs': len(runs),
+            'avg_wall_time': _average(wall for wall, _, _ in runs),
+            'avg_cpu_time': _average(cpu for _, cpu, _ in runs),
+            'peak_rss': max((rss for _, _, rss in runs if rss is not None),
+                            default=None),
+        }
+        for idx, runs in totals.items()
+    ]
+    cases.sort(key=lambda x: x['avg_wall_time'], reverse=True)
+    return cases[:limit]
+
+
+def _average(values):
+    # Average of the known values in milliseconds converted to seconds.
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) / 1000 if values else None
@@ -33,6 +33,43 @@ def inconsistent_testcase_error(test1, test2, field):
     return ValidationError({public_field: msg})
 
 
+def inconsistent_expansion_error(lang1, expansion1, lang2, expansion2):
+    """
+    Error raised when programs in different languages expand the same tests
+    to different results.
+
+    The error message shows the first test case in which both expansions
+    differ. The index and languages are available in the params attribute of
+    the resulting error.
+    """
+
+    index = 0
+    for index, (case1, case2) in enumerate(zip(expansion1, expansion2)):
+        if case1 != case2:
+            source1, source2 = case1.source(), case2.source()
+            break
+    else:
+        # One expansion has more test cases than the other
+        index = min(len(expansion1), len(expansion2))
+        source1 = expansion1[index].source() if index < len(expansion1) else ''
+        source2 = expansion2[index].source() if index < len(expansion2) else ''
+
+    params = {
+        'lang1': lang1,
+        'lang2': lang2,
+        'index': index + 1,
+        'case1': source1,
+        'case2': source2,
+    }
+    msg = _(
+        '%(lang1)s and %(lang2)s are producing different results in test '
+        'case #%(index)s.\n\n'
+        '%(lang1)s:\n%(case1)s\n\n'
+        '%(lang2)s:\n%(case2)s'
+    )
+    return ValidationError(msg, code='inconsistent_expansion', params=params)
+
+
 def inconsistent_iospec_error(answer_key, ref, obtained):
     for ref, obtained in zip(ref, obtained):
         if ref != obtained:
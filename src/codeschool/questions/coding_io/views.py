@@ -1,3 +1,51 @@
-from django.shortcuts import render
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse, Http404
 
-# Create your views here.
+from . import feedback_cache
+from . import grading_queue
+from . import regrade
+from . import sandbox_pool
+from . import usage
+
+#: Maximum number of questions reported by usage_statistics_view.
+MAX_STATISTICS_LIMIT = 100
+
+
+@staff_member_required
+def grading_metrics_view(request):
+    """
+    Report the grading queue depth, grading latency percentiles, feedback
+    cache counters and the sandbox pools of the current process as JSON.
+    """
+
+    data = grading_queue.metrics()
+    data['feedback_cache'] = feedback_cache.metrics()
+    data['sandbox_pools'] = sandbox_pool.metrics()
+    return JsonResponse(data)
+
+
+@staff_member_required
+def regrade_status_view(request, job_id):
+    """
+    Report the progress and estimated remaining time of a regrade job as JSON.
+    """
+
+    status = regrade.job_status(job_id)
+    if status is None:
+        raise Http404('regrade job not found')
+    return JsonResponse(status)
+
+
+@staff_member_required
+def usage_statistics_view(request):
+    """
+    Report the questions that spent most CPU time in grading and their
+    slowest test cases as JSON.
+    """
+
+    try:
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        limit = 20
+    limit = min(max(limit, 1), MAX_STATISTICS_LIMIT)
+    return JsonResponse({'questions': usage.question_statistics(limit)})
@@ -77,7 +77,17 @@ class Question(models.DecoupledAdminPage,
         submission = self.submit(client.request, **kwargs)
         if submission.recycled:
             client.dialog(html='You already submitted this response!')
-        elif self.instant_autograde:
+        else:
+            self.serve_ajax_feedback(client, submission)
+
+    def serve_ajax_feedback(self, client, submission):
+        """
+        Grade a new submission and send the feedback to the client.
+
+        Subclasses may override this method to defer grading.
+        """
+
+        if self.instant_autograde:
             feedback = submission.auto_feedback()
             data = feedback.render_message()
             client.dialog(html=data)
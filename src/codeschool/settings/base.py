@@ -216,3 +216,8 @@ BROKER_URL = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+CELERY_ROUTES = {
+    'codeschool.questions.coding_io.tasks.grade_submission': {
+        'queue': 'grading',
+    },
+}
@@ -20,3 +20,87 @@ CODESCHOOL_DEBUG_VIEWS = True
 
 #: Enable a global "Questions" page
 CODESCHOOL_GLOBAL_QUESTIONS = True
+
+#: If true, CodingIoQuestion submissions are graded by celery workers listening
+#: on the CODESCHOOL_GRADING_QUEUE queue instead of inside the web worker that
+#: received the request. The browser polls for the feedback.
+CODESCHOOL_ASYNC_GRADING = False
+
+#: Name of the celery queue used for grading submissions.
+CODESCHOOL_GRADING_QUEUE = 'grading'
+
+#: Maximum number of submissions that can be graded simultaneously by all
+#: workers consuming the grading queue.
+CODESCHOOL_GRADING_QUEUE_CONCURRENCY = 4
+
+#: Number of test cases of a single submission that can be graded in parallel.
+#: Values greater than 1 distribute test cases to a pool of grading workers.
+CODESCHOOL_GRADING_WORKERS = 1
+
+#: Share grading results between identical submissions (same source, language,
+#: test cases and timeout) to the same question, even from different users.
+CODESCHOOL_FEEDBACK_CACHE = True
+
+#: Expiration time (in seconds) of shared grading results.
+CODESCHOOL_FEEDBACK_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+#: Expand and validate tests of programming questions in a celery job after
+#: the question is saved. If False, it runs in the request that saved the
+#: question.
+CODESCHOOL_BACKGROUND_VALIDATION = True
+
+#: Maximum time (in seconds) that grading waits for a test state that is being
+#: computed in the background before falling back to the last test state.
+CODESCHOOL_TEST_STATE_WAIT = 2.0
+
+#: Number of distinct programs graded simultaneously by a regrade job.
+CODESCHOOL_REGRADE_WORKERS = 4
+
+#: Time (in seconds) that leaderboards are kept in cache.
+CODESCHOOL_LEADERBOARD_TIMEOUT = 5 * 60
+
+#: Number of attendance check-ins accumulated by each web worker before they
+#: are written to the database.
+CODESCHOOL_CHECKIN_BATCH_SIZE = 50
+
+#: Maximum time (in seconds) that a check-in waits before being written. The
+#: buffer of each web worker is flushed by a timer started by its first
+#: check-in.
+CODESCHOOL_CHECKIN_FLUSH_INTERVAL = 5.0
+
+#: Maximum number of check-in requests per user in a 10 seconds window.
+CODESCHOOL_CHECKIN_RATE_LIMIT = 5
+
+#: Run python and pytuga programs in pools of warm sandboxed interpreters
+#: instead of starting a new interpreter for each submission.
+CODESCHOOL_SANDBOX_POOL = True
+
+#: Number of warm interpreters per language in each process.
+CODESCHOOL_SANDBOX_POOL_SIZE = 4
+
+#: Number of programs executed by a warm interpreter before it is replaced.
+CODESCHOOL_SANDBOX_POOL_MAX_JOBS = 100
+
+#: Keep executables of compiled programs in an on-disk cache shared by all
+#: grading processes of a node.
+CODESCHOOL_BUILD_CACHE = True
+
+#: Directory of the build cache. It must belong to the user that runs
+#: codeschool. The default is a directory in the system temporary folder.
+CODESCHOOL_BUILD_CACHE_DIR = None
+
+#: Maximum size (in bytes) of the build cache. Least recently used
+#: executables are removed first.
+CODESCHOOL_BUILD_CACHE_MAX_SIZE = 512 * 2 ** 20
+
+#: Derive the timeout of each test case from the running time of the answer
+#: keys, measured when the tests of a question are expanded in the background.
+CODESCHOOL_TIMEOUT_CALIBRATION = True
+
+#: Ratio between the timeout of a test case and its reference running time.
+CODESCHOOL_TIMEOUT_FACTOR = 5.0
+
+#: Minimum and maximum values (in seconds) of calibrated timeouts. Calibrated
+#: timeouts never exceed the timeout of the question.
+CODESCHOOL_TIMEOUT_MIN = 0.5
+CODESCHOOL_TIMEOUT_MAX = 10.0
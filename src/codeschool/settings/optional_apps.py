@@ -0,0 +1,24 @@
+"""
+Settings that enable all optional apps.
+
+Used to run the tests of the optional apps, which are skipped with the
+default settings. Optional apps do not ship migrations, so they must be
+created before running the tests:
+
+    python manage.py makemigrations friends courses attendance gamification \
+        --settings=codeschool.settings.optional_apps
+    py.test src/codeschool --ds=codeschool.settings.optional_apps
+"""
+from codeschool.settings import *  # noqa
+from codeschool.settings import INSTALLED_APPS
+
+OPTIONAL_APPS = [
+    'codeschool.social',
+    'codeschool.social.friends',
+    'codeschool.lms.courses',
+    'codeschool.lms.attendance',
+    'codeschool.gamification',
+]
+INSTALLED_APPS = OPTIONAL_APPS + [
+    app for app in INSTALLED_APPS if app not in OPTIONAL_APPS
+]
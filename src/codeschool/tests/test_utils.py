@@ -0,0 +1,26 @@
+from codeschool.utils import LRUCache, iter_csv
+
+
+def test_lru_cache_discards_least_recently_used_item():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_lru_cache_get_default():
+    cache = LRUCache()
+    assert cache.get('missing') is None
+    assert cache.get('missing', 42) == 42
+
+
+def test_iter_csv_renders_header_and_rows_lazily():
+    rows = iter([('foo', 1), ('bar', 2)])
+    lines = iter_csv(rows, header=('name', 'value'))
+    assert next(lines) == 'name,value\r\n'
+    assert list(lines) == ['foo,1\r\n', 'bar,2\r\n']
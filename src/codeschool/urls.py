@@ -15,10 +15,10 @@ Including another URLconf
 """
 import os
 
+from django.conf import settings
 from django.conf.urls import url, include
 from wagtail.wagtailcore import urls as wagtail_urls
 
-from codeschool import settings
 from codeschool.accounts.views import profile_view
 from codeschool.core.views import index_view
 
@@ -61,6 +61,27 @@ if 'codeschool.lms.courses' in settings.INSTALLED_APPS:
         url(r'^courses/$', course_list, name='course-list'),
     ]
 
+# Attendance sheets
+if 'codeschool.lms.attendance' in settings.INSTALLED_APPS:
+    urlpatterns += [
+        url(r'^attendance/', include('codeschool.lms.attendance.urls',
+                                     namespace='attendance')),
+    ]
+
+# Grading queue metrics
+if 'codeschool.questions.coding_io' in settings.INSTALLED_APPS:
+    from codeschool.questions.coding_io.views import grading_metrics_view, \
+        regrade_status_view, usage_statistics_view
+
+    urlpatterns += [
+        url(r'^_grading/metrics/$', grading_metrics_view,
+            name='grading-metrics'),
+        url(r'^_grading/regrade/(?P<job_id>[0-9a-f]+)/$', regrade_status_view,
+            name='regrade-status'),
+        url(r'^_grading/usage/$', usage_statistics_view,
+            name='grading-usage'),
+    ]
+
 # Optional cli/clt interface
 if 'codeschool.cli' in settings.INSTALLED_APPS:
     from codeschool.cli import api as jsonrpc_api
@@ -1,4 +1,7 @@
+import csv
 import hashlib
+import threading
+from collections import OrderedDict
 from functools import lru_cache
 
 from django.db.models import QuerySet, Model, Manager
@@ -148,9 +151,107 @@ def md5hash_seq(seq):
     return md5hash(''.join(hashes))
 
 
+class LRUCache:
+    """
+    A thread-safe mapping that holds at most maxsize items.
+
+    When full, the least recently used item is discarded.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        Return value associated with key and mark it as recently used.
+        """
+
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        """
+        Associate value with key, discarding the least recently used item if
+        the cache is full.
+        """
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        """
+        Remove key from cache, if present.
+        """
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all items from cache.
+        """
+
+        with self._lock:
+            self._data.clear()
+
+
 def get_ip(request):
     """
     Return the best possible inference for the user's ip adress from a request.
     """
 
     return get_real_ip(request) or _get_ip(request) or ''
+
+
+class _Echo:
+    """
+    File-like object that returns the written value instead of storing it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, header=None, dialect='excel'):
+    """
+    Iterate over CSV lines created from the given sequence of rows.
+
+    Rows are consumed lazily, hence this function can be used to render
+    arbitrarily large tables using a constant amount of memory.
+    """
+
+    writer = csv.writer(_Echo(), dialect=dialect)
+    if header is not None:
+        yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def streaming_csv_response(rows, filename=None, header=None, dialect='excel'):
+    """
+    Return a StreamingHttpResponse that renders the given rows as CSV.
+    """
+
+    from django.http import StreamingHttpResponse
+
+    response = StreamingHttpResponse(iter_csv(rows, header, dialect),
+                                     content_type='text/csv')
+    if filename:
+        response['Content-Disposition'] = \
+            'attachment; filename="%s"' % filename
+    return response